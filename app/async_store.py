@@ -0,0 +1,66 @@
+"""
+Cooperative access to the Wishlist model
+
+Python 2 has no asyncio, so this store gets its concurrency from gevent
+greenlets instead. Once gevent has monkey patched the standard library,
+the sockets used by the Cloudant client and the sleeps between retries
+yield to other greenlets instead of blocking the process. A single worker
+can then keep thousands of requests waiting on Cloudant.
+
+Every store method starts the model call in a greenlet taken from a
+bounded pool and returns that greenlet at once. Call get() on it, or pass
+several to gather(), to wait for the results. The REST API does not use
+the store: under gevent each request already runs in its own greenlet.
+"""
+
+import gevent
+from gevent.pool import Pool
+from app.models import Wishlist
+
+# most greenlets a store runs at the same time, None for no limit
+POOL_SIZE = 1000
+
+class AsyncWishlistStore(object):
+    """ Runs Wishlist model calls in greenlets """
+
+    def __init__(self, size=POOL_SIZE, model=Wishlist):
+        """ Constructor """
+        self.pool = Pool(size)
+        self.model = model
+
+    def spawn(self, func, *args, **kwargs):
+        """ Runs a function in a pooled greenlet and returns the greenlet """
+        return self.pool.spawn(func, *args, **kwargs)
+
+    def find(self, wishlist_id):
+        """ Finds a Wishlist by its ID """
+        return self.spawn(self.model.find, wishlist_id)
+
+    def find_by(self, **kwargs):
+        """ Finds the Wishlists that match the given fields """
+        return self.spawn(self.model.find_by, **kwargs)
+
+    def all(self):
+        """ Returns all of the Wishlists in the database """
+        return self.spawn(self.model.all)
+
+    def save(self, wishlist):
+        """ Saves a Wishlist and resolves to it once it has an id """
+        def _save():
+            wishlist.save()
+            return wishlist
+        return self.spawn(_save)
+
+    def delete(self, wishlist):
+        """ Deletes a Wishlist from the database """
+        return self.spawn(wishlist.delete)
+
+    def join(self, timeout=None):
+        """ Waits for every running greenlet to finish """
+        return self.pool.join(timeout=timeout)
+
+    @staticmethod
+    def gather(*greenlets):
+        """ Waits for the greenlets and returns their values in order """
+        gevent.joinall(greenlets, raise_error=True)
+        return [greenlet.value for greenlet in greenlets]
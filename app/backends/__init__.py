@@ -0,0 +1,28 @@
+"""
+Storage backends for the Wishlist model
+
+The backend is picked by name, normally from the WISHLIST_BACKEND
+environment variable:
+
+    cloudant    Cloudant or CouchDB (the default)
+    memory      indexed dicts in process memory
+    sqlite      a local SQLite file in SQLITE_DIR
+"""
+
+from app.backends.base import Backend
+from app.backends.cloudant_backend import CloudantBackend
+from app.backends.memory_backend import MemoryBackend
+from app.backends.sqlite_backend import SQLiteBackend
+
+BACKENDS = {
+    'cloudant': CloudantBackend,
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend,
+}
+
+def get_backend(name):
+    """ Returns a new backend of the named kind """
+    if name not in BACKENDS:
+        raise AssertionError('Storage backend [{}] is not one of {}'.format(
+            name, ', '.join(sorted(BACKENDS))))
+    return BACKENDS[name]()
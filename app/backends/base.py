@@ -0,0 +1,186 @@
+"""
+Storage backend interface
+
+The Wishlist model keeps validation, caching and paging to itself and hands
+every read and write of a stored document to a backend. Documents are plain
+dicts with an _id and a _rev like CouchDB documents, so a backend only has
+to store, index and return them.
+"""
+
+import json
+import uuid
+import base64
+from app import models
+
+# comparison operators a selector value can use
+OPERATORS = {
+    '$eq': lambda value, arg: value == arg,
+    '$ne': lambda value, arg: value != arg,
+    '$gt': lambda value, arg: value > arg,
+    '$gte': lambda value, arg: value >= arg,
+    '$lt': lambda value, arg: value < arg,
+    '$lte': lambda value, arg: value <= arg,
+    '$in': lambda value, arg: value in arg,
+}
+
+def matches(doc, selector):
+    """ Returns True if the document matches every field of the selector """
+    for field, condition in selector.items():
+        if field not in doc:
+            return False
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for operator, arg in condition.items():
+            if operator not in OPERATORS:
+                raise models.DataValidationError('Invalid query: unknown operator '
+                                                 + operator)
+            if not OPERATORS[operator](doc[field], arg):
+                return False
+    return True
+
+def make_bookmark(doc, sort_keys):
+    """ Returns a bookmark for the page that starts after a document """
+    key = [doc.get(name) for name in sort_keys] + [doc['_id']]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')))
+
+def parse_bookmark(bookmark, sort_keys):
+    """ Returns the sort key values and _id of the document a page starts after """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(str(bookmark)))
+    except (TypeError, ValueError):
+        key = None
+    if not isinstance(key, list) or len(key) != len(sort_keys) + 1:
+        raise models.DataValidationError('Invalid cursor: it was not returned by this query')
+    return key
+
+def sort_page(docs, sort_keys, direction='asc', limit=None, bookmark=None, skip=None):
+    """
+    Returns a page of documents held in memory and the bookmark of the next
+    page, for backends that match and sort in Python
+    """
+    sort_keys = list(sort_keys or [])
+    for key in sort_keys:
+        # like Cloudant, a sorted field has to be present
+        docs = [doc for doc in docs if doc.get(key) is not None]
+    sort_key = lambda doc: tuple(doc.get(key) for key in sort_keys + ['_id'])
+    descending = direction == 'desc'
+    docs = sorted(docs, key=sort_key, reverse=descending)
+    if bookmark:
+        last = tuple(parse_bookmark(bookmark, sort_keys))
+        if descending:
+            docs = [doc for doc in docs if sort_key(doc) < last]
+        else:
+            docs = [doc for doc in docs if sort_key(doc) > last]
+    elif skip:
+        docs = docs[skip:]
+    page = docs[:limit] if limit else docs
+    next_bookmark = None
+    if limit and len(page) == limit:
+        next_bookmark = make_bookmark(page[-1], sort_keys)
+    return page, next_bookmark
+
+def next_rev(rev):
+    """ Returns the revision that follows rev in CouchDB's N-hash form """
+    number = int(rev.split('-', 1)[0]) if rev else 0
+    return '{}-{}'.format(number + 1, uuid.uuid4().hex)
+
+class Backend(object):
+    """ Interface that every Wishlist storage backend implements """
+
+    # other processes can write the same data, so a cache needs a follower
+    shared = True
+
+    def connect(self, dbname):
+        """ Opens the named database, creating it if it does not exist """
+        raise NotImplementedError
+
+    def disconnect(self):
+        """ Closes the connection to the database """
+        pass
+
+    def reconnect(self):
+        """ Opens the connection again after a disconnect """
+        pass
+
+    def create_indexes(self):
+        """ Creates the declared query indexes that do not exist yet """
+        pass
+
+    def create_query_index(self, field_name, order='asc'):
+        """ Creates a query index on a single field """
+        pass
+
+    def create_views(self):
+        """ Installs the precomputed views that counts are read from """
+        pass
+
+    def get(self, doc_id):
+        """ Returns the document with the id or None """
+        raise NotImplementedError
+
+    def get_many(self, doc_ids):
+        """ Returns the document of each id in the same order, with None if missing """
+        return [self.get(doc_id) for doc_id in doc_ids]
+
+    def revision(self, doc_id):
+        """ Returns the current revision of a document or None """
+        raise NotImplementedError
+
+    def create(self, doc):
+        """ Stores a new document and returns it with its _id and _rev set """
+        raise NotImplementedError
+
+    def update(self, doc):
+        """
+        Writes a document over the revision in its _rev and returns the new
+        revision. Raises DataConflictError when that revision is not current.
+        """
+        raise NotImplementedError
+
+    def delete(self, doc_id):
+        """ Deletes a document if it exists """
+        raise NotImplementedError
+
+    def bulk_save(self, docs):
+        """
+        Stores several documents at once and returns a row for each one with
+        either its id and rev or the error that kept it from being stored
+        """
+        raise NotImplementedError
+
+    def bulk_delete(self, docs):
+        """ Deletes documents given by _id and _rev and returns the count """
+        raise NotImplementedError
+
+    def page_all(self, limit, startkey=None, include_docs=True):
+        """
+        Returns up to limit documents in id order starting at startkey and
+        the key the next page starts at, or None after the last page.
+        Without include_docs only the _id and _rev of each one are returned.
+        """
+        raise NotImplementedError
+
+    def find(self, selector, fields=None, sort_keys=None, direction='asc',
+             limit=None, bookmark=None, skip=None):
+        """
+        Returns the documents that match a selector and the bookmark of the
+        next page, or None after the last page. fields and sort_keys are
+        document keys and skip only applies without a bookmark.
+
+        Like a CouchDB bookmark, the bookmark holds the sort key of the last
+        document rather than an offset, so documents written or deleted
+        between pages do not shift the next page.
+        """
+        raise NotImplementedError
+
+    def count(self, customer_id=None):
+        """ Returns the number of documents, or only those of a customer_id """
+        raise NotImplementedError
+
+    def customer_counts(self):
+        """ Returns a dict with the number of documents of every customer_id """
+        raise NotImplementedError
+
+    def changes_follower(self, cache, since='now', since_file=None):
+        """ Returns a follower that keeps the cache in step with other writers """
+        return None
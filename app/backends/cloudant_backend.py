@@ -0,0 +1,422 @@
+"""
+Cloudant / CouchDB storage backend
+
+This backend looks for an environment variable called BINDING_CLOUDANT to
+get its database credentials from. If it cannot find one, it connects to
+CouchDB on CLOUDANT_HOST using CLOUDANT_USERNAME and CLOUDANT_PASSWORD.
+
+Lists are read from _all_docs and queries run through Cloudant Query on
+the indexes declared in QUERY_INDEXES. Counts are read from the _count
+reduce view in the STATS_DDOC design document, which CouchDB keeps up to
+date as documents change.
+"""
+
+import os
+import json
+import logging
+from collections import OrderedDict
+from cloudant.client import Cloudant
+from cloudant.document import Document
+from cloudant.query import Query
+from requests import HTTPError, ConnectionError
+from requests.adapters import HTTPAdapter
+from app import models
+from app.backends.base import Backend, matches, sort_page
+from app.changes import ChangesFollower
+from app.resilience import retrying
+
+# design document with the views counts are read from; raise the version
+# whenever a view changes so init_db installs the new one
+STATS_DDOC = '_design/wishlist-stats'
+STATS_VERSION = 1
+STATS_VIEWS = {
+    'by_customer': {
+        'map': 'function (doc) { if (doc.name !== undefined) { '
+               'emit(doc.customer_id === undefined ? null : doc.customer_id, null); } }',
+        'reduce': '_count',
+    },
+}
+
+# operators a Mango JSON index can turn into a key range; others such as
+# $in or $ne make CouchDB scan the whole index
+RANGE_OPERATORS = set(['$eq', '$gt', '$gte', '$lt', '$lte'])
+
+class CloudantBackend(Backend):
+    """ Stores Wishlists in Cloudant or CouchDB """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self):
+        """ Constructor """
+        self.client = None   # cloudant.client.Cloudant
+        self.database = None # cloudant.database.CloudantDatabase
+
+    def connect(self, dbname):
+        """ Connects to Cloudant and makes sure the database is ready """
+        opts = {}
+        vcap_services = {}
+        # Try and get VCAP from the environment or a file if developing
+        #if 'VCAP_SERVICES' in os.environ:
+        #    self.logger.info('Running in Bluemix mode.')
+        #    vcap_services = json.loads(os.environ['VCAP_SERVICES'])
+        # if VCAP_SERVICES isn't found, maybe we are running on Kubernetes?
+        if 'BINDING_CLOUDANT' in os.environ:
+            self.logger.info('Found Kubernetes Bindings')
+            creds = json.loads(os.environ['BINDING_CLOUDANT'])
+            vcap_services = {"cloudantNoSQLDB": [{"credentials": creds}]}
+        else:
+            self.logger.info('VCAP_SERVICES and BINDING_CLOUDANT undefined.')
+            creds = {
+                "username": models.CLOUDANT_USERNAME,
+                "password": models.CLOUDANT_PASSWORD,
+                "host": models.CLOUDANT_HOST,
+                "port": 5984,
+                "url": "http://"+models.CLOUDANT_HOST+":5984/"
+            }
+            vcap_services = {"cloudantNoSQLDB": [{"credentials": creds}]}
+
+        # Look for Cloudant in VCAP_SERVICES
+        for service in vcap_services:
+            if service.startswith('cloudantNoSQLDB'):
+                cloudant_service = vcap_services[service][0]
+                opts['username'] = cloudant_service['credentials']['username']
+                opts['password'] = cloudant_service['credentials']['password']
+                opts['host'] = cloudant_service['credentials']['host']
+                opts['port'] = cloudant_service['credentials']['port']
+                opts['url'] = cloudant_service['credentials']['url']
+
+        if any(k not in opts for k in ('host', 'username', 'password', 'port', 'url')):
+            self.logger.info('Error - Failed to retrieve options. ' \
+                             'Check that app is bound to a Cloudant service.')
+            exit(-1)
+
+        self.logger.info('Cloudant Endpoint: %s', opts['url'])
+        try:
+            if models.ADMIN_PARTY:
+                self.logger.info('Running in Admin Party Mode...')
+            self.client = Cloudant(opts['username'],
+                                   opts['password'],
+                                   url=opts['url'],
+                                   connect=True,
+                                   auto_renew=True,
+                                   admin_party=models.ADMIN_PARTY,
+                                   timeout=models.CLOUDANT_TIMEOUT,
+                                   adapter=HTTPAdapter(pool_connections=1,
+                                                       pool_maxsize=self.pool_size(),
+                                                       pool_block=True)
+                                  )
+        except ConnectionError:
+            raise AssertionError('Cloudant service could not be reached')
+
+        # Create database if it doesn't exist
+        try:
+            self.database = self.client[dbname]
+        except KeyError:
+            # Create a database using an initialized client
+            self.database = self.client.create_database(dbname)
+        # check for success
+        if not self.database.exists():
+            raise AssertionError('Database [{}] could not be obtained'.format(dbname))
+
+    @staticmethod
+    def pool_size():
+        """ Returns how many connections to pool, one per thread and one for the feed """
+        # the continuous _changes request holds its connection for good, and
+        # with pool_block a thread left without one would wait forever
+        return models.CLOUDANT_POOL_SIZE + (1 if models.CHANGES_FOLLOWER else 0)
+
+    def disconnect(self):
+        """ Disconnect from the server """
+        if self.client:
+            self.client.disconnect()
+
+    def reconnect(self):
+        """ Connect to the server again """
+        self.client.connect()
+
+######################################################################
+#  I N D E X E S
+######################################################################
+
+    def create_indexes(self):
+        """ Creates the declared query indexes that do not exist yet """
+        response = self.database.get_query_indexes(raw_result=True)
+        existing = set(index['ddoc'] for index in response.get('indexes', []))
+        for fields in models.QUERY_INDEXES:
+            ddoc = self.index_name(fields)
+            if ddoc in existing:
+                continue
+            self.logger.info('Creating query index %s', ddoc)
+            self.database.create_query_index(design_document_id=ddoc,
+                                             index_name='-'.join(fields),
+                                             fields=fields)
+
+    def create_query_index(self, field_name, order='asc'):
+        """ Creates a new query index for searching """
+        self.database.create_query_index(index_name=field_name, fields=[{field_name: order}])
+
+    def create_views(self):
+        """ Installs the stats design document unless it is already current """
+        document = Document(self.database, STATS_DDOC)
+        if document.exists():
+            document.fetch()
+            if document.get('version') == STATS_VERSION:
+                return
+        self.logger.info('Installing %s version %s', STATS_DDOC, STATS_VERSION)
+        document['language'] = 'javascript'
+        document['version'] = STATS_VERSION
+        document['views'] = STATS_VIEWS
+        try:
+            document.save()
+        except HTTPError as err:
+            # another worker installed it at the same time
+            if err.response is None or err.response.status_code != 409:
+                raise
+
+    @staticmethod
+    def index_name(fields):
+        """ Returns the design document id of the index on the fields """
+        return '_design/wishlists-' + '-'.join(fields)
+
+    def index_for(self, selector, sort_keys=None):
+        """ Returns the declared index that best covers the selector fields """
+        fields = self._index_fields(selector, sort_keys or [])
+        if fields is None:
+            return None
+        return self.index_name(fields)
+
+    @staticmethod
+    def _index_fields(selector, sort_keys):
+        """ Returns the fields of the declared index that best covers a query """
+        queried = set(field for field, condition in selector.items()
+                      if not isinstance(condition, dict) or set(condition) <= RANGE_OPERATORS)
+        best = None
+        for fields in models.QUERY_INDEXES:
+            if not set(fields) <= queried:
+                continue
+            if sort_keys:
+                # sorted fields must end the index and the ones before them
+                # must be matched exactly so they do not change the order
+                prefix = fields[:len(fields) - len(sort_keys)]
+                if fields[len(prefix):] != sort_keys:
+                    continue
+                if any(isinstance(selector[field], dict) for field in prefix):
+                    continue
+            if best is None or len(fields) > len(best):
+                best = fields
+        return best
+
+######################################################################
+#  D O C U M E N T S
+######################################################################
+
+    def get(self, doc_id):
+        """ Returns the document with the id or None """
+        document = self.fetch_document(doc_id)
+        if document is None:
+            return None
+        return dict(document)
+
+    def get_many(self, doc_ids):
+        """ Reads several documents with one POST to _all_docs with their keys """
+        if not doc_ids:
+            return []
+        rows = self._all_docs(keys=list(doc_ids), include_docs=True).get('rows', [])
+        # missing ids come back with an error and deleted ones without a doc,
+        # and design documents hold indexes, not Wishlists
+        found = dict((row['key'], row['doc']) for row in rows
+                     if row.get('doc') and not row['key'].startswith('_design/'))
+        return [found.get(doc_id) for doc_id in doc_ids]
+
+    def fetch_document(self, doc_id):
+        """ Reads a document by id without keeping it in the database object """
+        document = Document(self.database, doc_id)
+        try:
+            document.fetch()
+        except HTTPError as err:
+            if err.response is not None and err.response.status_code == 404:
+                return None
+            raise
+        return document
+
+    def revision(self, doc_id):
+        """ Returns the current revision of a document using a HEAD request """
+        document = Document(self.database, doc_id)
+        resp = self.client.r_session.head(document.document_url)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.headers.get('ETag', '').strip('"') or None
+
+    def create(self, doc):
+        """ Stores a new document and returns it with its _id and _rev set """
+        document = self.database.create_document(doc)
+        # the database object keeps every document it creates, so let it go
+        self.database.pop(document['_id'], None)
+        if not document.exists():
+            return None
+        return dict(document)
+
+    def update(self, doc):
+        """
+        Writes a document with a single PUT against the revision in its _rev,
+        so a write made in between is not overwritten
+        """
+        document = Document(self.database, doc['_id'])
+        document.update(doc)
+        resp = self.client.r_session.put(document.document_url, data=document.json(),
+                                         headers={'Content-Type': 'application/json'})
+        if resp.status_code in (404, 409):
+            raise models.DataConflictError(doc['_id'])
+        resp.raise_for_status()
+        return resp.json()['rev']
+
+    def delete(self, doc_id):
+        """ Deletes a document if it exists """
+        document = self.fetch_document(doc_id)
+        if document:
+            document.delete()
+
+    @retrying('bulk_save')
+    def bulk_save(self, docs):
+        """ Writes documents with a single _bulk_docs request """
+        if not docs:
+            return []
+        return self.database.bulk_docs(docs)
+
+    @retrying('bulk_delete')
+    def bulk_delete(self, docs):
+        """ Deletes documents by _id and _rev with a single _bulk_docs request """
+        if not docs:
+            return 0
+        deleted = [{'_id': doc['_id'], '_rev': doc['_rev'], '_deleted': True}
+                   for doc in docs]
+        rows = self.database.bulk_docs(deleted)
+        return len([row for row in rows if 'error' not in row])
+
+    def page_all(self, limit, startkey=None, include_docs=True):
+        """ Reads a page of documents from _all_docs keyed by document id """
+        docs = []
+        while True:
+            # ask for one extra row to find where the next page starts
+            params = {'include_docs': include_docs, 'limit': limit - len(docs) + 1}
+            if startkey:
+                params['startkey'] = startkey
+            rows = self._all_docs(**params).get('rows', [])
+            more = len(rows) == params['limit']
+            startkey = rows.pop()['id'] if more else None
+            for row in rows:
+                # design documents hold indexes, not Wishlists
+                if row['id'].startswith('_design/'):
+                    continue
+                if include_docs:
+                    docs.append(row['doc'])
+                else:
+                    docs.append({'_id': row['id'], '_rev': row['value']['rev']})
+            if not more or len(docs) == limit:
+                return docs, startkey
+
+    @retrying('all_docs')
+    def _all_docs(self, **kwargs):
+        """ Reads rows from _all_docs """
+        return self.database.all_docs(**kwargs)
+
+    @retrying('query')
+    def find(self, selector, fields=None, sort_keys=None, direction='asc',
+             limit=None, bookmark=None, skip=None):
+        """ Runs a query on its declared index and returns a page of documents """
+        customers = selector.get('customer_id')
+        if isinstance(customers, dict) and '$in' in customers:
+            return self._find_by_customers(selector, fields, sort_keys, direction, limit,
+                                           bookmark, skip)
+        selector = dict(selector)
+        sort_keys = list(sort_keys or [])
+        for key in sort_keys:
+            # a sorted field has to be in the selector for its index to be used
+            selector.setdefault(key, {'$gt': None})
+        if not selector:
+            selector['_id'] = {'$gt': None}
+        params = {}
+        index_fields = self._index_fields(selector, sort_keys)
+        if index_fields:
+            params['use_index'] = self.index_name(index_fields)
+            sort_keys = index_fields if sort_keys else []
+        elif set(selector) == set(['_id']):
+            pass    # answered from the primary index
+        elif models.STRICT_INDEXES:
+            raise models.QueryIndexError('No index for query {}'.format(selector))
+        else:
+            self.logger.warning('No index for query %s, using a full scan', selector)
+        if sort_keys:
+            params['sort'] = [{key: direction} for key in sort_keys]
+        if fields:
+            params['fields'] = fields
+        if limit:
+            params['limit'] = limit
+        if bookmark:
+            params['bookmark'] = bookmark
+        elif skip:
+            params['skip'] = skip
+        try:
+            response = Query(self.database, selector=selector)(**params)
+        except HTTPError as err:
+            # Cloudant rejects a bookmark it did not hand out with a 400
+            if bookmark and err.response is not None and err.response.status_code == 400:
+                raise models.DataValidationError('Invalid cursor: ' + str(bookmark))
+            raise
+        if 'warning' in response:
+            self.logger.warning('Query %s: %s', selector, response['warning'])
+        docs = response.get('docs', [])
+        next_bookmark = None
+        if limit and len(docs) == limit:
+            next_bookmark = response.get('bookmark')
+        return docs, next_bookmark
+
+    def _find_by_customers(self, selector, fields, sort_keys, direction, limit, bookmark,
+                           skip):
+        """
+        Answers a query on several customer_ids from the by_customer view
+
+        A Mango index cannot narrow $in down, so the documents of the given
+        customers are read with one keyed view request instead of a scan.
+        The rest of the selector, the order and the paging are applied here
+        and the bookmark holds the sort key of the last document.
+        """
+        keys = list(OrderedDict.fromkeys(selector['customer_id']['$in']))
+        docs = []
+        if keys:
+            rows = self._view('by_customer', keys=keys, reduce=False,
+                              include_docs=True).get('rows', [])
+            docs = [row['doc'] for row in rows
+                    if row.get('doc') and matches(row['doc'], selector)]
+        page, next_bookmark = sort_page(docs, sort_keys, direction, limit, bookmark, skip)
+        if fields:
+            page = [dict((key, doc[key]) for key in fields if key in doc) for doc in page]
+        return page, next_bookmark
+
+    @retrying('count')
+    def count(self, customer_id=None):
+        """ Returns the number of documents from the reduced by_customer view """
+        params = {'reduce': True}
+        if customer_id is not None:
+            params['key'] = customer_id
+        rows = self._view('by_customer', **params).get('rows', [])
+        return rows[0]['value'] if rows else 0
+
+    @retrying('customer_counts')
+    def customer_counts(self):
+        """ Returns the number of documents of every customer_id from the view """
+        rows = self._view('by_customer', reduce=True, group=True).get('rows', [])
+        return dict((row['key'], row['value']) for row in rows)
+
+    def _view(self, view_name, **kwargs):
+        """ Reads the raw result of a view in the stats design document """
+        return self.database.get_view_result(STATS_DDOC, view_name, raw_result=True, **kwargs)
+
+    def changes_follower(self, cache, since='now', since_file=None):
+        """ Returns a follower of the database _changes feed """
+        # the feed shares the client's read timeout, so heartbeats have to
+        # come well inside it or an idle feed would keep timing out
+        heartbeat = int(models.CLOUDANT_TIMEOUT * 1000 / 2)
+        return ChangesFollower(self.database, cache, since=since, since_file=since_file,
+                               heartbeat=heartbeat)
@@ -0,0 +1,253 @@
+"""
+In-memory storage backend
+
+Keeps documents in a dict keyed by _id with a dict index for every field
+named in QUERY_INDEXES, so a lookup on customer_id or name only touches
+the documents that match. Document ids are also kept in a sorted list
+for paging in id order.
+
+Data lives as long as the process does and is shared by every backend
+that opens the same database name. Use it for edge or cache nodes, tests
+and benchmarks that should not need a CouchDB server.
+"""
+
+import uuid
+import bisect
+import threading
+from collections import Counter
+from app import models
+from app.backends.base import Backend, matches, next_rev, sort_page
+
+class MemoryDatabase(object):
+    """ Documents, field indexes and id order for one database """
+
+    def __init__(self, fields):
+        """ Constructor """
+        self.docs = {}
+        self.order = []
+        self.indexes = dict((field, {}) for field in fields)
+        self.lock = threading.RLock()
+
+    def add(self, doc):
+        """ Stores a document and adds it to the indexes """
+        doc_id = doc['_id']
+        old = self.docs.get(doc_id)
+        if old is None:
+            bisect.insort(self.order, doc_id)
+        else:
+            self._unindex(old)
+        self.docs[doc_id] = doc
+        for field, index in self.indexes.items():
+            if field in doc:
+                index.setdefault(doc[field], set()).add(doc_id)
+
+    def remove(self, doc_id):
+        """ Removes a document and drops it from the indexes """
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        del self.order[bisect.bisect_left(self.order, doc_id)]
+        self._unindex(doc)
+
+    def _unindex(self, doc):
+        """ Drops a document from the field indexes """
+        for field, index in self.indexes.items():
+            ids = index.get(doc[field]) if field in doc else None
+            if ids is not None:
+                ids.discard(doc['_id'])
+                if not ids:
+                    del index[doc[field]]
+
+class MemoryBackend(Backend):
+    """ Stores Wishlists in process memory """
+
+    databases = {}  # MemoryDatabase by name, shared by every backend
+    shared = False  # only this process can write its documents
+    lock = threading.Lock()
+
+    def __init__(self):
+        """ Constructor """
+        self.db = None
+
+    def connect(self, dbname):
+        """ Opens the named database, creating it if it does not exist """
+        with MemoryBackend.lock:
+            if dbname not in MemoryBackend.databases:
+                MemoryBackend.databases[dbname] = MemoryDatabase(self.indexed_fields())
+            self.db = MemoryBackend.databases[dbname]
+
+    @staticmethod
+    def indexed_fields():
+        """ Returns every field named in the declared query indexes """
+        return set(field for fields in models.QUERY_INDEXES for field in fields)
+
+    def create_query_index(self, field_name, order='asc'):
+        """ Indexes the documents on one more field """
+        with self.db.lock:
+            if field_name in self.db.indexes:
+                return
+            self.db.indexes[field_name] = {}
+            for doc in self.db.docs.values():
+                self.db.add(doc)
+
+######################################################################
+#  D O C U M E N T S
+######################################################################
+
+    def get(self, doc_id):
+        """ Returns a copy of the document with the id or None """
+        doc = self.db.docs.get(doc_id)
+        return dict(doc) if doc is not None else None
+
+    def get_many(self, doc_ids):
+        """ Returns copies of the documents of each id, with None if missing """
+        with self.db.lock:
+            docs = [self.db.docs.get(doc_id) for doc_id in doc_ids]
+        return [dict(doc) if doc is not None else None for doc in docs]
+
+    def revision(self, doc_id):
+        """ Returns the current revision of a document or None """
+        doc = self.db.docs.get(doc_id)
+        return doc['_rev'] if doc is not None else None
+
+    def create(self, doc):
+        """ Stores a new document under a generated id, or None if it exists """
+        doc = dict(doc)
+        doc.setdefault('_id', uuid.uuid4().hex)
+        with self.db.lock:
+            if doc['_id'] in self.db.docs:
+                return None
+            doc['_rev'] = next_rev(None)
+            self.db.add(doc)
+        return dict(doc)
+
+    def update(self, doc):
+        """ Writes a document if its _rev is the current revision """
+        with self.db.lock:
+            rev = self._write(dict(doc))
+        if rev is None:
+            raise models.DataConflictError(doc['_id'])
+        return rev
+
+    def delete(self, doc_id):
+        """ Deletes a document if it exists """
+        with self.db.lock:
+            self.db.remove(doc_id)
+
+    def bulk_save(self, docs):
+        """ Stores several documents and returns a row for each one """
+        rows = []
+        with self.db.lock:
+            for doc in docs:
+                doc = dict(doc)
+                doc.setdefault('_id', uuid.uuid4().hex)
+                rev = self._write(doc)
+                if rev is None:
+                    rows.append({'id': doc['_id'], 'error': 'conflict',
+                                 'reason': 'Document update conflict.'})
+                else:
+                    rows.append({'id': doc['_id'], 'rev': rev})
+        return rows
+
+    def bulk_delete(self, docs):
+        """ Deletes documents whose _rev is current and returns the count """
+        count = 0
+        with self.db.lock:
+            for doc in docs:
+                current = self.db.docs.get(doc['_id'])
+                if current is not None and current['_rev'] == doc['_rev']:
+                    self.db.remove(doc['_id'])
+                    count += 1
+        return count
+
+    def _write(self, doc):
+        """ Stores a document over its _rev and returns the new rev or None """
+        current = self.db.docs.get(doc['_id'])
+        current_rev = current['_rev'] if current is not None else None
+        if doc.get('_rev') != current_rev:
+            return None
+        doc['_rev'] = next_rev(current_rev)
+        self.db.add(doc)
+        return doc['_rev']
+
+######################################################################
+#  Q U E R I E S
+######################################################################
+
+    def page_all(self, limit, startkey=None, include_docs=True):
+        """ Returns a page of documents in id order """
+        with self.db.lock:
+            start = bisect.bisect_left(self.db.order, startkey) if startkey else 0
+            ids = self.db.order[start:start + limit + 1]
+            next_key = ids.pop() if len(ids) > limit else None
+            if include_docs:
+                docs = [dict(self.db.docs[doc_id]) for doc_id in ids]
+            else:
+                docs = [{'_id': doc_id, '_rev': self.db.docs[doc_id]['_rev']}
+                        for doc_id in ids]
+        return docs, next_key
+
+    def find(self, selector, fields=None, sort_keys=None, direction='asc',
+             limit=None, bookmark=None, skip=None):
+        """
+        Returns a page of the documents that match a selector
+
+        The bookmark holds the sort key and _id of the last document read
+        """
+        with self.db.lock:
+            docs = [doc for doc in self._candidates(selector)
+                    if matches(doc, selector)]
+        page, next_bookmark = sort_page(docs, sort_keys, direction, limit, bookmark, skip)
+        if fields:
+            page = [dict((key, doc[key]) for key in fields if key in doc) for doc in page]
+        else:
+            page = [dict(doc) for doc in page]
+        return page, next_bookmark
+
+    def _candidates(self, selector):
+        """ Returns the documents an index narrows a selector down to """
+        if '_id' in selector and not isinstance(selector['_id'], dict):
+            doc = self.db.docs.get(selector['_id'])
+            return [doc] if doc is not None else []
+        found = None
+        for field, value in selector.items():
+            index = self.db.indexes.get(field)
+            if index is None:
+                continue
+            if not isinstance(value, dict):
+                ids = index.get(value, set())
+            elif list(value) == ['$eq']:
+                ids = index.get(value['$eq'], set())
+            elif list(value) == ['$in']:
+                ids = set()
+                for each in value['$in']:
+                    ids |= index.get(each, set())
+            else:
+                continue
+            found = ids if found is None or len(ids) < len(found) else found
+        if found is None:
+            return list(self.db.docs.values())
+        return [self.db.docs[doc_id] for doc_id in found]
+
+######################################################################
+#  C O U N T S
+######################################################################
+
+    def count(self, customer_id=None):
+        """ Returns the number of documents, or only those of a customer_id """
+        with self.db.lock:
+            if customer_id is None:
+                return len(self.db.docs)
+            index = self.db.indexes.get('customer_id')
+            if index is not None:
+                return len(index.get(customer_id, ()))
+            return len([doc for doc in self.db.docs.values()
+                        if doc.get('customer_id') == customer_id])
+
+    def customer_counts(self):
+        """ Returns a dict with the number of documents of every customer_id """
+        with self.db.lock:
+            index = self.db.indexes.get('customer_id')
+            if index is not None:
+                return dict((key, len(ids)) for key, ids in index.items())
+            return dict(Counter(doc.get('customer_id') for doc in self.db.docs.values()))
@@ -0,0 +1,386 @@
+"""
+SQLite storage backend
+
+Stores each Wishlist as a row in a local SQLite file named after the
+database, in the directory given by SQLITE_DIR. This suits single node
+installs where running CouchDB is not worth it. Each read is a local call
+instead of an HTTP round trip.
+
+The file runs in WAL mode so readers do not block the writer. Every thread
+gets its own connection, and statements are passed as fixed SQL with
+parameters so the connection's statement cache can reuse them. name and
+customer_id are real columns with the indexes from QUERY_INDEXES. The rest
+of the document is stored as JSON.
+"""
+
+import os
+import json
+import uuid
+import sqlite3
+import logging
+import threading
+from itertools import islice
+from contextlib import contextmanager
+from app import models
+from app.backends.base import Backend, matches, next_rev
+from app.backends.base import make_bookmark, parse_bookmark
+
+# document keys that are stored in their own columns
+COLUMNS = {'_id': 'id', '_rev': 'rev', 'name': 'name', 'customer_id': 'customer_id'}
+
+# operators that can be turned into SQL on a column
+SQL_OPERATORS = {
+    '$eq': '=',
+    '$ne': '!=',
+    '$gt': '>',
+    '$gte': '>=',
+    '$lt': '<',
+    '$lte': '<=',
+}
+
+# the fewest parameters a statement can take in any SQLite build
+MAX_VARIABLES = 999
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS wishlists (
+    id TEXT PRIMARY KEY,
+    rev TEXT NOT NULL,
+    name TEXT,
+    customer_id TEXT,
+    doc TEXT NOT NULL
+)
+'''
+
+SELECT_DOC = 'SELECT doc FROM wishlists WHERE id = ?'
+SELECT_REV = 'SELECT rev FROM wishlists WHERE id = ?'
+INSERT_DOC = ('INSERT INTO wishlists (id, rev, name, customer_id, doc) '
+              'VALUES (?, ?, ?, ?, ?)')
+UPDATE_DOC = ('UPDATE wishlists SET rev = ?, name = ?, customer_id = ?, doc = ? '
+              'WHERE id = ? AND rev = ?')
+DELETE_DOC = 'DELETE FROM wishlists WHERE id = ?'
+DELETE_REV = 'DELETE FROM wishlists WHERE id = ? AND rev = ?'
+COUNT_ALL = 'SELECT COUNT(*) FROM wishlists'
+COUNT_CUSTOMER = 'SELECT COUNT(*) FROM wishlists WHERE customer_id = ?'
+COUNT_BY_CUSTOMER = 'SELECT customer_id, COUNT(*) FROM wishlists GROUP BY customer_id'
+
+class SQLiteBackend(Backend):
+    """ Stores Wishlists in a local SQLite database """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self):
+        """ Constructor """
+        self.path = None
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connect(self, dbname):
+        """ Opens the database file and creates the table if needed """
+        if models.SQLITE_DIR and not os.path.isdir(models.SQLITE_DIR):
+            os.makedirs(models.SQLITE_DIR)
+        self.path = os.path.join(models.SQLITE_DIR, dbname + '.sqlite3')
+        self.logger.info('SQLite database: %s', self.path)
+        conn = self.connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(SCHEMA)
+
+    def connection(self):
+        """ Returns the connection of the calling thread """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # autocommit mode so transactions are begun explicitly
+            conn = sqlite3.connect(self.path, timeout=models.SQLITE_TIMEOUT,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def disconnect(self):
+        """ Closes the connection of every thread """
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+        self.local = threading.local()
+
+    @contextmanager
+    def transaction(self):
+        """ Runs the statements in the block as one write transaction """
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+######################################################################
+#  I N D E X E S
+######################################################################
+
+    def create_indexes(self):
+        """ Creates the declared indexes on the document columns """
+        for fields in models.QUERY_INDEXES:
+            self._create_index(fields)
+
+    def create_query_index(self, field_name, order='asc'):
+        """ Creates an index on a single column """
+        self._create_index([field_name])
+
+    def _create_index(self, fields):
+        """ Creates an index on columns if they all exist """
+        if any(field not in COLUMNS for field in fields):
+            self.logger.warning('Cannot index %s, only %s are columns',
+                                fields, ', '.join(sorted(COLUMNS)))
+            return
+        columns = [COLUMNS[field] for field in fields]
+        self.connection().execute(
+            'CREATE INDEX IF NOT EXISTS wishlists_{} ON wishlists ({})'.format(
+                '_'.join(columns), ', '.join(columns)))
+
+######################################################################
+#  D O C U M E N T S
+######################################################################
+
+    def get(self, doc_id):
+        """ Returns the document with the id or None """
+        row = self.connection().execute(SELECT_DOC, (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, doc_ids):
+        """ Returns the document of each id in the same order, with None if missing """
+        conn = self.connection()
+        found = {}
+        # stay under SQLite's limit on the number of parameters
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            sql = 'SELECT id, doc FROM wishlists WHERE id IN ({})'.format(
+                ', '.join('?' * len(batch)))
+            found.update(conn.execute(sql, batch).fetchall())
+        return [json.loads(found[doc_id]) if doc_id in found else None
+                for doc_id in doc_ids]
+
+    def revision(self, doc_id):
+        """ Returns the current revision of a document or None """
+        row = self.connection().execute(SELECT_REV, (doc_id,)).fetchone()
+        return row[0] if row else None
+
+    def create(self, doc):
+        """ Stores a new document under a generated id, or None if it exists """
+        doc = dict(doc)
+        doc.setdefault('_id', uuid.uuid4().hex)
+        doc['_rev'] = next_rev(None)
+        try:
+            with self.transaction() as conn:
+                conn.execute(INSERT_DOC, self._row(doc))
+        except sqlite3.IntegrityError:
+            return None
+        return doc
+
+    def update(self, doc):
+        """ Writes a document if its _rev is the current revision """
+        with self.transaction() as conn:
+            rev = self._write(conn, dict(doc))
+        if rev is None:
+            raise models.DataConflictError(doc['_id'])
+        return rev
+
+    def delete(self, doc_id):
+        """ Deletes a document if it exists """
+        with self.transaction() as conn:
+            conn.execute(DELETE_DOC, (doc_id,))
+
+    def bulk_save(self, docs):
+        """ Stores several documents in a single transaction """
+        docs = [dict(doc) for doc in docs]
+        for doc in docs:
+            doc.setdefault('_id', uuid.uuid4().hex)
+        rows = []
+        inserts = []
+        with self.transaction() as conn:
+            current = self._revisions(conn, [doc['_id'] for doc in docs])
+            for doc in docs:
+                if doc.get('_rev') != current.get(doc['_id']):
+                    rows.append({'id': doc['_id'], 'error': 'conflict',
+                                 'reason': 'Document update conflict.'})
+                    continue
+                if doc['_id'] in current:
+                    self._write(conn, doc)
+                else:
+                    doc['_rev'] = next_rev(None)
+                    inserts.append(self._row(doc))
+                # a later document with the same _id has to match this write
+                current[doc['_id']] = doc['_rev']
+                rows.append({'id': doc['_id'], 'rev': doc['_rev']})
+            conn.executemany(INSERT_DOC, inserts)
+        return rows
+
+    def bulk_delete(self, docs):
+        """ Deletes documents whose _rev is current and returns the count """
+        if not docs:
+            return 0
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(DELETE_REV, [(doc['_id'], doc['_rev']) for doc in docs])
+            return conn.total_changes - before
+
+    def _write(self, conn, doc):
+        """ Stores a document over its _rev and returns the new rev or None """
+        old_rev = doc.get('_rev')
+        doc['_rev'] = next_rev(old_rev)
+        if old_rev is None:
+            try:
+                conn.execute(INSERT_DOC, self._row(doc))
+            except sqlite3.IntegrityError:
+                return None
+            return doc['_rev']
+        doc_id, rev, name, customer_id, body = self._row(doc)
+        cursor = conn.execute(UPDATE_DOC, (rev, name, customer_id, body, doc_id, old_rev))
+        return doc['_rev'] if cursor.rowcount == 1 else None
+
+    @staticmethod
+    def _revisions(conn, doc_ids):
+        """ Returns the current revision of each of the ids that exist """
+        revs = {}
+        # stay under SQLite's limit on the number of parameters
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            sql = 'SELECT id, rev FROM wishlists WHERE id IN ({})'.format(
+                ', '.join('?' * len(batch)))
+            revs.update(conn.execute(sql, batch).fetchall())
+        return revs
+
+    @staticmethod
+    def _row(doc):
+        """ Returns the column values of a document """
+        return (doc['_id'], doc['_rev'], doc.get('name'), doc.get('customer_id'),
+                json.dumps(doc))
+
+######################################################################
+#  Q U E R I E S
+######################################################################
+
+    def page_all(self, limit, startkey=None, include_docs=True):
+        """ Returns a page of documents in id order """
+        column = 'doc' if include_docs else 'rev'
+        sql = 'SELECT id, {} FROM wishlists WHERE id >= ? ORDER BY id LIMIT ?'.format(column)
+        rows = self.connection().execute(sql, (startkey or '', limit + 1)).fetchall()
+        # the extra row is where the next page starts
+        next_key = rows.pop()[0] if len(rows) > limit else None
+        if include_docs:
+            return [json.loads(row[1]) for row in rows], next_key
+        return [{'_id': row[0], '_rev': row[1]} for row in rows], next_key
+
+    def find(self, selector, fields=None, sort_keys=None, direction='asc',
+             limit=None, bookmark=None, skip=None):
+        """
+        Returns a page of the documents that match a selector
+
+        Conditions on columns run in SQL and any others are checked on the
+        decoded documents. The bookmark holds the sort key and _id of the
+        last document, and the next page is the rows that sort after it.
+        """
+        sort_keys = list(sort_keys or [])
+        where, params, rest = self._where(selector, sort_keys)
+        keys = sort_keys + ['_id']
+        descending = direction == 'desc'
+        if bookmark:
+            after, values = self._after(keys, parse_bookmark(bookmark, sort_keys), descending)
+            where.append(after)
+            params.extend(values)
+        if len(params) > MAX_VARIABLES:
+            raise models.DataValidationError('Invalid query: more than {} values'.format(
+                MAX_VARIABLES))
+        order = ', '.join('{} {}'.format(COLUMNS[key], direction.upper()) for key in keys)
+        sql = 'SELECT doc FROM wishlists'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY ' + order
+        start = 0 if bookmark else (skip or 0)
+        if not rest:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [limit or -1, start]
+            start = 0
+        docs = (json.loads(row[0]) for row in self.connection().execute(sql, params))
+        if rest:
+            docs = (doc for doc in docs if matches(doc, rest))
+        page = list(islice(docs, start, start + limit if limit else None))
+        next_bookmark = None
+        if limit and len(page) == limit:
+            next_bookmark = make_bookmark(page[-1], sort_keys)
+        if fields:
+            page = [dict((key, doc[key]) for key in fields if key in doc) for doc in page]
+        return page, next_bookmark
+
+    @staticmethod
+    def _after(keys, values, descending):
+        """ Returns the SQL condition and parameters for the rows after a bookmark """
+        operator = '<' if descending else '>'
+        clauses = []
+        params = []
+        for index, key in enumerate(keys):
+            # equal on the keys before this one and past the bookmark on this one
+            terms = ['{} = ?'.format(COLUMNS[name]) for name in keys[:index]]
+            terms.append('{} {} ?'.format(COLUMNS[key], operator))
+            clauses.append('(' + ' AND '.join(terms) + ')')
+            params.extend(values[:index + 1])
+        return '(' + ' OR '.join(clauses) + ')', params
+
+    @staticmethod
+    def _where(selector, sort_keys):
+        """
+        Returns the SQL conditions and parameters for the column fields of a
+        selector and a selector with the fields that have to be checked in Python
+        """
+        where = []
+        params = []
+        rest = {}
+        for key in sort_keys:
+            if key not in COLUMNS:
+                raise models.DataValidationError('Invalid sort: unknown field ' + key)
+            # like Cloudant, a sorted field has to be present
+            where.append('{} IS NOT NULL'.format(COLUMNS[key]))
+        for field, condition in selector.items():
+            if field not in COLUMNS:
+                rest[field] = condition
+                continue
+            column = COLUMNS[field]
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for operator, arg in condition.items():
+                if operator == '$in':
+                    where.append('{} IN ({})'.format(column, ', '.join('?' * len(arg))))
+                    params.extend(arg)
+                elif operator not in SQL_OPERATORS:
+                    raise models.DataValidationError('Invalid query: unknown operator '
+                                                     + operator)
+                elif arg is None:
+                    # null sorts before everything, so only = and > mean anything
+                    if operator in ('$eq', '$lte'):
+                        where.append('{} IS NULL'.format(column))
+                    elif operator in ('$ne', '$gt'):
+                        where.append('{} IS NOT NULL'.format(column))
+                    elif operator == '$lt':
+                        where.append('0')
+                else:
+                    where.append('{} {} ?'.format(column, SQL_OPERATORS[operator]))
+                    params.append(arg)
+        return where, params, rest
+
+######################################################################
+#  C O U N T S
+######################################################################
+
+    def count(self, customer_id=None):
+        """ Returns the number of rows, or only those of a customer_id """
+        if customer_id is None:
+            return self.connection().execute(COUNT_ALL).fetchone()[0]
+        return self.connection().execute(COUNT_CUSTOMER, (customer_id,)).fetchone()[0]
+
+    def customer_counts(self):
+        """ Returns a dict with the number of rows of every customer_id """
+        return dict(self.connection().execute(COUNT_BY_CUSTOMER).fetchall())
@@ -0,0 +1,78 @@
+"""
+In-process cache for documents read from the database
+
+The cache holds at most maxsize entries and drops the least recently
+used one when it is full. Entries older than ttl seconds are treated as
+missing. A maxsize of 0 turns the cache off.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+class LRUCache(object):
+    """ Size bounded least recently used cache with expiring entries """
+
+    def __init__(self, maxsize=1024, ttl=30, timer=time.time):
+        """ Constructor """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """ Returns the value cached for a key or None """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < self.timer():
+                self.misses += 1
+                return None
+            # re-insert so the entry becomes the most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """ Returns the value cached for a key without counting or reordering """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[0] if entry else None
+
+    def set(self, key, value):
+        """ Caches a value for a key """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self.timer() + self.ttl)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """ Removes a key from the cache """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every key from the cache """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """ Returns the hit and miss counters and the current size """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
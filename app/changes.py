@@ -0,0 +1,164 @@
+"""
+Changes feed follower
+
+Each worker keeps its own cache of Wishlists, so a write made by another
+worker or host would leave a stale copy behind. The follower reads the
+database _changes feed in a background thread and evicts cached entries
+whose revision no longer matches the one in the feed.
+
+The feed is read from the last sequence that was processed, which can be
+saved to a file so a restarted worker picks up where it left off. Lost
+connections are retried with exponential backoff.
+
+The lag behind the database, in changes and in seconds since the follower
+was last caught up, is exported to app.metrics on every heartbeat and every
+SAVE_EVERY changes, along with the time of the last event and the number
+of reconnects.
+"""
+
+import os
+import time
+import logging
+import threading
+from app import metrics
+
+# save the since sequence to disk and report the lag after this many changes
+SAVE_EVERY = 100
+
+class ChangesFollower(threading.Thread):
+    """ Background thread that keeps a document cache in step with _changes """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, database, cache, since='now', since_file=None,
+                 heartbeat=30000, max_backoff=60):
+        """ Constructor """
+        super(ChangesFollower, self).__init__(name='changes-follower')
+        self.daemon = True
+        self.database = database
+        self.cache = cache
+        self.since_file = since_file
+        self.since = self.load_since() or since
+        self.heartbeat = heartbeat
+        self.max_backoff = max_backoff
+        self.changes = 0
+        self.reconnects = 0
+        self.last_event = None
+        self.caught_up = None
+        self._feed = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        """ Follows the feed until stopped, reconnecting when it drops """
+        backoff = 1
+        while not self._stopped.is_set():
+            try:
+                self.follow()
+                backoff = 1
+            except Exception as err:  # pylint: disable=broad-except
+                if self._stopped.is_set():
+                    break
+                self.reconnects += 1
+                metrics.CHANGES_RECONNECTS.inc()
+                ChangesFollower.logger.warning('Changes feed failed: %s, '
+                                               'reconnecting in %ss', err, backoff)
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        self.save_since()
+
+    def follow(self):
+        """ Reads the continuous feed from the last sequence processed """
+        if self.since == 'now':
+            # pin the starting point so a reconnect does not skip changes
+            self.since = self.database.metadata().get('update_seq', 'now')
+        ChangesFollower.logger.info('Following changes since %s', self.since)
+        self._feed = self.database.changes(feed='continuous', since=self.since,
+                                           heartbeat=self.heartbeat)
+        for change in self._feed:
+            self.last_event = time.time()
+            metrics.CHANGES_LAST_EVENT.set(self.last_event)
+            if change:
+                self.apply(change)
+            else:   # heartbeats come through as None
+                self.report_lag()
+
+    def apply(self, change):
+        """ Evicts the cached copy of a changed document unless it is current """
+        if 'id' not in change or 'seq' not in change:
+            ChangesFollower.logger.warning('Unexpected change: %s', change)
+            return
+        revs = [item['rev'] for item in change.get('changes', [])]
+        cached = self.cache.peek(change['id'])
+        if cached is not None and (change.get('deleted') or cached.get('_rev') not in revs):
+            self.cache.invalidate(change['id'])
+        self.since = change['seq']
+        self.changes += 1
+        if self.changes % SAVE_EVERY == 0:
+            self.save_since()
+            self.report_lag()
+
+    def stop(self):
+        """ Asks the thread to stop at the next change or heartbeat """
+        self._stopped.set()
+        if self._feed:
+            self._feed.stop()
+
+    def load_since(self):
+        """ Returns the since sequence saved on disk if there is one """
+        if not self.since_file or not os.path.exists(self.since_file):
+            return None
+        with open(self.since_file) as since_file:
+            return since_file.read().strip() or None
+
+    def save_since(self):
+        """ Saves the since sequence to disk if a file was given """
+        if not self.since_file or self.since == 'now':
+            return
+        with open(self.since_file, 'w') as since_file:
+            since_file.write(str(self.since))
+
+    def lag(self):
+        """ Returns how many changes the database is ahead of the follower """
+        latest = sequence_number(self.database.metadata().get('update_seq'))
+        current = sequence_number(self.since)
+        if latest is None or current is None:
+            return None
+        return max(latest - current, 0)
+
+    def report_lag(self):
+        """ Sets the lag metrics from the latest sequence of the database """
+        try:
+            lag = self.lag()
+        except Exception as err:  # pylint: disable=broad-except
+            ChangesFollower.logger.warning('Could not read the database sequence: %s', err)
+            return
+        if lag is None:
+            return
+        now = time.time()
+        if lag == 0 or self.caught_up is None:
+            self.caught_up = now
+        metrics.CHANGES_LAG.set(lag)
+        metrics.CHANGES_LAG_SECONDS.set(now - self.caught_up)
+
+    def stats(self):
+        """ Returns the follower counters """
+        idle = None
+        if self.last_event:
+            idle = time.time() - self.last_event
+        return {
+            'since': self.since,
+            'changes': self.changes,
+            'reconnects': self.reconnects,
+            'seconds_since_event': idle,
+            'running': self.is_alive()
+        }
+
+
+def sequence_number(seq):
+    """ Returns the numeric part of a CouchDB 1.x or 2.x sequence """
+    if seq is None:
+        return None
+    prefix = str(seq).split('-')[0]
+    if not prefix.isdigit():
+        return None
+    return int(prefix)
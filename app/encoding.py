@@ -0,0 +1,61 @@
+"""
+JSON encoders for API responses
+
+The routes in app/server.py encode their bodies with dumps() from this
+module, so the encoder can be swapped without touching every handler. The
+one in use is named by the RESPONSE_ENCODER setting:
+
+    json        the standard library with compact separators (default)
+    flask       flask.json, which follows JSON_SORT_KEYS and the app's encoder
+    ujson       ujson, when it is installed
+    simplejson  simplejson, when it is installed
+
+The default leaves keys unsorted so Python uses its C accelerated encoder.
+"""
+
+import json
+from flask import json as flask_json
+
+try:
+    import ujson
+except ImportError:     # optional, only used when chosen
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:     # optional, only used when chosen
+    simplejson = None
+
+MIMETYPE = 'application/json'
+
+def _stdlib_dumps(data):
+    """ Encodes with the standard library's C accelerated encoder """
+    return json.dumps(data, separators=(',', ':'))
+
+ENCODERS = {
+    'json': _stdlib_dumps,
+    'flask': flask_json.dumps,
+}
+if ujson:
+    ENCODERS['ujson'] = lambda data: ujson.dumps(data, ensure_ascii=True)
+if simplejson:
+    ENCODERS['simplejson'] = lambda data: simplejson.dumps(data, separators=(',', ':'))
+
+# the encoder used by dumps(), chosen with use()
+_encoder = _stdlib_dumps
+
+def use(name):
+    """ Makes the named encoder the one dumps() uses """
+    global _encoder # pylint: disable=global-statement,invalid-name
+    if name not in ENCODERS:
+        raise AssertionError('JSON encoder [{}] is not one of {}'.format(
+            name, ', '.join(sorted(ENCODERS))))
+    _encoder = ENCODERS[name]
+
+def register(name, dumps):
+    """ Adds an encoder that turns data into a JSON string """
+    ENCODERS[name] = dumps
+
+def dumps(data):
+    """ Encodes data as JSON with the encoder in use """
+    return _encoder(data)
@@ -5,7 +5,8 @@ Handles all of the HTTP Error Codes as JSON
 """
 
 from flask import jsonify, make_response
-from app.models import DataValidationError
+from app.models import DataValidationError, DataConflictError
+from app.resilience import CircuitOpenError
 from . import app
 
 ######################################################################
@@ -16,6 +17,18 @@ def request_validation_error(error):
     """ Handles Value Errors from bad data """
     return bad_request(error)
 
+@app.errorhandler(DataConflictError)
+def request_conflict_error(error):
+    """ Handles writes made against a stale revision """
+    return conflict(error)
+
+@app.errorhandler(CircuitOpenError)
+def request_circuit_open(error):
+    """ Handles calls refused while the database is unavailable """
+    response = service_unavailable(error)
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 @app.errorhandler(400)
 def bad_request(error):
     """ Handles bad reuests with 400_BAD_REQUEST """
@@ -37,6 +50,20 @@ def method_not_supported(error):
     app.logger.error(message)
     return make_response(jsonify(status=405, error='Method not Allowed', message=message), 405)
 
+@app.errorhandler(409)
+def conflict(error):
+    """ Handles conflicting writes with 409_CONFLICT """
+    message = error.message or str(error)
+    app.logger.error(message)
+    return make_response(jsonify(status=409, error='Conflict', message=message), 409)
+
+@app.errorhandler(412)
+def precondition_failed(error):
+    """ Handles failed If-Match preconditions with 412_PRECONDITION_FAILED """
+    message = error.message or str(error)
+    app.logger.error(message)
+    return make_response(jsonify(status=412, error='Precondition Failed', message=message), 412)
+
 @app.errorhandler(415)
 def mediatype_not_supported(error):
     """ Handles unsuppoted media requests with 415_UNSUPPORTED_MEDIA_TYPE """
@@ -44,6 +71,13 @@ def mediatype_not_supported(error):
     app.logger.error(message)
     return make_response(jsonify(status=415, error='Unsupported media type', message=message), 415)
 
+@app.errorhandler(503)
+def service_unavailable(error):
+    """ Handles an unavailable database with 503_SERVICE_UNAVAILABLE """
+    message = error.message or str(error)
+    app.logger.error(message)
+    return make_response(jsonify(status=503, error='Service Unavailable', message=message), 503)
+
 @app.errorhandler(500)
 def internal_server_error(error):
     """ Handles unexpected server error with 500_SERVER_ERROR """
@@ -0,0 +1,96 @@
+"""
+Prometheus metrics for the Wishlist service
+
+Counts and times HTTP requests per route, times the Wishlist model methods
+that go to the database, counts the retries made by the retry policy in
+app.resilience and reports how far the changes feed follower in app.changes
+is behind the database. GET /metrics serves everything in the Prometheus
+text format.
+
+When gunicorn runs several worker processes, set PROMETHEUS_MULTIPROC_DIR
+to a directory the workers share before they start. Each worker then writes
+its samples there and /metrics adds them up across every worker.
+gunicorn.conf.py sets this up.
+"""
+
+import os
+import time
+from functools import wraps
+
+# prometheus_client before 0.8 only reads the lower case name
+MULTIPROC_DIR = (os.environ.get('PROMETHEUS_MULTIPROC_DIR') or
+                 os.environ.get('prometheus_multiproc_dir'))
+if MULTIPROC_DIR:
+    os.environ['prometheus_multiproc_dir'] = MULTIPROC_DIR
+
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY
+from prometheus_client import generate_latest, multiprocess, CONTENT_TYPE_LATEST
+
+REQUESTS = Counter('wishlist_http_requests_total',
+                   'HTTP requests by route, method and status',
+                   ['method', 'endpoint', 'status'])
+REQUEST_LATENCY = Histogram('wishlist_http_request_duration_seconds',
+                            'Time spent handling HTTP requests by route',
+                            ['method', 'endpoint'])
+REQUESTS_IN_FLIGHT = Gauge('wishlist_http_requests_in_flight',
+                           'HTTP requests being handled',
+                           multiprocess_mode='livesum')
+ERRORS = Counter('wishlist_http_errors_total',
+                 'Error responses by route and status',
+                 ['endpoint', 'status'])
+DB_LATENCY = Histogram('wishlist_db_operation_duration_seconds',
+                       'Time spent in Wishlist model methods that use the database',
+                       ['operation'])
+DB_IN_FLIGHT = Gauge('wishlist_db_operations_in_flight',
+                     'Wishlist model methods waiting on the database',
+                     ['operation'], multiprocess_mode='livesum')
+DB_ERRORS = Counter('wishlist_db_operation_errors_total',
+                    'Wishlist model methods that raised an error',
+                    ['operation'])
+RETRIES = Counter('wishlist_db_retries_total',
+                  'Database calls retried by the retry policy',
+                  ['operation'])
+CHANGES_LAG = Gauge('wishlist_changes_lag',
+                    'Changes the database is ahead of the changes feed follower',
+                    multiprocess_mode='max')
+CHANGES_LAG_SECONDS = Gauge('wishlist_changes_lag_seconds',
+                            'Seconds since the changes feed follower was last caught up',
+                            multiprocess_mode='max')
+CHANGES_LAST_EVENT = Gauge('wishlist_changes_last_event_timestamp_seconds',
+                           'When the changes feed follower last read a change or heartbeat',
+                           multiprocess_mode='min')
+CHANGES_RECONNECTS = Counter('wishlist_changes_reconnects_total',
+                             'Times the changes feed follower reconnected')
+
+def timed(operation):
+    """ Decorator that times a model method and counts its errors """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            DB_IN_FLIGHT.labels(operation).inc()
+            started = time.time()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                DB_ERRORS.labels(operation).inc()
+                raise
+            finally:
+                DB_LATENCY.labels(operation).observe(time.time() - started)
+                DB_IN_FLIGHT.labels(operation).dec()
+        return wrapper
+    return decorator
+
+def observe_request(method, endpoint, status, seconds):
+    """ Records a finished HTTP request """
+    REQUESTS.labels(method, endpoint, str(status)).inc()
+    REQUEST_LATENCY.labels(method, endpoint).observe(seconds)
+    if status >= 400:
+        ERRORS.labels(endpoint, str(status)).inc()
+
+def generate():
+    """ Returns the metrics of every worker in the Prometheus text format """
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -17,10 +17,11 @@
 Wishlist Model that uses Cloudant
 
 You must initlaize this class before use by calling inititlize().
-This class looks for an environment variable called VCAP_SERVICES
-to get it's database credentials from. If it cannot find one, it
-tries to connect to Cloudant on the localhost. If that fails it looks
-for a server name 'cloudant' to connect to.
+The documents are stored by the backend named in WISHLIST_BACKEND,
+which is Cloudant unless it is set to memory. The Cloudant backend
+looks for an environment variable called BINDING_CLOUDANT to get
+it's database credentials from. If it cannot find one, it tries to
+connect to Cloudant on the localhost.
 
 To use with Docker couchdb database use:
     docker run -d --name couchdb -p 5984:5984 -e COUCHDB_USER=admin -e COUCHDB_PASSWORD=pass couchdb
@@ -32,42 +33,135 @@ Docker Note:
 """
 
 import os
-import json
+import uuid
+import heapq
 import logging
-from retry import retry
-from cloudant.client import Cloudant
-from cloudant.query import Query
+import threading
+from collections import OrderedDict
 from requests import HTTPError, ConnectionError
+from app.cache import LRUCache
+from app.metrics import timed
+from app.resilience import CircuitBreaker, RetryPolicy, configure, retrying
+from app.resilience import retryable, unavailable
 
 # get configruation from enviuronment (12-factor)
+WISHLIST_BACKEND = os.environ.get('WISHLIST_BACKEND', 'cloudant')
 ADMIN_PARTY = os.environ.get('ADMIN_PARTY', 'False').lower() == 'true'
 CLOUDANT_HOST = os.environ.get('CLOUDANT_HOST', 'localhost')
 CLOUDANT_USERNAME = os.environ.get('CLOUDANT_USERNAME', 'admin')
 CLOUDANT_PASSWORD = os.environ.get('CLOUDANT_PASSWORD', 'pass')
 
-# global variables for retry (must be int)
+# HTTP connections pooled per worker; size it to the number of threads, as
+# one more is added for the changes feed follower when it is on. The read
+# timeout is in seconds and the feed sends heartbeats every half of it
+CLOUDANT_POOL_SIZE = int(os.environ.get('CLOUDANT_POOL_SIZE', 10))
+CLOUDANT_TIMEOUT = float(os.environ.get('CLOUDANT_TIMEOUT', 30))
+
+# directory the sqlite backend keeps its database files in
+SQLITE_DIR = os.environ.get('SQLITE_DIR', '.')
+SQLITE_TIMEOUT = float(os.environ.get('SQLITE_TIMEOUT', 5))
+
+# retry policy for 429 and 5xx errors: the most attempts, the first delay
+# and its growth factor in seconds, and the time budget of each request
 RETRY_COUNT = int(os.environ.get('RETRY_COUNT', 10))
-RETRY_DELAY = int(os.environ.get('RETRY_DELAY', 1))
-RETRY_BACKOFF = int(os.environ.get('RETRY_BACKOFF', 2))
+RETRY_DELAY = float(os.environ.get('RETRY_DELAY', 1))
+RETRY_BACKOFF = float(os.environ.get('RETRY_BACKOFF', 2))
+RETRY_DEADLINE = float(os.environ.get('RETRY_DEADLINE', 10))
+
+# circuit breaker: failures in a row that open it, seconds it stays open
+# before probing the database again, and how many probes run at once
+BREAKER_THRESHOLD = int(os.environ.get('BREAKER_THRESHOLD', 5))
+BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', 30))
+BREAKER_PROBES = int(os.environ.get('BREAKER_PROBES', 1))
+
+# global variables for paging through large result sets (must be int)
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+
+# number of documents written per _bulk_docs request (must be int)
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 500))
+
+# bounded cache of documents read by id (size 0 turns it off). It is only
+# on when no other process can write the data or the changes feed follower
+# evicts what they write, unless CACHE_WITHOUT_FOLLOWER accepts reads that
+# are up to CACHE_TTL seconds stale
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', 1024))
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 30))
+CACHE_WITHOUT_FOLLOWER = os.environ.get('CACHE_WITHOUT_FOLLOWER', 'False').lower() == 'true'
+# Wishlists read into the cache when a worker starts (0 turns it off)
+WARM_CACHE_SIZE = int(os.environ.get('WARM_CACHE_SIZE', 100))
+
+# follow the _changes feed to evict cache entries written elsewhere
+CHANGES_FOLLOWER = os.environ.get('CHANGES_FOLLOWER', 'False').lower() == 'true'
+CHANGES_SINCE_FILE = os.environ.get('CHANGES_SINCE_FILE')
+
+# raise instead of warning when a query has no index to use
+STRICT_INDEXES = os.environ.get('STRICT_INDEXES', 'False').lower() == 'true'
+
+# query indexes that init_db makes sure exist (field lists in index order)
+QUERY_INDEXES = [
+    ['customer_id'],
+    ['name'],
+    ['customer_id', 'name'],
+]
+
+# fields a Wishlist can be projected and sorted on and their document keys
+FIELDS = {'id': '_id', 'name': 'name', 'customer_id': 'customer_id'}
 
 class DataValidationError(Exception):
     """ Custom Exception with data validation fails """
     pass
 
+class QueryIndexError(Exception):
+    """ Custom Exception when a query has no index in strict mode """
+    pass
+
+class DataConflictError(Exception):
+    """ Custom Exception when a write is made against a stale revision """
+    pass
+
+def _merge_condition(selector, field, condition):
+    """ Adds a condition on a field to a selector, ANDed with any already there """
+    if isinstance(condition, (list, tuple)):
+        values = list(condition)
+        condition = values[0] if len(values) == 1 else {'$in': values}
+    if field not in selector:
+        selector[field] = condition
+        return
+    current = selector[field]
+    merged = dict(current) if isinstance(current, dict) else {'$eq': current}
+    if not isinstance(condition, dict):
+        condition = {'$eq': condition}
+    for operator, arg in condition.items():
+        if operator == '$in' and operator in merged:
+            # a value has to be in both lists
+            arg = [value for value in merged[operator] if value in arg]
+        elif operator in merged and merged[operator] != arg:
+            raise DataValidationError('Invalid query: conflicting {} conditions on {}'.format(
+                operator, field))
+        merged[operator] = arg
+    selector[field] = merged
+
 class Wishlist(object):
     """ Wishlist interface to database """
 
+    # no per instance __dict__, which keeps large listings small
+    __slots__ = ('id', 'rev', 'name', 'customer_id')
+
     logger = logging.getLogger(__name__)
-    client = None   # cloudant.client.Cloudant
-    database = None # cloudant.database.CloudantDatabase
+    backend = None  # app.backends.base.Backend
+    cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+    follower = None # app.changes.ChangesFollower
+    lock = threading.Lock()
 
     def __init__(self, name=None, customer_id=None):
         """ Constructor """
         self.id = None
+        self.rev = None
         self.name = name
         self.customer_id = customer_id
 
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    @retrying('create')
     def create(self):
         """
         Creates a new Wishlist in the database
@@ -76,30 +170,41 @@ class Wishlist(object):
             raise DataValidationError('name attribute is not set')
 
         try:
-
-            document = self.database.create_document(self.serialize())
+            document = self.backend.create(self.serialize())
         except HTTPError as err:
+            if retryable(err) or unavailable(err):
+                # let the retry policy and the circuit breaker see it
+                raise
             Wishlist.logger.warning('Create failed: %s', err)
             return
 
-        if document.exists():
-            print(document['_id'])
+        if document:
             self.id = document['_id']
+            self.rev = document['_rev']
 
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    @retrying('update')
     def update(self):
         """
         Updates a Wishlist in the database
+
+        The document is written against the revision the Wishlist was
+        read at, so a write made in between is not overwritten.
         """
+        document = self.serialize()
+        document['_id'] = document.pop('id')
+        if self.rev:
+            document['_rev'] = self.rev
         try:
-            document = self.database[self.id]
-        except KeyError:
-            document = None
-        if document:
-            document.update(self.serialize())
-            document.save()
-
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
+            self.rev = self.backend.update(document)
+        except DataConflictError:
+            Wishlist.cache.invalidate(self.id)
+            raise DataConflictError('Wishlist with id \'{}\' was changed or removed '
+                                    'by another request'.format(self.id))
+        document['_rev'] = self.rev
+        Wishlist.cache.set(self.id, document)
+
+    @timed('save')
+    @retrying('save')
     def save(self):
         """ Saves a Wishlist in the database """
         if self.name is None:   # name is the only required field
@@ -109,17 +214,14 @@ class Wishlist(object):
         else:
             self.create()
 
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    @timed('delete')
+    @retrying('delete')
     def delete(self):
         """ Deletes a Wishlist from the database """
-        try:
-            document = self.database[self.id]
-        except KeyError:
-            document = None
-        if document:
-            document.delete()
+        self.backend.delete(self.id)
+        Wishlist.cache.invalidate(self.id)
 
-    def serialize(self):
+    def serialize(self, fields=None):
         """ serializes a Wishlist into a dictionary """
         wishlist = {
             "name": self.name,
@@ -127,11 +229,36 @@ class Wishlist(object):
         }
         if self.id:
             wishlist['id'] = self.id
+        if fields:
+            wishlist = dict((key, value) for key, value in wishlist.items() if key in fields)
+        return wishlist
+
+    @staticmethod
+    def serialize_document(document, fields=None):
+        """
+        Serializes a stored document the way serialize() would serialize
+        the Wishlist read from it, without creating the Wishlist
+        """
+        if fields:
+            wishlist = {}
+            for name in fields:
+                if name == 'id':
+                    if document.get('_id'):
+                        wishlist['id'] = document['_id']
+                elif name in FIELDS:
+                    wishlist[name] = document.get(FIELDS[name])
+            return wishlist
+        wishlist = {
+            "name": document.get('name'),
+            "customer_id": document.get('customer_id')
+        }
+        if document.get('_id'):
+            wishlist['id'] = document['_id']
         return wishlist
 
     def deserialize(self, data):
         """ deserializes a Wishlist my marshalling the data """
-        Wishlist.logger.info(data)
+        Wishlist.logger.debug('Deserializing %s', data)
         try:
             self.name = data['name']
             self.customer_id = data['customer_id']
@@ -139,13 +266,29 @@ class Wishlist(object):
             raise DataValidationError('Invalid wishlist: missing ' + error.args[0])
         except TypeError as error:
             raise DataValidationError('Invalid wishlist: body of request contained bad or no data')
+        for field in ('name', 'customer_id'):
+            # fields are indexed and stored in columns, so they must be scalars
+            value = getattr(self, field)
+            if value is not None and not isinstance(value, (basestring, int, long, float)):
+                raise DataValidationError('Invalid wishlist: {} must be a string or a '
+                                          'number'.format(field))
 
         # if there is no id and the data has one, assign it
         if not self.id and '_id' in data:
             self.id = data['_id']
+        if not self.rev and '_rev' in data:
+            self.rev = data['_rev']
 
         return self
 
+    @classmethod
+    def from_document(cls, document):
+        """ Creates a Wishlist from a stored document that may only hold some fields """
+        wishlist = Wishlist(document.get('name'), document.get('customer_id'))
+        wishlist.id = document.get('_id')
+        wishlist.rev = document.get('_rev')
+        return wishlist
+
 
 ######################################################################
 #  S T A T I C   D A T A B S E   M E T H O D S
@@ -154,71 +297,386 @@ class Wishlist(object):
     @classmethod
     def connect(cls):
         """ Connect to the server """
-        cls.client.connect()
+        cls.backend.reconnect()
 
     @classmethod
     def disconnect(cls):
         """ Disconnect from the server """
-        cls.client.disconnect()
+        cls.stop_following()
+        cls.backend.disconnect()
 
     @classmethod
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def follow_changes(cls, since='now'):
+        """ Starts evicting cached Wishlists as the _changes feed reports writes """
+        if cls.follower and cls.follower.is_alive():
+            return cls.follower
+        cls.follower = cls.backend.changes_follower(cls.cache, since=since,
+                                                    since_file=CHANGES_SINCE_FILE)
+        if cls.follower:
+            cls.follower.start()
+        return cls.follower
+
+    @classmethod
+    def stop_following(cls):
+        """ Stops the _changes feed follower if one is running """
+        if cls.follower:
+            cls.follower.stop()
+            cls.follower = None
+
+    @classmethod
+    @retrying('warm_cache')
+    def warm_cache(cls, limit=WARM_CACHE_SIZE):
+        """ Reads the first Wishlists into the cache and returns how many """
+        limit = min(limit, cls.cache.maxsize)
+        if limit <= 0:
+            return 0
+        documents, _ = cls.backend.page_all(limit)
+        for document in documents:
+            cls.cache.set(document['_id'], document)
+        return len(documents)
+
+    @classmethod
+    @retrying('create_query_index')
     def create_query_index(cls, field_name, order='asc'):
         """ Creates a new query index for searching """
-        cls.database.create_query_index(index_name=field_name, fields=[{field_name: order}])
+        cls.backend.create_query_index(field_name, order)
+
+    @classmethod
+    @retrying('create_indexes')
+    def create_indexes(cls):
+        """ Creates the declared query indexes that do not exist yet """
+        cls.backend.create_indexes()
+
+    @classmethod
+    @retrying('create_views')
+    def create_views(cls):
+        """ Installs the precomputed views that counts are read from """
+        cls.backend.create_views()
+
+    @staticmethod
+    def parse_selector(selector):
+        """
+        Returns a selector with a single condition per field
+
+        A list of values becomes $in, and the clauses of $and are merged into
+        the fields they are on, so backends and index selection only see plain
+        field conditions that one query can answer
+        """
+        parsed = {}
+        for field, condition in selector.items():
+            if field == '$and':
+                if not isinstance(condition, list):
+                    raise DataValidationError('Invalid query: $and takes a list of selectors')
+                clauses = [Wishlist.parse_selector(clause) for clause in condition]
+            elif field.startswith('$'):
+                raise DataValidationError('Invalid query: unknown operator ' + field)
+            else:
+                clauses = [{field: condition}]
+            for clause in clauses:
+                for name, value in clause.items():
+                    _merge_condition(parsed, name, value)
+        return parsed
+
+    @staticmethod
+    def parse_sort(sort):
+        """ Returns the document keys and direction for field names like -name """
+        keys = []
+        directions = set()
+        for item in sort:
+            name = item.lstrip('-')
+            if name not in FIELDS:
+                raise DataValidationError('Invalid sort: unknown field ' + name)
+            keys.append(FIELDS[name])
+            directions.add('desc' if item.startswith('-') else 'asc')
+        if len(directions) > 1:
+            raise DataValidationError('Invalid sort: fields must all sort the same way')
+        return keys, directions.pop() if directions else 'asc'
+
+    @staticmethod
+    def parse_fields(fields):
+        """ Returns the document keys to fetch for a list of field names """
+        keys = ['_id', '_rev']
+        for name in fields:
+            if name not in FIELDS:
+                raise DataValidationError('Invalid fields: unknown field ' + name)
+            if FIELDS[name] not in keys:
+                keys.append(FIELDS[name])
+        return keys
+
+    @classmethod
+    def save_many(cls, wishlists, batch_size=BULK_BATCH_SIZE):
+        """
+        Saves a list of new Wishlists using _bulk_docs in batches
+
+        Returns a result for each Wishlist in the same order with either
+        the id it was saved under or the error that kept it from saving
+        """
+        results = []
+        for start in range(0, len(wishlists), batch_size):
+            results.extend(cls._save_batch(wishlists[start:start + batch_size]))
+        return results
+
+    @classmethod
+    def _save_batch(cls, wishlists):
+        """ Writes one batch of Wishlists with a single bulk request """
+        results = [None] * len(wishlists)
+        docs = []
+        saved = []
+        for index, wishlist in enumerate(wishlists):
+            if wishlist.name is None:   # name is the only required field
+                results[index] = {'error': 'bad_request',
+                                  'reason': 'name attribute is not set'}
+                continue
+            # assign ids up front so a retried batch cannot create duplicates
+            if not wishlist.id:
+                wishlist.id = uuid.uuid4().hex
+            doc = wishlist.serialize()
+            doc['_id'] = doc.pop('id')
+            docs.append(doc)
+            saved.append(index)
+        for index, row in zip(saved, cls.backend.bulk_save(docs)):
+            if 'error' in row:
+                wishlists[index].id = None
+                results[index] = {'error': row['error'], 'reason': row.get('reason')}
+            else:
+                wishlists[index].rev = row.get('rev')
+                results[index] = {'id': row['id']}
+        return results
 
     @classmethod
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
     def remove_all(cls):
         """ Removes all documents from the database (use for testing)  """
-        for document in cls.database:
-            document.delete()
+        cls.cache.clear()
+        count = 0
+        startkey = None
+        while True:
+            docs, startkey = cls.backend.page_all(BULK_BATCH_SIZE, startkey,
+                                                  include_docs=False)
+            count += cls._delete_batch(docs)
+            if not startkey:
+                return count
 
     @classmethod
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
+    def delete_where(cls, **kwargs):
+        """ Deletes the Wishlists that match the selector and returns the count """
+        count = 0
+        batch = []
+        for doc_id, rev in cls.revisions(**kwargs):
+            batch.append({'_id': doc_id, '_rev': rev})
+            if len(batch) == BULK_BATCH_SIZE:
+                count += cls._delete_batch(batch)
+                batch = []
+        return count + cls._delete_batch(batch)
+
+    @classmethod
+    def revisions(cls, **kwargs):
+        """ Generator that yields the id and revision of matching Wishlists """
+        selector = cls.parse_selector(kwargs)
+        bookmark = None
+        while True:
+            docs, bookmark = cls.backend.find(selector, fields=['_id', '_rev'],
+                                              limit=BULK_BATCH_SIZE, bookmark=bookmark)
+            for doc in docs:
+                yield doc['_id'], doc['_rev']
+            if not bookmark:
+                return
+
+    @classmethod
+    def _delete_batch(cls, docs):
+        """ Deletes documents by _id and _rev with a single bulk request """
+        if not docs:
+            return 0
+        for doc in docs:
+            cls.cache.invalidate(doc['_id'])
+        return cls.backend.bulk_delete(docs)
+
+    @classmethod
+    @timed('all')
     def all(cls):
         """ Query that returns all Wishlists """
-        results = []
-        for doc in cls.database:
-            wishlist = Wishlist().deserialize(doc)
-            wishlist.id = doc['_id']
-            results.append(wishlist)
-        return results
+        return list(cls.iter_all())
+
+    @classmethod
+    def iter_all(cls):
+        """ Generator that yields all Wishlists one page at a time """
+        return cls.iter_by()
+
+    @classmethod
+    def page(cls, limit=PAGE_SIZE, cursor=None, fields=None, sort=None, skip=None,
+             **kwargs):
+        """
+        Returns a page of Wishlists and the cursor for the next page
+
+        Without a selector the page is read in document id order starting at
+        the id held in the cursor. With a selector the page comes from a
+        query and the cursor is the bookmark returned with it. The next
+        cursor is None once the last page has been read.
+
+        fields limits the fields read, sort is a list of field names where
+        a leading - sorts descending and skip only applies to the first page
+        """
+        docs, next_cursor = cls.page_documents(limit, cursor, fields, sort, skip, **kwargs)
+        return [cls.from_document(doc) for doc in docs], next_cursor
+
+    @classmethod
+    @timed('page')
+    @retrying('page')
+    def page_documents(cls, limit=PAGE_SIZE, cursor=None, fields=None, sort=None, skip=None,
+                       **kwargs):
+        """
+        Returns a page of stored documents and the cursor for the next page
+
+        Takes the same arguments as page() but leaves the documents as they
+        were read, so listings can serialize them with serialize_document().
+        Each page is retried on its own, so an error part way through a scan
+        does not read the earlier pages again.
+        """
+        if kwargs or fields or sort or skip:
+            return cls._page_by_query(limit, cursor, cls.parse_selector(kwargs), fields,
+                                      sort, skip)
+        return cls.backend.page_all(limit, cursor)
+
+    @classmethod
+    def _page_by_query(cls, limit, cursor, selector, fields=None, sort=None, skip=None):
+        """ Reads a page of documents from a query using its bookmark """
+        sort_keys, direction = cls.parse_sort(sort or [])
+        keys = cls.parse_fields(fields) if fields else None
+        return cls.backend.find(selector, fields=keys, sort_keys=sort_keys,
+                                direction=direction, limit=limit, bookmark=cursor, skip=skip)
 
 ######################################################################
 #  F I N D E R   M E T H O D S
 ######################################################################
 
     @classmethod
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
-    def find_by(cls, **kwargs):
-        """ Find records using selector """
-        query = Query(cls.database, selector=kwargs)
-        results = []
-        for doc in query.result:
-            wishlist = Wishlist()
-            wishlist.deserialize(doc)
-            results.append(wishlist)
-        return results
+    @timed('find_by')
+    def find_by(cls, fields=None, sort=None, limit=None, skip=None, **kwargs):
+        """
+        Find records using selector
+
+        A field can be given a value, a list of values for $in, or operators
+        like {'$gte': 'a'}. Wishlist.find_by(**{'$and': [...]}) combines
+        selectors into one query.
+        """
+        return list(cls.iter_by(fields, sort, limit, skip, **kwargs))
 
     @classmethod
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
-    def find(cls, wishlist_id):
+    def iter_by(cls, fields=None, sort=None, limit=None, skip=None, **kwargs):
+        """ Generator that yields records using selector one page at a time """
+        from_document = cls.from_document
+        for document in cls.iter_documents(fields, sort, limit, skip, **kwargs):
+            yield from_document(document)
+
+    @classmethod
+    def iter_documents(cls, fields=None, sort=None, limit=None, skip=None, **kwargs):
+        """ Generator that yields stored documents using selector one page at a time """
+        cursor = None
+        remaining = limit
+        while remaining is None or remaining > 0:
+            size = PAGE_SIZE if remaining is None else min(PAGE_SIZE, remaining)
+            docs, cursor = cls.page_documents(size, cursor, fields, sort, skip, **kwargs)
+            for doc in docs:
+                yield doc
+            if remaining is not None:
+                remaining -= len(docs)
+            if not cursor:
+                return
+
+    @classmethod
+    @timed('count')
+    @retrying('count')
+    def count(cls, customer_id=None):
+        """ Returns the number of Wishlists, or only those of a customer """
+        return cls.backend.count(customer_id)
+
+    @classmethod
+    @timed('stats')
+    @retrying('stats')
+    def stats(cls, top=10):
+        """
+        Returns the number of Wishlists and customers, the smallest, largest
+        and mean number of Wishlists per customer, and the top customers
+        """
+        counts = cls.backend.customer_counts()
+        # every Wishlist is counted under its customer_id, so one view read
+        # answers the total as well
+        total = sum(counts.values())
+        ranked = heapq.nsmallest(top, counts.items(), key=lambda item: (-item[1], item[0]))
+        return {
+            'total': total,
+            'customers': len(counts),
+            'per_customer': {
+                'min': min(counts.values()) if counts else 0,
+                'max': max(counts.values()) if counts else 0,
+                'mean': round(float(sum(counts.values())) / len(counts), 2) if counts else 0,
+            },
+            'top_customers': [{'customer_id': customer_id, 'count': count}
+                              for customer_id, count in ranked],
+        }
+
+    @classmethod
+    @timed('find')
+    def find(cls, wishlist_id, cached=True):
         """ Query that finds Wishlists by their id """
-        try:
-            document = cls.database[wishlist_id]
-            return Wishlist().deserialize(document)
-        except KeyError:
-            return None
+        document = cls.cache.get(wishlist_id) if cached else None
+        if document is None:
+            document = cls._fetch(wishlist_id)
+            if document is None:
+                return None
+            cls.cache.set(wishlist_id, document)
+        return Wishlist().deserialize(document)
+
+    @classmethod
+    @timed('find_many')
+    def find_many(cls, wishlist_ids, cached=True):
+        """
+        Finds several Wishlists by id with a single read for those not cached
+
+        Returns the Wishlists found in the order of their ids and the list of
+        ids that were not found. Repeated ids are only looked up once.
+        """
+        wishlist_ids = list(OrderedDict.fromkeys(wishlist_ids))
+        documents = {}
+        if cached:
+            for wishlist_id in wishlist_ids:
+                document = cls.cache.get(wishlist_id)
+                if document is not None:
+                    documents[wishlist_id] = document
+        wanted = [wishlist_id for wishlist_id in wishlist_ids if wishlist_id not in documents]
+        if wanted:
+            for wishlist_id, document in zip(wanted, cls._fetch_many(wanted)):
+                if document is not None:
+                    cls.cache.set(wishlist_id, document)
+                    documents[wishlist_id] = document
+        found = [cls.from_document(documents[wishlist_id])
+                 for wishlist_id in wishlist_ids if wishlist_id in documents]
+        missing = [wishlist_id for wishlist_id in wishlist_ids if wishlist_id not in documents]
+        return found, missing
+
+    @classmethod
+    @retrying('find_many')
+    def _fetch_many(cls, wishlist_ids):
+        """ Reads several documents from the backend in one call """
+        return cls.backend.get_many(wishlist_ids)
+
+    @classmethod
+    @retrying('find')
+    def _fetch(cls, wishlist_id):
+        """ Reads a document from the backend, so cache hits skip the breaker """
+        return cls.backend.get(wishlist_id)
+
+    @classmethod
+    @retrying('revision')
+    def revision(cls, wishlist_id):
+        """ Returns the current revision of a Wishlist without reading it """
+        return cls.backend.revision(wishlist_id)
 
     @classmethod
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
     def find_by_name(cls, name):
         """ Query that finds Wishlists by their name """
         return cls.find_by(name=name)
 
     @classmethod
-    @retry(HTTPError, delay=1, backoff=2, tries=5)
     def find_by_customer_id(cls, customer_id):
         """ Query that finds Wishlists by their customer_id """
         return cls.find_by(customer_id=customer_id)
@@ -226,71 +684,42 @@ class Wishlist(object):
 
 
 ############################################################
-#  C L O U D A N T   D A T A B A S E   C O N N E C T I O N
+#  D A T A B A S E   C O N N E C T I O N
 ############################################################
 
     @staticmethod
     def init_db(dbname='wishlists'):
         """
-        Initialized Coundant database connection
+        Initialized the storage backend named in WISHLIST_BACKEND
+
+        The backend is shared by every thread in the worker, so it is set up
+        under a lock and any backend that was already open is closed first
         """
-        opts = {}
-        vcap_services = {}
-        # Try and get VCAP from the environment or a file if developing
-        #if 'VCAP_SERVICES' in os.environ:
-        #    Wishlist.logger.info('Running in Bluemix mode.')
-        #    vcap_services = json.loads(os.environ['VCAP_SERVICES'])
-        # if VCAP_SERVICES isn't found, maybe we are running on Kubernetes?
-        if 'BINDING_CLOUDANT' in os.environ:
-            Wishlist.logger.info('Found Kubernetes Bindings')
-            creds = json.loads(os.environ['BINDING_CLOUDANT'])
-            vcap_services = {"cloudantNoSQLDB": [{"credentials": creds}]}
-        else:
-            Wishlist.logger.info('VCAP_SERVICES and BINDING_CLOUDANT undefined.')
-            creds = {
-                "username": CLOUDANT_USERNAME,
-                "password": CLOUDANT_PASSWORD,
-                "host": CLOUDANT_HOST,
-                "port": 5984,
-                "url": "http://"+CLOUDANT_HOST+":5984/"
-            }
-            vcap_services = {"cloudantNoSQLDB": [{"credentials": creds}]}
-
-        # Look for Cloudant in VCAP_SERVICES
-        for service in vcap_services:
-            if service.startswith('cloudantNoSQLDB'):
-                cloudant_service = vcap_services[service][0]
-                opts['username'] = cloudant_service['credentials']['username']
-                opts['password'] = cloudant_service['credentials']['password']
-                opts['host'] = cloudant_service['credentials']['host']
-                opts['port'] = cloudant_service['credentials']['port']
-                opts['url'] = cloudant_service['credentials']['url']
-
-        if any(k not in opts for k in ('host', 'username', 'password', 'port', 'url')):
-            Wishlist.logger.info('Error - Failed to retrieve options. ' \
-                             'Check that app is bound to a Cloudant service.')
-            exit(-1)
-
-        Wishlist.logger.info('Cloudant Endpoint: %s', opts['url'])
-        try:
-            if ADMIN_PARTY:
-                Wishlist.logger.info('Running in Admin Party Mode...')
-            Wishlist.client = Cloudant(opts['username'],
-                                  opts['password'],
-                                  url=opts['url'],
-                                  connect=True,
-                                  auto_renew=True,
-                                  admin_party=ADMIN_PARTY
-                                 )
-        except ConnectionError:
-            raise AssertionError('Cloudant service could not be reached')
-
-        # Create database if it doesn't exist
-        try:
-            Wishlist.database = Wishlist.client[dbname]
-        except KeyError:
-            # Create a database using an initialized client
-            Wishlist.database = Wishlist.client.create_database(dbname)
-        # check for success
-        if not Wishlist.database.exists():
-            raise AssertionError('Database [{}] could not be obtained'.format(dbname))
+        # imported here because the backends use the errors defined above
+        from app.backends import get_backend
+        breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT, BREAKER_PROBES)
+        configure(RetryPolicy(RETRY_COUNT, RETRY_DELAY, RETRY_BACKOFF, RETRY_DEADLINE,
+                              breaker=breaker))
+        with Wishlist.lock:
+            if Wishlist.backend:
+                try:
+                    Wishlist.disconnect()
+                except (HTTPError, ConnectionError) as err:
+                    Wishlist.logger.warning('Disconnect failed: %s', err)
+            backend = get_backend(WISHLIST_BACKEND)
+            backend.connect(dbname)
+            Wishlist.backend = backend
+
+            # Make sure queries have the indexes they need
+            Wishlist.create_indexes()
+            Wishlist.create_views()
+
+            # Keep the cache in step with writes from other workers
+            if CHANGES_FOLLOWER:
+                Wishlist.follow_changes()
+            Wishlist.cache.clear()
+            if backend.shared and not Wishlist.follower and not CACHE_WITHOUT_FOLLOWER:
+                Wishlist.logger.info('No changes feed to follow, Wishlists are not cached')
+                Wishlist.cache.maxsize = 0
+            else:
+                Wishlist.cache.maxsize = CACHE_SIZE
@@ -0,0 +1,240 @@
+"""
+Retry policy for calls to the database
+
+A call that fails with a retryable HTTP status (429 or 5xx) is tried again
+after a backoff that grows by a factor on every attempt, with jitter so the
+workers that failed together do not all come back at the same moment. A
+Retry-After header from the server is respected. Errors such as 400, 404
+or 409 are raised at once because sending the same request again cannot
+help.
+
+Every request gets a single time budget. Calls made inside a call that is
+already retrying are not retried themselves, so a save() that calls
+update() makes at most the attempts of one policy, and no retry sleeps
+past the deadline of the request. When the next wait would end after the
+deadline the last error is raised instead.
+
+A circuit breaker sits in front of every attempt. After a run of failures
+that show the database is unavailable it opens, and calls fail at once
+with CircuitOpenError instead of waiting on timeouts. Once it has been
+open for a while a limited number of probe calls are let through, and the
+first one that succeeds closes it again.
+"""
+
+import math
+import time
+import random
+import logging
+import threading
+from functools import wraps
+from email.utils import parsedate_tz, mktime_tz
+from requests import HTTPError, ConnectionError, Timeout
+from app import metrics
+
+# the budget of the request and whether a retry loop is running, per thread
+_state = threading.local()
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling the database while the circuit is open """
+
+    def __init__(self, retry_after=1):
+        """ Constructor """
+        super(CircuitOpenError, self).__init__(
+            'The database is unavailable, try again in {} seconds'.format(retry_after))
+        self.retry_after = retry_after
+
+def unavailable(error):
+    """ Returns True if an error shows the database cannot serve requests """
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    return (isinstance(error, HTTPError) and error.response is not None and
+            error.response.status_code >= 500)
+
+def retryable(error):
+    """ Returns True if an error is worth trying again """
+    if not isinstance(error, HTTPError) or error.response is None:
+        return False
+    code = error.response.status_code
+    return code == 429 or code >= 500
+
+def retry_after(error):
+    """ Returns the seconds a Retry-After header asks to wait, or None """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # otherwise it is an HTTP date
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
+
+def start_budget(seconds=None):
+    """ Starts the time budget of a request on the calling thread """
+    _state.deadline = policy.timer() + (policy.deadline if seconds is None else seconds)
+
+def end_budget():
+    """ Ends the time budget of the request on the calling thread """
+    _state.deadline = None
+
+class CircuitBreaker(object):
+    """ Fails calls fast while the database keeps failing """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, threshold=5, reset_timeout=30, probes=1, timer=time.time):
+        """ Constructor """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probes = probes
+        self.timer = timer
+        self.failures = 0
+        self.opened_at = None
+        self.probing = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """ Returns closed, open or half_open """
+        if self.opened_at is None:
+            return CLOSED
+        if self.timer() < self.opened_at + self.reset_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def retry_after(self):
+        """ Returns the whole seconds until probes are let through """
+        if self.opened_at is None:
+            return 0
+        left = self.opened_at + self.reset_timeout - self.timer()
+        return max(1, int(math.ceil(left)))
+
+    def stats(self):
+        """ Returns the state of the breaker as a dictionary """
+        return {'state': self.state, 'failures': self.failures,
+                'retry_after': self.retry_after()}
+
+    def call(self, function, *args, **kwargs):
+        """ Calls a function unless the circuit is open """
+        with self._lock:
+            state = self.state
+            if state == OPEN or (state == HALF_OPEN and self.probing >= self.probes):
+                raise CircuitOpenError(self.retry_after())
+            probe = state == HALF_OPEN
+            if probe:
+                self.probing += 1
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            self._record(probe, unavailable(error))
+            raise
+        self._record(probe, False)
+        return result
+
+    def _record(self, probe, failed):
+        """ Counts the outcome of a call and opens or closes the circuit """
+        with self._lock:
+            if probe:
+                self.probing -= 1
+            if not failed:
+                if self.opened_at is not None and probe:
+                    self.logger.info('Database is back, closing the circuit')
+                    self.opened_at = None
+                if self.opened_at is None:
+                    self.failures = 0
+                return
+            self.failures += 1
+            if probe or (self.opened_at is None and self.failures >= self.threshold):
+                self.logger.warning('Database failed %d times in a row, opening the '
+                                    'circuit for %s seconds', self.failures,
+                                    self.reset_timeout)
+                self.opened_at = self.timer()
+
+class RetryPolicy(object):
+    """ Retries retryable errors with jittered backoff inside a deadline """
+
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, tries=10, delay=1, backoff=2, deadline=10, max_delay=None,
+                 jitter=True, timer=time.time, sleep=time.sleep, breaker=None):
+        """ Constructor """
+        self.breaker = breaker or CircuitBreaker(timer=timer)
+        self.tries = max(1, tries)
+        self.delay = delay
+        self.backoff = backoff
+        self.deadline = deadline
+        self.max_delay = max_delay if max_delay is not None else deadline
+        self.jitter = jitter
+        self.timer = timer
+        self.sleep = sleep
+
+    def wait(self, attempt, requested=None):
+        """ Returns how long to wait after a failed attempt (counted from 1) """
+        wait = min(self.max_delay, self.delay * self.backoff ** (attempt - 1))
+        if self.jitter:
+            # keep at least half so the backoff still grows
+            wait = wait / 2.0 + random.uniform(0, wait / 2.0)
+        if requested is not None:
+            wait = max(wait, requested)
+        return wait
+
+    def call(self, operation, function, *args, **kwargs):
+        """ Calls a function and retries it while the policy allows """
+        if getattr(_state, 'retrying', False):
+            # the outermost call owns the retries
+            return function(*args, **kwargs)
+        deadline = self.timer() + self.deadline
+        budget = getattr(_state, 'deadline', None)
+        if budget is not None:
+            deadline = min(deadline, budget)
+        _state.retrying = True
+        try:
+            attempt = 1
+            while True:
+                try:
+                    return self.breaker.call(function, *args, **kwargs)
+                except HTTPError as error:
+                    if attempt >= self.tries or not retryable(error):
+                        raise
+                    if self.breaker.state == OPEN:
+                        # waiting cannot help until the circuit lets probes through
+                        raise
+                    wait = self.wait(attempt, retry_after(error))
+                    if self.timer() + wait > deadline:
+                        self.logger.warning('%s failed with %s, no time left to retry',
+                                            operation, error.response.status_code)
+                        raise
+                    self.logger.warning('%s failed with %s, retrying in %.2f seconds',
+                                        operation, error.response.status_code, wait)
+                    metrics.RETRIES.labels(operation).inc()
+                    self.sleep(wait)
+                    attempt += 1
+        finally:
+            _state.retrying = False
+
+# the policy used by @retrying, replaced by configure()
+policy = RetryPolicy()
+
+def configure(new_policy):
+    """ Makes a policy the one every @retrying call uses """
+    global policy # pylint: disable=global-statement,invalid-name
+    policy = new_policy
+
+def retrying(operation):
+    """ Decorator that runs a function under the current retry policy """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            return policy.call(operation, function, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -20,33 +20,82 @@ Wishlist Store Service with UI
 Paths:
 ------
 GET / - Displays a UI for Selenium testing
+GET /metrics - Returns request and database metrics for Prometheus
 GET /wishlists - Returns a list all of the Wishlists
+GET /wishlists?limit={n}&cursor={cursor} - Returns a page of Wishlists
+GET /wishlists?fields={a,b}&sort={-a,b}&skip={n} - Returns selected fields in order
+GET /wishlists?customer_id={a,b}&name={name} - Returns the Wishlists that match every filter
+    (a filter takes comma separated or repeated values and matches any of them)
+GET /wishlists/stats?top={n} - Returns counts of Wishlists and the top customers
+GET /customers/{customer_id}/wishlists/count - Returns how many Wishlists a customer has
 GET /wishlists/{id} - Returns the Wishlist with a given id number
+    (single Wishlists and pages send an ETag and honour If-None-Match; a full
+    filtered list only does for requests that send If-None-Match)
 POST /wishlists - creates a new Wishlist record in the database
+POST /wishlists/bulk - creates a list of new Wishlist records in the database
+POST /wishlists/_lookup - returns the Wishlists with the ids in {"ids": [...]}
 PUT /wishlists/{id} - updates a Wishlist record in the database
+    (send the ETag of the Wishlist in If-Match to update it in one write)
 DELETE /wishlists/{id} - deletes a Wishlist record in the database
+DELETE /wishlists?customer_id={a,b} - deletes the Wishlists of the customers
 """
 
 import sys
+import time
+import hashlib
 import logging
-from flask import jsonify, request, json, url_for, make_response, abort
+from itertools import chain
+from collections import OrderedDict
+from flask import request, url_for, make_response, abort
+from flask import Response, stream_with_context, g
 from flask_api import status    # HTTP Status Codes
 from werkzeug.exceptions import NotFound
-from app.models import Wishlist
+from app.models import Wishlist, DataValidationError, DataConflictError
+from app.models import PAGE_SIZE, MAX_PAGE_SIZE
+from app import metrics, resilience, encoding
+from app.cache import LRUCache
 from . import app
 
 # Error handlers reuire app to be initialized so we must import
 # then only after we have initialized the Flask app instance
 import error_handlers
 
+encoding.use(app.config['RESPONSE_ENCODER'])
+
+# encoded Wishlists by (id, rev); a revision never changes, so an entry
+# cannot go stale and hot reads skip encoding
+RESPONSE_CACHE = LRUCache(app.config['RESPONSE_CACHE_SIZE'], app.config['RESPONSE_CACHE_TTL'])
 
 ######################################################################
 # GET HEALTH CHECK
 ######################################################################
 @app.route('/healthcheck')
 def healthcheck():
-    """ Let them know our heart is still beating """
-    return make_response(jsonify(status=200, message='Healthy'), status.HTTP_200_OK)
+    """
+    Let them know our heart is still beating
+
+    Reports 503 while the circuit breaker in front of the database is open
+    so a load balancer can route around this instance without a query.
+    """
+    breaker = resilience.policy.breaker.stats()
+    if breaker['state'] == resilience.OPEN:
+        resp = make_json_response(dict(status=503, message='Database unavailable',
+                                       circuit=breaker),
+                                  status.HTTP_503_SERVICE_UNAVAILABLE)
+        resp.headers['Retry-After'] = str(breaker['retry_after'])
+        return resp
+    return make_json_response(dict(status=200, message='Healthy', circuit=breaker),
+                              status.HTTP_200_OK)
+
+######################################################################
+# GET METRICS
+######################################################################
+@app.route('/metrics')
+def get_metrics():
+    """ Returns the metrics of every worker in the Prometheus text format """
+    data, content_type = metrics.generate()
+    return Response(data, mimetype=content_type.split(';')[0],
+                    headers={'Content-Type': content_type})
 
 ######################################################################
 # GET INDEX
@@ -65,23 +114,82 @@ def index():
 def list_wishlists():
     """ Returns all of the Wishlists """
     app.logger.info('Request to list Wishlists...')
-    wishlists = []
-    customer_id = request.args.get('customer_id')
-    name = request.args.get('name')
-    if customer_id:
-        app.logger.info('Find by customer_id')
-        wishlists = Wishlist.find_by_customer_id(customer_id)
-    elif name:
-        app.logger.info('Find by name')
-        wishlists = Wishlist.find_by_name(name)
+    filters = get_filters()
+    options = get_query_options()
+    if 'limit' in request.args or 'cursor' in request.args:
+        return list_wishlists_page(filters, options)
+
+    etag = None
+    if filters and request.if_none_match and 'skip' not in options:
+        # the ids and revisions are enough to tell if the list has changed.
+        # They are read before the body, so a write in between can only cost
+        # the client a 200 on its next request, never a wrong 304
+        etag = make_list_etag(Wishlist.revisions(**filters))
+        if etag in request.if_none_match:
+            return make_not_modified_response(etag)
+    if filters:
+        app.logger.info('Find by %s', ', '.join(sorted(filters)))
     else:
         app.logger.info('Find all')
-        wishlists = Wishlist.all()
+    documents = Wishlist.iter_documents(**dict(filters, **options))
 
-    app.logger.info('[%s] Wishlists returned', len(wishlists))
-    results = [wishlist.serialize() for wishlist in wishlists]
-    return make_response(jsonify(results), status.HTTP_200_OK)
+    chunks = stream_json_array(documents, options.get('fields'))
+    # read the first chunk now so database errors still get a proper status
+    first_chunk = next(chunks)
+    response = Response(stream_with_context(chain([first_chunk], chunks)),
+                        status=status.HTTP_200_OK, mimetype='application/json')
+    if etag:
+        response.set_etag(etag)
+    return response
+
+def list_wishlists_page(filters, options):
+    """ Returns one page of Wishlists with a Link to the next page """
+    limit = min(get_int_arg('limit', PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    app.logger.info('Find page of %s after cursor [%s]', limit, cursor)
+    documents, next_cursor = Wishlist.page_documents(limit, cursor,
+                                                     **dict(filters, **options))
+    app.logger.info('[%s] Wishlists returned', len(documents))
+    etag = make_list_etag((doc.get('_id'), doc.get('_rev')) for doc in documents)
+    if etag in request.if_none_match:
+        return make_not_modified_response(etag)
+    serialize = Wishlist.serialize_document
+    results = [serialize(doc, options.get('fields')) for doc in documents]
+    headers = {}
+    if next_cursor:
+        args = request.args.to_dict(flat=False)
+        args.pop('skip', None)
+        args.update(limit=limit, cursor=next_cursor)
+        next_url = url_for('list_wishlists', _external=True, **args)
+        headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    response = make_json_response(results, status.HTTP_200_OK, headers)
+    response.set_etag(etag)
+    return response
+
+
+######################################################################
+# WISHLIST STATISTICS
+######################################################################
+@app.route('/wishlists/stats', methods=['GET'])
+def get_wishlist_stats():
+    """
+    Returns the number of Wishlists and customers and the top customers
+
+    The counts come from views the database keeps up to date, so no
+    Wishlist is read to answer. The view still returns one row per
+    customer, so on Cloudant the request costs O(customers), not O(1)
+    """
+    top = min(get_int_arg('top', 10, 0), MAX_PAGE_SIZE)
+    app.logger.info('Request for Wishlist stats with the top %s customers', top)
+    return make_json_response(Wishlist.stats(top), status.HTTP_200_OK)
 
+@app.route('/customers/<customer_id>/wishlists/count', methods=['GET'])
+def count_customer_wishlists(customer_id):
+    """ Returns how many Wishlists a customer has """
+    app.logger.info('Request to count the Wishlists of customer [%s]', customer_id)
+    count = Wishlist.count(customer_id)
+    return make_json_response({'customer_id': customer_id, 'count': count},
+                              status.HTTP_200_OK)
 
 ######################################################################
 # RETRIEVE A WISHLIST
@@ -94,10 +202,18 @@ def get_wishlists(wishlist_id):
     This endpoint will return a Wishlist based on it's id
     """
     app.logger.info("Request to Retrieve a wishlist with id [%s]", wishlist_id)
+    rev = None
+    if request.if_none_match:
+        # a HEAD request is enough to tell if the client copy is current
+        rev = Wishlist.revision(wishlist_id)
+        if rev and rev in request.if_none_match:
+            return make_not_modified_response(rev)
     wishlist =  Wishlist.find(wishlist_id)
+    if wishlist and rev and wishlist.rev != rev:
+        wishlist = Wishlist.find(wishlist_id, cached=False)
     if not wishlist:
         raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
-    return make_response(jsonify(wishlist.serialize()), status.HTTP_200_OK)
+    return make_wishlist_response(wishlist, status.HTTP_200_OK)
 
 ######################################################################
 # CREATE A NEW WISHLIST  
@@ -125,11 +241,72 @@ def create_wishlists():
     wishlist = Wishlist()
     wishlist.deserialize(data)
     wishlist.save()
+    if not wishlist.id:
+        abort(status.HTTP_503_SERVICE_UNAVAILABLE, 'Wishlist could not be created')
     app.logger.info('Wishlist with new id [%s] saved!', wishlist.id)
-    message = wishlist.serialize()
     location_url = url_for('get_wishlists', wishlist_id=wishlist.id, _external=True)
-    return make_response(jsonify(message), status.HTTP_201_CREATED,
-                         {'Location': location_url})
+    return make_wishlist_response(wishlist, status.HTTP_201_CREATED,
+                                  {'Location': location_url})
+
+
+######################################################################
+# CREATE NEW WISHLISTS IN BULK
+######################################################################
+@app.route('/wishlists/bulk', methods=['POST'])
+def create_wishlists_bulk():
+    """
+    Creates a list of Wishlists
+    This endpoint will create every valid Wishlist in the posted JSON array
+    and return the id or the error for each one in the same order
+    """
+    app.logger.info('Request to Create Wishlists in bulk...')
+    check_content_type('application/json')
+    data = request.get_json()
+    if not isinstance(data, list):
+        abort(status.HTTP_400_BAD_REQUEST, 'Body must be a JSON array of wishlists')
+    results = [None] * len(data)
+    wishlists = []
+    positions = []
+    for index, item in enumerate(data):
+        try:
+            wishlists.append(Wishlist().deserialize(item))
+            positions.append(index)
+        except DataValidationError as error:
+            results[index] = {'error': 'bad_request', 'reason': str(error)}
+    for index, result in zip(positions, Wishlist.save_many(wishlists)):
+        results[index] = result
+    failed = len([result for result in results if 'error' in result])
+    app.logger.info('[%s] Wishlists saved, [%s] failed', len(results) - failed, failed)
+    if failed:
+        return make_json_response(results, status.HTTP_207_MULTI_STATUS)
+    return make_json_response(results, status.HTTP_201_CREATED)
+
+
+######################################################################
+# LOOK UP WISHLISTS BY ID
+######################################################################
+@app.route('/wishlists/_lookup', methods=['POST'])
+def lookup_wishlists():
+    """
+    Retrieves several Wishlists at once
+    This endpoint will return the Wishlists with the ids in the posted
+    {"ids": [...]} in the same order and list the ids that were not found
+    """
+    check_content_type('application/json')
+    data = request.get_json()
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if not isinstance(ids, list) or not all(isinstance(item, basestring) for item in ids):
+        abort(status.HTTP_400_BAD_REQUEST, 'Body must be {"ids": [...]} with string ids')
+    if len(ids) > MAX_PAGE_SIZE:
+        abort(status.HTTP_400_BAD_REQUEST,
+              'No more than {} ids can be looked up at once'.format(MAX_PAGE_SIZE))
+    app.logger.info('Request to look up [%s] Wishlists', len(ids))
+    wishlists, missing = Wishlist.find_many(ids)
+    app.logger.info('[%s] Wishlists found, [%s] missing', len(wishlists), len(missing))
+    # reuse the encoded Wishlists rather than encoding the whole list
+    body = '{{"wishlists":[{}],"missing":{}}}'.format(
+        ','.join(encode_wishlist(wishlist) for wishlist in wishlists), encoding.dumps(missing))
+    return make_encoded_response(body, status.HTTP_200_OK)
 
 
 ######################################################################
@@ -141,18 +318,33 @@ def update_wishlists(wishlist_id):
     Update a Wishlist
 
     This endpoint will update a Wishlist based the body that is posted
+    When an If-Match header carries the Wishlist ETag the update is written
+    directly against that revision and fails with 412 if it is out of date
     """
     app.logger.info('Request to Update a wishlist with id [%s]', wishlist_id)
     check_content_type('application/json')
-    wishlist = Wishlist.find(wishlist_id)
-    if not wishlist:
-        raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
     data = request.get_json()
     app.logger.info(data)
+    revisions = list(request.if_match)
+    if revisions:
+        wishlist = Wishlist()
+        wishlist.deserialize(data)
+        wishlist.id = wishlist_id
+        wishlist.rev = revisions[0]
+        try:
+            wishlist.save()
+        except DataConflictError as error:
+            abort(status.HTTP_412_PRECONDITION_FAILED, str(error))
+        return make_wishlist_response(wishlist, status.HTTP_200_OK)
+
+    # read the current revision so the write cannot overwrite a newer one
+    wishlist = Wishlist.find(wishlist_id, cached=False)
+    if not wishlist:
+        raise NotFound("Wishlist with id '{}' was not found.".format(wishlist_id))
     wishlist.deserialize(data)
     wishlist.id = wishlist_id
     wishlist.save()
-    return make_response(jsonify(wishlist.serialize()), status.HTTP_200_OK)
+    return make_wishlist_response(wishlist, status.HTTP_200_OK)
 
 ######################################################################
 # DELETE A WISHLIST
@@ -170,6 +362,25 @@ def delete_wishlists(wishlist_id):
         wishlist.delete()
     return make_response('', status.HTTP_204_NO_CONTENT)
 
+######################################################################
+# DELETE WISHLISTS THAT MATCH A FILTER
+######################################################################
+@app.route('/wishlists', methods=['DELETE'])
+def delete_wishlists_where():
+    """
+    Delete Wishlists by filter
+
+    This endpoint will delete every Wishlist that matches the customer_id
+    and/or name filters given in the query string
+    """
+    filters = get_filters()
+    app.logger.info('Request to Delete wishlists matching %s', filters)
+    if not filters:
+        abort(status.HTTP_400_BAD_REQUEST, 'A customer_id or name filter is required')
+    count = Wishlist.delete_where(**filters)
+    app.logger.info('[%s] Wishlists deleted', count)
+    return make_response('', status.HTTP_204_NO_CONTENT)
+
 ######################################################################
 # PURCHASE A PET
 ######################################################################
@@ -199,10 +410,56 @@ def wishlists_reset():
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
-@app.before_first_request
+@app.before_request
+def start_request_timer():
+    """ Notes when the request started and counts it as in flight """
+    g.request_started = time.time()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request_metrics(response):
+    """ Records the route, status and latency of the request """
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        method, status_code = request.method, response.status_code
+        def record():
+            metrics.observe_request(method, endpoint, status_code, time.time() - started)
+        if response.is_streamed:
+            # a streamed body is still being read from the database here, so
+            # the request is timed when the server has sent all of it
+            response.call_on_close(record)
+        else:
+            record()
+    return response
+
+@app.teardown_request
+def end_request_timer(error=None):
+    """ Stops counting the request as in flight """
+    if g.pop('request_started', None) is not None:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+
+@app.before_request
+def start_retry_budget():
+    """ Gives the database retries of the request one time budget """
+    resilience.start_budget()
+
+@app.teardown_request
+def end_retry_budget(error=None):
+    """ Ends the retry budget of the request """
+    resilience.end_budget()
+
 def init_db(dbname="wishlists"):
-    """ Initlaize the model """
+    """
+    Initialize the model and warm its cache
+
+    Called once per worker before it accepts traffic (see the post_worker_init
+    hook in gunicorn.conf.py) so no request pays for connecting. An error
+    here is raised so the worker fails to boot.
+    """
     Wishlist.init_db(dbname)
+    count = Wishlist.warm_cache()
+    app.logger.info('Database %s ready, %d Wishlists cached', dbname, count)
 
 # load sample data
 def data_load(payload):
@@ -214,6 +471,104 @@ def data_reset():
     """ Removes all Wishlists from the database """
     Wishlist.remove_all()
 
+def make_wishlist_response(wishlist, status_code, headers=None):
+    """ Makes a response for a single Wishlist with its revision as the ETag """
+    response = make_encoded_response(encode_wishlist(wishlist), status_code, headers)
+    if wishlist.rev:
+        response.set_etag(wishlist.rev)
+    return response
+
+def encode_wishlist(wishlist):
+    """ Returns the JSON of a Wishlist, reusing it while the revision is the same """
+    if not (wishlist.id and wishlist.rev):
+        return encoding.dumps(wishlist.serialize())
+    key = (wishlist.id, wishlist.rev)
+    body = RESPONSE_CACHE.get(key)
+    if body is None:
+        body = encoding.dumps(wishlist.serialize())
+        RESPONSE_CACHE.set(key, body)
+    return body
+
+def make_json_response(data, status_code, headers=None):
+    """ Makes a JSON response with the encoder in use """
+    return make_encoded_response(encoding.dumps(data), status_code, headers)
+
+def make_encoded_response(body, status_code, headers=None):
+    """ Makes a JSON response from a body that is already encoded """
+    return Response(body, status=status_code, headers=headers,
+                    mimetype=encoding.MIMETYPE)
+
+def make_not_modified_response(etag):
+    """ Makes an empty 304 response telling the client its copy is current """
+    response = make_response('', status.HTTP_304_NOT_MODIFIED)
+    response.set_etag(etag)
+    return response
+
+def make_list_etag(revisions):
+    """ Returns an ETag for a list from the ids and revisions in it """
+    # the query string changes which fields and order are sent
+    digest = hashlib.sha1(request.query_string)
+    for doc_id, rev in revisions:
+        digest.update('{}:{}\n'.format(doc_id, rev).encode('utf-8'))
+    return digest.hexdigest()
+
+def stream_json_array(documents, fields=None, chunk_size=PAGE_SIZE):
+    """ Generator that encodes stored Wishlist documents as a JSON array in chunks """
+    serialize = Wishlist.serialize_document
+    dumps = encoding.dumps
+    count = 0
+    chunk = ['[']
+    for document in documents:
+        if count:
+            chunk.append(',')
+        chunk.append(dumps(serialize(document, fields)))
+        count += 1
+        if count % chunk_size == 0:
+            yield ''.join(chunk)
+            chunk = []
+    chunk.append(']')
+    app.logger.info('[%s] Wishlists returned', count)
+    yield ''.join(chunk)
+
+def get_filters():
+    """
+    Returns the selector for the customer_id and name query parameters
+
+    A parameter can be repeated or hold comma separated values, and several
+    values match any of them with $in, so the whole filter is one query
+    """
+    filters = {}
+    for field in ('customer_id', 'name'):
+        values = [value.strip() for arg in request.args.getlist(field)
+                  for value in arg.split(',')]
+        values = list(OrderedDict.fromkeys(value for value in values if value))
+        if len(values) == 1:
+            filters[field] = values[0]
+        elif values:
+            filters[field] = {'$in': values}
+    return filters
+
+def get_query_options():
+    """ Returns the fields, sort and skip query parameters of a listing """
+    options = {}
+    for name in ('fields', 'sort'):
+        if request.args.get(name):
+            options[name] = request.args.get(name).split(',')
+    if 'skip' in request.args:
+        options['skip'] = get_int_arg('skip', 0, 0)
+    return options
+
+def get_int_arg(name, default, minimum):
+    """ Returns an integer query parameter that is at least the minimum """
+    value = request.args.get(name, str(default))
+    try:
+        value = int(value)
+    except ValueError:
+        abort(status.HTTP_400_BAD_REQUEST, '{} must be an integer'.format(name))
+    if value < minimum:
+        abort(status.HTTP_400_BAD_REQUEST, '{} must be at least {}'.format(name, minimum))
+    return value
+
 def check_content_type(content_type):
     """ Checks that the media type is correct """
     if 'Content-Type' not in request.headers:
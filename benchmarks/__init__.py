@@ -0,0 +1,6 @@
+"""
+Performance benchmarks for the Wishlist service
+
+These are not part of the test suite. Run them by hand or in CI to compare
+throughput and latency between changes.
+"""
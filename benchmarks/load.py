@@ -0,0 +1,320 @@
+"""
+Load generator for the Wishlist REST API
+
+Drives the service with a number of concurrent clients that each pick
+requests from a weighted mix of endpoints, then prints a JSON report with
+the throughput and the p50, p95 and p99 latency of every endpoint.
+
+Without --url the Flask app is driven in process through its test client,
+on the memory backend unless WISHLIST_BACKEND says otherwise, so no
+CouchDB or gunicorn is needed. With --url the requests go over HTTP to a
+running server.
+
+    python -m benchmarks.load --concurrency 8 --duration 10
+    python -m benchmarks.load --url http://localhost:5000 --requests 5000
+    python -m benchmarks.load --mix list=1,get=6,create=1,update=1,delete=1
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+import requests
+
+# endpoints and how often each is called unless --mix says otherwise
+DEFAULT_MIX = {
+    'list': 10,
+    'get': 50,
+    'create': 15,
+    'update': 15,
+    'delete': 10,
+}
+
+# the endpoint each request kind exercises, used as the report key
+ENDPOINTS = {
+    'list': 'GET /wishlists',
+    'get': 'GET /wishlists/<id>',
+    'create': 'POST /wishlists',
+    'update': 'PUT /wishlists/<id>',
+    'delete': 'DELETE /wishlists/<id>',
+}
+
+class HTTPClient(object):
+    """ Sends requests to a running server """
+
+    def __init__(self, url):
+        """ Constructor """
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, body=None):
+        """ Sends a request and returns the status code and JSON body """
+        resp = self.session.request(method, self.url + path, json=body)
+        try:
+            data = resp.json()
+        except ValueError:
+            data = None
+        return resp.status_code, data
+
+class AppClient(object):
+    """ Sends requests to the Flask app in this process """
+
+    def __init__(self, app):
+        """ Constructor """
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        """ Sends a request and returns the status code and JSON body """
+        if body is None:
+            resp = self.client.open(path, method=method)
+        else:
+            resp = self.client.open(path, method=method, data=json.dumps(body),
+                                    content_type='application/json')
+        data = json.loads(resp.data) if resp.data else None
+        return resp.status_code, data
+
+class IdPool(object):
+    """ Ids of Wishlists the clients have created and not yet deleted """
+
+    def __init__(self):
+        """ Constructor """
+        self.ids = []
+        self.lock = threading.Lock()
+
+    def add(self, wishlist_id):
+        """ Adds an id to the pool """
+        with self.lock:
+            self.ids.append(wishlist_id)
+
+    def pick(self, rand):
+        """ Returns a random id or None if the pool is empty """
+        with self.lock:
+            return rand.choice(self.ids) if self.ids else None
+
+    def take(self, rand):
+        """ Removes a random id from the pool and returns it """
+        with self.lock:
+            if not self.ids:
+                return None
+            index = rand.randrange(len(self.ids))
+            self.ids[index], self.ids[-1] = self.ids[-1], self.ids[index]
+            return self.ids.pop()
+
+class Worker(threading.Thread):
+    """ One client that sends requests until it is told to stop """
+
+    def __init__(self, client, mix, pool, rand, deadline=None, budget=None):
+        """ Constructor """
+        super(Worker, self).__init__()
+        self.daemon = True
+        self.client = client
+        self.kinds = [kind for kind, weight in mix for _ in range(weight)]
+        self.pool = pool
+        self.rand = rand
+        self.deadline = deadline
+        self.budget = budget
+        self.samples = dict((kind, []) for kind, _ in mix)
+        self.errors = dict((kind, 0) for kind, _ in mix)
+
+    def run(self):
+        """ Sends requests and records how long each one took """
+        while not self.finished():
+            kind = self.rand.choice(self.kinds)
+            started = time.time()
+            try:
+                ok = getattr(self, 'do_' + kind)()
+            except Exception: # pylint: disable=broad-except
+                ok = False
+            self.samples[kind].append(time.time() - started)
+            if not ok:
+                self.errors[kind] += 1
+
+    def finished(self):
+        """ Returns True once the time or request budget has been used """
+        if self.deadline is not None and time.time() >= self.deadline:
+            return True
+        if self.budget is not None:
+            with self.budget['lock']:
+                if self.budget['left'] <= 0:
+                    return True
+                self.budget['left'] -= 1
+        return False
+
+    def new_wishlist(self):
+        """ Returns the body of a random Wishlist """
+        return {'name': 'list-{}'.format(self.rand.randrange(1000)),
+                'customer_id': str(self.rand.randrange(100))}
+
+    def do_list(self):
+        """ GET /wishlists for a random customer """
+        code, _ = self.client.request(
+            'GET', '/wishlists?customer_id={}'.format(self.rand.randrange(100)))
+        return code == 200
+
+    def do_get(self):
+        """ GET /wishlists/<id> """
+        wishlist_id = self.pool.pick(self.rand)
+        if wishlist_id is None:
+            return self.do_create()
+        code, _ = self.client.request('GET', '/wishlists/' + wishlist_id)
+        # another client may have deleted it
+        return code in (200, 404)
+
+    def do_create(self):
+        """ POST /wishlists """
+        code, data = self.client.request('POST', '/wishlists', self.new_wishlist())
+        if code == 201:
+            self.pool.add(data['id'])
+        return code == 201
+
+    def do_update(self):
+        """ PUT /wishlists/<id> """
+        wishlist_id = self.pool.pick(self.rand)
+        if wishlist_id is None:
+            return self.do_create()
+        code, _ = self.client.request('PUT', '/wishlists/' + wishlist_id,
+                                      self.new_wishlist())
+        return code in (200, 404, 409)
+
+    def do_delete(self):
+        """ DELETE /wishlists/<id> """
+        wishlist_id = self.pool.take(self.rand)
+        if wishlist_id is None:
+            return self.do_create()
+        code, _ = self.client.request('DELETE', '/wishlists/' + wishlist_id)
+        return code == 204
+
+def percentile(samples, fraction):
+    """ Returns the nearest rank percentile of sorted samples """
+    if not samples:
+        return None
+    rank = int(math.ceil(fraction * len(samples))) - 1
+    return samples[max(0, min(rank, len(samples) - 1))]
+
+def summarize(samples, errors, elapsed):
+    """ Returns the counts, throughput and latencies in milliseconds """
+    samples = sorted(samples)
+    def millis(seconds):
+        return round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else None,
+        'mean_ms': millis(sum(samples) / len(samples)) if samples else None,
+        'p50_ms': millis(percentile(samples, 0.50)),
+        'p95_ms': millis(percentile(samples, 0.95)),
+        'p99_ms': millis(percentile(samples, 0.99)),
+        'max_ms': millis(samples[-1]) if samples else None,
+    }
+
+def parse_mix(text):
+    """ Parses a mix like get=6,list=1 into (kind, weight) pairs """
+    mix = []
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in ENDPOINTS:
+            raise ValueError('Unknown request kind {}, use one of {}'.format(
+                kind, ', '.join(sorted(ENDPOINTS))))
+        if int(weight) > 0:
+            mix.append((kind, int(weight)))
+    if not mix:
+        raise ValueError('The mix has no request with a weight above 0')
+    return mix
+
+def make_client_factory(url=None):
+    """ Returns a function that makes one client per worker """
+    if url:
+        return lambda: HTTPClient(url)
+    from app import app, server, models
+    # use the stand-in store unless a backend was chosen on purpose
+    models.WISHLIST_BACKEND = os.environ.get('WISHLIST_BACKEND', 'memory')
+    logging.disable(logging.INFO)
+    app.logger.setLevel(logging.WARNING)
+    server.init_db()
+    return lambda: AppClient(app)
+
+def run_benchmark(url=None, concurrency=4, duration=None, count=1000, mix=None,
+                  preload=100, seed=None):
+    """
+    Runs the load and returns the report as a dictionary
+
+    The run lasts for duration seconds, or until count requests have been
+    sent when no duration is given. mix is a list of (kind, weight) pairs.
+    """
+    mix = mix or sorted(DEFAULT_MIX.items())
+    new_client = make_client_factory(url)
+    pool = IdPool()
+    rand = random.Random(seed)
+
+    # start with some Wishlists so reads have something to find
+    loader = Worker(new_client(), [('create', 1)], pool, random.Random(rand.random()))
+    for _ in range(preload):
+        loader.do_create()
+
+    deadline = time.time() + duration if duration else None
+    budget = None
+    if not duration:
+        budget = {'left': count, 'lock': threading.Lock()}
+    workers = [Worker(new_client(), mix, pool, random.Random(rand.random()),
+                      deadline, budget) for _ in range(concurrency)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - started
+
+    endpoints = {}
+    everything = []
+    total_errors = 0
+    for kind, _ in mix:
+        samples = [sample for worker in workers for sample in worker.samples[kind]]
+        errors = sum(worker.errors[kind] for worker in workers)
+        everything.extend(samples)
+        total_errors += errors
+        endpoints[ENDPOINTS[kind]] = summarize(samples, errors, elapsed)
+    return {
+        'target': url or 'in-process ({} backend)'.format(
+            os.environ.get('WISHLIST_BACKEND', 'memory')),
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'mix': dict(mix),
+        'total': summarize(everything, total_errors, elapsed),
+        'endpoints': endpoints,
+    }
+
+def main(argv=None):
+    """ Parses the command line, runs the load and prints the report """
+    parser = argparse.ArgumentParser(description='Load test the Wishlist API')
+    parser.add_argument('--url', help='base URL of a running server (default: in process)')
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients')
+    parser.add_argument('--duration', type=float, help='seconds to run for')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='total requests to send when no duration is given')
+    parser.add_argument('--mix', type=parse_mix,
+                        default=','.join('{}={}'.format(kind, weight)
+                                         for kind, weight in sorted(DEFAULT_MIX.items())),
+                        help='weights of list, get, create, update and delete')
+    parser.add_argument('--preload', type=int, default=100,
+                        help='Wishlists to create before the run')
+    parser.add_argument('--seed', type=int, help='seed for a repeatable request order')
+    parser.add_argument('--output', help='file to write the JSON report to')
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.url, args.concurrency, args.duration, args.requests,
+                           args.mix, args.preload, args.seed)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + '\n')
+    sys.stdout.write(text + '\n')
+    return 1 if report['total']['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
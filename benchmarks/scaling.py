@@ -0,0 +1,201 @@
+"""
+Data size scaling benchmark for the listing and query paths
+
+Seeds a local store with a growing number of Wishlists and, at each size,
+measures how long each listing path takes and how much memory it needs:
+
+    all                 Wishlist.all()
+    find_by_customer    Wishlist.find_by_customer_id() for one customer
+    page                Wishlist.page() for the first page
+    get_list            GET /wishlists read to the end of the response
+    get_list_customer   GET /wishlists?customer_id=... read to the end
+
+Every measurement runs in a forked child so one path cannot leave memory
+behind for the next. Peak memory comes from tracemalloc where Python has
+it. Otherwise it is how far the child's resident set size peaks above
+where it started, after the kernel's high water mark has been reset.
+live_objects counts the objects the path leaves alive while its result is
+held, which shows how much a path materializes. The results are printed
+as a table and can be written as JSON.
+
+    python -m benchmarks.scaling --sizes 10000,100000,1000000
+    python -m benchmarks.scaling --backend sqlite --paths all,page --output scaling.json
+"""
+
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import multiprocessing
+
+try:
+    import tracemalloc
+except ImportError:     # Python 2 has no tracemalloc
+    tracemalloc = None
+
+PATHS = ['all', 'find_by_customer', 'page', 'get_list', 'get_list_customer']
+
+def memory_status(name):
+    """ Returns a memory figure in KB from /proc/self/status like VmRSS """
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(name + ':'):
+                return int(line.split()[1])
+    return None
+
+def reset_peak_rss():
+    """ Resets the peak resident set size the kernel reports in VmHWM """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def run_path(path, customer_id):
+    """ Runs one listing path and returns what it produced """
+    from app import app
+    from app.models import Wishlist
+    if path == 'all':
+        return Wishlist.all()
+    if path == 'find_by_customer':
+        return Wishlist.find_by_customer_id(customer_id)
+    if path == 'page':
+        return Wishlist.page()[0]
+    client = app.test_client()
+    url = '/wishlists'
+    if path == 'get_list_customer':
+        url += '?customer_id=' + customer_id
+    resp = client.get(url)
+    return resp.get_data()
+
+def measure(path, customer_id):
+    """ Measures one run of a path in the calling process """
+    gc.collect()
+    objects_before = len(gc.get_objects())
+    if tracemalloc:
+        source = 'tracemalloc'
+        tracemalloc.start()
+    elif reset_peak_rss():
+        source = 'VmHWM'
+        rss_before = memory_status('VmRSS')
+    else:
+        # ru_maxrss is in KB on Linux but also holds the parent's peak
+        source = 'ru_maxrss'
+        rss_before = memory_status('VmRSS')
+    started = time.time()
+    result = run_path(path, customer_id)
+    elapsed = time.time() - started
+    if source == 'tracemalloc':
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_kb = peak // 1024
+    elif source == 'VmHWM':
+        peak_kb = memory_status('VmHWM') - rss_before
+    else:
+        peak_kb = max(0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before)
+    live_objects = len(gc.get_objects()) - objects_before
+    stats = {
+        'path': path,
+        'seconds': round(elapsed, 4),
+        'peak_kb': peak_kb,
+        'peak_source': source,
+        'live_objects': live_objects,
+    }
+    if isinstance(result, bytes):
+        stats['bytes'] = len(result)
+        result = json.loads(result)
+    stats['results'] = len(result)
+    return stats
+
+def measure_in_child(path, customer_id, dbname):
+    """ Measures a path in a forked child and returns its numbers """
+    parent, child = multiprocessing.Pipe()
+    def target():
+        from app.models import Wishlist
+        # connections must not be shared with the parent
+        Wishlist.init_db(dbname)
+        child.send(measure(path, customer_id))
+        child.close()
+    process = multiprocessing.Process(target=target)
+    process.start()
+    stats = parent.recv()
+    process.join()
+    return stats
+
+def seed(size, customers, batch_size=10000):
+    """ Fills the store with size Wishlists spread over the customers """
+    from app.models import Wishlist
+    Wishlist.remove_all()
+    for start in range(0, size, batch_size):
+        Wishlist.save_many([Wishlist('list-{}'.format(number), str(number % customers))
+                            for number in range(start, min(size, start + batch_size))],
+                           batch_size)
+
+def run_scaling(sizes, paths=None, backend='memory', customers=1000, dbname='scaling'):
+    """ Seeds each size, measures every path and returns the rows """
+    from app import app, server, models
+    from app.models import Wishlist
+    models.WISHLIST_BACKEND = backend
+    logging.disable(logging.INFO)
+    app.logger.setLevel(logging.WARNING)
+    server.init_db(dbname)
+    rows = []
+    for size in sizes:
+        started = time.time()
+        seed(size, customers)
+        seconds = time.time() - started
+        for path in paths or PATHS:
+            stats = measure_in_child(path, '0', dbname)
+            stats['size'] = size
+            stats['seed_seconds'] = round(seconds, 2)
+            stats['us_per_result'] = round(stats['seconds'] * 1e6 / stats['results'], 2) \
+                if stats['results'] else None
+            rows.append(stats)
+    Wishlist.remove_all()
+    return rows
+
+def format_table(rows):
+    """ Returns the rows as a plain text table """
+    columns = ['size', 'path', 'results', 'seconds', 'us_per_result', 'peak_kb',
+               'live_objects']
+    cells = [columns] + [[str(row[column]) for column in columns] for row in rows]
+    widths = [max(len(line[index]) for line in cells) for index in range(len(columns))]
+    lines = []
+    for number, line in enumerate(cells):
+        lines.append('  '.join(cell.rjust(width) for cell, width in zip(line, widths)))
+        if number == 0:
+            lines.append('  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    """ Parses the command line, runs the benchmark and prints the table """
+    parser = argparse.ArgumentParser(description='Measure listing paths at several sizes')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma separated store sizes')
+    parser.add_argument('--paths', default=','.join(PATHS),
+                        help='comma separated paths from ' + ', '.join(PATHS))
+    parser.add_argument('--backend', default='memory', choices=['memory', 'sqlite'],
+                        help='local store to seed')
+    parser.add_argument('--customers', type=int, default=1000,
+                        help='customers the Wishlists are spread over')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    paths = args.paths.split(',')
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        parser.error('unknown paths: ' + ', '.join(sorted(unknown)))
+
+    rows = run_scaling(sizes, paths, args.backend, args.customers)
+    sys.stdout.write(format_table(rows) + '\n')
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(rows, output, indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
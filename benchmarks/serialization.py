@@ -0,0 +1,114 @@
+"""
+Microbenchmark for turning stored documents into API output
+
+Measures how many documents per second each way of serializing a listing
+can handle, with nothing else in the loop:
+
+    model           Wishlist().deserialize(doc).serialize()
+    from_document   Wishlist.from_document(doc).serialize()
+    document        Wishlist.serialize_document(doc)
+
+Log records go to os.devnull at the chosen level, so the cost of logging
+in the loop is counted the way a production worker would pay it. The size
+of one Wishlist instance is printed too.
+
+    python -m benchmarks.serialization --documents 100000 --repeat 5
+"""
+
+import gc
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+PATHS = ['model', 'from_document', 'document']
+
+def make_documents(count, customers=100):
+    """ Returns stored documents like the backends read them """
+    return [{'_id': '{:032x}'.format(number), '_rev': '1-{:032x}'.format(number),
+             'name': 'list-{}'.format(number), 'customer_id': str(number % customers)}
+            for number in range(count)]
+
+def serializer(path):
+    """ Returns a function that serializes one document along a path """
+    from app.models import Wishlist
+    if path == 'model':
+        return lambda doc: Wishlist().deserialize(doc).serialize()
+    if path == 'from_document':
+        return lambda doc: Wishlist.from_document(doc).serialize()
+    return Wishlist.serialize_document
+
+def instance_bytes():
+    """ Returns the memory held by one Wishlist and its attribute dict """
+    from app.models import Wishlist
+    wishlist = Wishlist('list', '1')
+    size = sys.getsizeof(wishlist)
+    if hasattr(wishlist, '__dict__'):
+        size += sys.getsizeof(wishlist.__dict__)
+    return size
+
+def measure(path, documents, repeat=3):
+    """ Returns the best documents per second over several runs of a path """
+    serialize = serializer(path)
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.time()
+        for doc in documents:
+            serialize(doc)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'path': path,
+        'documents': len(documents),
+        'seconds': round(best, 4),
+        'docs_per_sec': int(len(documents) / best) if best else None,
+    }
+
+def run_serialization(count=100000, paths=None, repeat=3, log_level=logging.INFO):
+    """ Measures every path and returns the rows """
+    from app.models import Wishlist
+    handler = logging.FileHandler(os.devnull)
+    Wishlist.logger.addHandler(handler)
+    Wishlist.logger.setLevel(log_level)
+    Wishlist.logger.propagate = False
+    try:
+        documents = make_documents(count)
+        return [measure(path, documents, repeat) for path in paths or PATHS]
+    finally:
+        Wishlist.logger.removeHandler(handler)
+        Wishlist.logger.propagate = True
+        handler.close()
+
+def main(argv=None):
+    """ Parses the command line, runs the benchmark and prints the results """
+    parser = argparse.ArgumentParser(description='Measure document serialization')
+    parser.add_argument('--documents', type=int, default=100000,
+                        help='documents to serialize per run')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per path, best is kept')
+    parser.add_argument('--paths', default=','.join(PATHS),
+                        help='comma separated paths from ' + ', '.join(PATHS))
+    parser.add_argument('--log-level', default='INFO',
+                        help='level the model logs at during the runs')
+    parser.add_argument('--output', help='file to write the JSON results to')
+    args = parser.parse_args(argv)
+    paths = args.paths.split(',')
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        parser.error('unknown paths: ' + ', '.join(sorted(unknown)))
+
+    rows = run_serialization(args.documents, paths, args.repeat,
+                             getattr(logging, args.log_level.upper()))
+    for row in rows:
+        sys.stdout.write('{path:>14}  {docs_per_sec:>10} docs/s  {seconds}s\n'.format(**row))
+    sys.stdout.write('{:>14}  {} bytes\n'.format('instance', instance_bytes()))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'paths': rows, 'instance_bytes': instance_bytes()}, output,
+                      indent=2, sort_keys=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,10 @@
+import os
 import logging
 SECRET_KEY = 'secret-for-dev'
 LOGGING_LEVEL = logging.INFO
+
+# JSON encoder for response bodies, one of the names in app.encoding
+RESPONSE_ENCODER = os.environ.get('RESPONSE_ENCODER', 'json')
+# encoded Wishlists kept by id and revision (size 0 turns it off)
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
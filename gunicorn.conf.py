@@ -0,0 +1,66 @@
+"""
+Gunicorn configuration
+
+Workers default to the threaded (gthread) class so that one worker can keep
+several requests waiting on Cloudant at the same time. Every setting can be
+overridden from the environment:
+
+    GUNICORN_WORKER_CLASS   worker class (default gthread, use sync to opt out)
+    GUNICORN_WORKERS        number of worker processes (default 2)
+    GUNICORN_THREADS        threads per worker (default CLOUDANT_POOL_SIZE)
+    GUNICORN_WORKER_CONNECTIONS
+                            open connections per gevent worker (default 1000),
+                            also the default CLOUDANT_POOL_SIZE for gevent
+    PROMETHEUS_MULTIPROC_DIR
+                            where workers share metrics (default a new temp dir)
+
+Each worker connects to the database, checks its indexes and warms its
+cache in post_worker_init, before it accepts any request. If that fails the
+worker exits with a boot error and gunicorn shuts down instead of serving
+requests that cannot succeed.
+"""
+import os
+import tempfile
+
+bind = '0.0.0.0:' + os.getenv('PORT', '5000')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('GUNICORN_WORKERS', '2'))
+# one pooled connection per thread so no request waits for a socket; the
+# changes feed follower gets a connection on top of these
+threads = int(os.getenv('GUNICORN_THREADS', os.getenv('CLOUDANT_POOL_SIZE', '10')))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+# only used by the gevent worker class
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+# a gevent worker runs up to worker_connections requests at once, and with
+# a smaller blocking pool the rest would queue for a Cloudant connection;
+# workers are forked after this, so they read the size from the environment
+if worker_class == 'gevent' and not os.getenv('CLOUDANT_POOL_SIZE'):
+    os.environ['CLOUDANT_POOL_SIZE'] = str(worker_connections)
+
+# workers write their Prometheus samples here so /metrics can add them up
+METRICS_DIR = (os.getenv('PROMETHEUS_MULTIPROC_DIR') or
+               tempfile.mkdtemp(prefix='wishlist-metrics-'))
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = METRICS_DIR
+os.environ['prometheus_multiproc_dir'] = METRICS_DIR
+
+def on_starting(server):
+    """ Clears metrics left behind by an earlier run """
+    if not os.path.isdir(METRICS_DIR):
+        os.makedirs(METRICS_DIR)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.db'):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+def child_exit(server, worker):
+    """ Drops the live gauges of a worker that has exited """
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+def post_worker_init(worker):
+    """ Gets the database ready before the worker accepts requests """
+    # runs after the app is loaded and gevent has patched the worker, so
+    # the connections made here are the ones the requests will use
+    from app import server
+    server.init_db()
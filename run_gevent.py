@@ -0,0 +1,29 @@
+"""
+Wishlist Service Runner for gevent
+
+Serves the same Flask app as run.py from a gevent WSGI server. The standard
+library is monkey patched before anything else is imported so that calls to
+Cloudant yield instead of blocking, and one process can serve many
+concurrent requests without a thread for each.
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import os
+from gevent.pywsgi import WSGIServer
+from app import app, server
+
+# Pull options from environment
+PORT = os.getenv('PORT', '5000')
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == "__main__":
+    print "****************************************"
+    print " W I S H L I S T   S E R V I C E   R U N N I N G   (gevent)"
+    print "****************************************"
+    server.initialize_logging()
+    server.init_db()
+    WSGIServer(('0.0.0.0', int(PORT)), app).serve_forever()
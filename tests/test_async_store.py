@@ -0,0 +1,95 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Async Wishlist Store Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import time
+import unittest
+import gevent
+from mock import MagicMock
+from app.async_store import AsyncWishlistStore
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAsyncWishlistStore(unittest.TestCase):
+    """ Test Cases for the gevent Wishlist store """
+
+    def setUp(self):
+        self.model = MagicMock()
+        self.store = AsyncWishlistStore(size=10, model=self.model)
+
+    def test_find(self):
+        """ Find a Wishlist in a greenlet """
+        self.model.find.return_value = 'wishlist'
+        greenlet = self.store.find('123')
+        self.assertEqual(greenlet.get(), 'wishlist')
+        self.model.find.assert_called_with('123')
+
+    def test_find_by(self):
+        """ Find Wishlists by field in a greenlet """
+        self.model.find_by.return_value = ['a', 'b']
+        greenlet = self.store.find_by(customer_id='1')
+        self.assertEqual(greenlet.get(), ['a', 'b'])
+        self.model.find_by.assert_called_with(customer_id='1')
+
+    def test_all(self):
+        """ List all Wishlists in a greenlet """
+        self.model.all.return_value = []
+        self.assertEqual(self.store.all().get(), [])
+
+    def test_save_and_delete(self):
+        """ Save and delete a Wishlist in greenlets """
+        wishlist = MagicMock()
+        self.assertIs(self.store.save(wishlist).get(), wishlist)
+        wishlist.save.assert_called_once_with()
+        self.store.delete(wishlist).get()
+        wishlist.delete.assert_called_once_with()
+
+    def test_gather_runs_concurrently(self):
+        """ Calls that wait on I/O overlap instead of running one by one """
+        def slow_find(wishlist_id):
+            gevent.sleep(0.1)
+            return wishlist_id
+        self.model.find.side_effect = slow_find
+        started = time.time()
+        results = self.store.gather(*[self.store.find(str(i)) for i in range(10)])
+        self.assertEqual(results, [str(i) for i in range(10)])
+        self.assertLess(time.time() - started, 0.5)
+
+    def test_gather_raises_errors(self):
+        """ Errors in a greenlet are raised by gather """
+        self.model.find.side_effect = KeyError('missing')
+        self.assertRaises(KeyError, self.store.gather, self.store.find('1'))
+
+    def test_pool_is_bounded(self):
+        """ No more greenlets run than the pool size """
+        store = AsyncWishlistStore(size=2, model=self.model)
+        self.model.find.side_effect = lambda wishlist_id: gevent.sleep(0.05)
+        greenlets = [store.find(str(i)) for i in range(4)]
+        self.assertLessEqual(len(store.pool), 2)
+        store.join()
+        self.assertTrue(all(greenlet.ready() for greenlet in greenlets))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark Harness Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import logging
+import unittest
+from mock import patch
+from benchmarks.load import percentile, parse_mix, run_benchmark, ENDPOINTS
+from benchmarks.scaling import run_scaling, format_table
+from benchmarks.serialization import run_serialization, PATHS
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestLoadBenchmark(unittest.TestCase):
+    """ Test Cases for the load generator """
+
+    def test_percentile(self):
+        """ Nearest rank percentiles """
+        samples = range(1, 101)
+        self.assertEqual(percentile(samples, 0.50), 50)
+        self.assertEqual(percentile(samples, 0.95), 95)
+        self.assertEqual(percentile(samples, 0.99), 99)
+        self.assertEqual(percentile([7], 0.99), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_parse_mix(self):
+        """ Parse a request mix """
+        self.assertEqual(parse_mix('get=3,list=1,delete=0'), [('get', 3), ('list', 1)])
+        self.assertRaises(ValueError, parse_mix, 'fetch=1')
+        self.assertRaises(ValueError, parse_mix, 'get=0')
+
+    def test_run_in_process(self):
+        """ A short run against the stand-in store reports every endpoint """
+        # the harness switches the model to the memory backend and quiets logs
+        self.addCleanup(logging.disable, logging.NOTSET)
+        with patch('app.models.WISHLIST_BACKEND'):
+            report = run_benchmark(concurrency=2, count=100, preload=10, seed=1)
+        self.assertEqual(report['total']['requests'], 100)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertEqual(sorted(report['endpoints']), sorted(ENDPOINTS.values()))
+        for stats in report['endpoints'].values():
+            for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+                self.assertIn(key, stats)
+
+
+class TestScalingBenchmark(unittest.TestCase):
+    """ Test Cases for the data size scaling benchmark """
+
+    def test_run_scaling(self):
+        """ Every path is measured at every size """
+        self.addCleanup(logging.disable, logging.NOTSET)
+        with patch('app.models.WISHLIST_BACKEND'):
+            rows = run_scaling([20, 40], ['all', 'find_by_customer', 'get_list'],
+                               customers=10, dbname='test')
+        self.assertEqual([(row['size'], row['path']) for row in rows],
+                         [(20, 'all'), (20, 'find_by_customer'), (20, 'get_list'),
+                          (40, 'all'), (40, 'find_by_customer'), (40, 'get_list')])
+        self.assertEqual([row['results'] for row in rows], [20, 2, 20, 40, 4, 40])
+        for row in rows:
+            self.assertIsNotNone(row['peak_kb'])
+        table = format_table(rows).splitlines()
+        self.assertEqual(len(table), len(rows) + 2)
+        self.assertIn('live_objects', table[0])
+
+
+class TestSerializationBenchmark(unittest.TestCase):
+    """ Test Cases for the serialization microbenchmark """
+
+    def test_run_serialization(self):
+        """ Every path is measured """
+        rows = run_serialization(count=2000, repeat=1)
+        self.assertEqual([row['path'] for row in rows], PATHS)
+        for row in rows:
+            self.assertEqual(row['documents'], 2000)
+            self.assertGreater(row['docs_per_sec'], 0)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+LRU Cache Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import unittest
+from app.cache import LRUCache
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestLRUCache(unittest.TestCase):
+    """ Test Cases for the LRU Cache """
+
+    def setUp(self):
+        """ Create a cache with a clock we control """
+        self.now = 1000.0
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=lambda: self.now)
+
+    def test_get_and_set(self):
+        """ Get a value that was cached """
+        self.assertIsNone(self.cache.get('1'))
+        self.cache.set('1', {'name': 'fido'})
+        self.assertEqual(self.cache.get('1'), {'name': 'fido'})
+        stats = self.cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        """ Evict the least recently used entry when full """
+        self.cache.set('1', 'fido')
+        self.cache.set('2', 'kitty')
+        self.cache.get('1')
+        self.cache.set('3', 'bags')
+        self.assertEqual(len(self.cache), 2)
+        self.assertIn('1', self.cache)
+        self.assertNotIn('2', self.cache)
+        self.assertIn('3', self.cache)
+
+    def test_entries_expire(self):
+        """ Miss on an entry older than the TTL """
+        self.cache.set('1', 'fido')
+        self.now += 11
+        self.assertIsNone(self.cache.get('1'))
+        self.assertNotIn('1', self.cache)
+
+    def test_invalidate_and_clear(self):
+        """ Invalidate one entry and clear them all """
+        self.cache.set('1', 'fido')
+        self.cache.set('2', 'kitty')
+        self.cache.invalidate('1')
+        self.assertNotIn('1', self.cache)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_disabled_cache(self):
+        """ Cache nothing when the size is zero """
+        cache = LRUCache(maxsize=0)
+        cache.set('1', 'fido')
+        self.assertIsNone(cache.get('1'))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Changes Feed Follower Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+from requests import ConnectionError
+from prometheus_client import REGISTRY
+from app.cache import LRUCache
+from app.changes import ChangesFollower, sequence_number
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestChangesFollower(unittest.TestCase):
+    """ Test Cases for the Changes Feed Follower """
+
+    def setUp(self):
+        """ Create a follower over a cache and a fake database """
+        self.database = MagicMock()
+        self.database.metadata.return_value = {'update_seq': '10-abc'}
+        self.cache = LRUCache()
+        self.cache.set('1', {'_id': '1', '_rev': '1-a', 'name': 'fido'})
+        self.cache.set('2', {'_id': '2', '_rev': '1-b', 'name': 'bags'})
+        self.follower = ChangesFollower(self.database, self.cache)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_evict_changed_document(self):
+        """ Evict a cached document with a new revision """
+        self.follower.apply({'seq': '11-x', 'id': '1', 'changes': [{'rev': '2-a'}]})
+        self.assertNotIn('1', self.cache)
+        self.assertIn('2', self.cache)
+        self.assertEqual(self.follower.since, '11-x')
+        self.assertEqual(self.follower.changes, 1)
+
+    def test_keep_current_document(self):
+        """ Keep a cached document that already has the new revision """
+        self.follower.apply({'seq': '11-x', 'id': '2', 'changes': [{'rev': '1-b'}]})
+        self.assertIn('2', self.cache)
+
+    def test_evict_deleted_document(self):
+        """ Evict a cached document that was deleted """
+        self.follower.apply({'seq': '11-x', 'id': '2', 'deleted': True,
+                             'changes': [{'rev': '1-b'}]})
+        self.assertNotIn('2', self.cache)
+
+    def test_follow_feed(self):
+        """ Follow the feed from the current sequence """
+        self.database.changes.return_value = iter([
+            None,
+            {'seq': '11-x', 'id': '1', 'changes': [{'rev': '2-a'}]}
+        ])
+        self.follower.follow()
+        self.database.changes.assert_called_with(feed='continuous', since='10-abc',
+                                                 heartbeat=30000)
+        self.assertNotIn('1', self.cache)
+        self.assertEqual(self.follower.lag(), 0)
+
+    def test_report_lag(self):
+        """ Report the lag on heartbeats and count reconnects """
+        self.database.changes.return_value = iter([None])
+        self.follower.follow()
+        self.assertEqual(REGISTRY.get_sample_value('wishlist_changes_lag'), 0)
+        self.assertEqual(REGISTRY.get_sample_value('wishlist_changes_lag_seconds'), 0)
+        self.assertEqual(REGISTRY.get_sample_value(
+            'wishlist_changes_last_event_timestamp_seconds'), self.follower.last_event)
+        self.database.metadata.return_value = {'update_seq': '14-abc'}
+        self.follower.report_lag()
+        self.assertEqual(REGISTRY.get_sample_value('wishlist_changes_lag'), 4)
+        self.assertGreaterEqual(REGISTRY.get_sample_value('wishlist_changes_lag_seconds'), 0)
+        self.database.metadata.side_effect = ConnectionError('down')
+        self.follower.report_lag()
+        self.assertEqual(REGISTRY.get_sample_value('wishlist_changes_lag'), 4)
+
+    def test_reconnect_after_failure(self):
+        """ Reconnect when the feed connection fails """
+        calls = []
+        def changes(**kwargs):
+            calls.append(kwargs['since'])
+            if len(calls) == 1:
+                raise ConnectionError('feed dropped')
+            self.follower.stop()
+            return iter([])
+        self.database.changes.side_effect = changes
+        self.follower.max_backoff = 0
+        reconnects = REGISTRY.get_sample_value('wishlist_changes_reconnects_total')
+        self.follower.run()
+        self.assertEqual(calls, ['10-abc', '10-abc'])
+        self.assertEqual(self.follower.reconnects, 1)
+        self.assertEqual(REGISTRY.get_sample_value('wishlist_changes_reconnects_total'),
+                         reconnects + 1)
+
+    def test_save_and_load_since(self):
+        """ Resume from the sequence saved on disk """
+        since_file = os.path.join(self.tmpdir, 'since')
+        follower = ChangesFollower(self.database, self.cache, since_file=since_file)
+        follower.apply({'seq': '12-y', 'id': '1', 'changes': [{'rev': '2-a'}]})
+        follower.save_since()
+        follower = ChangesFollower(self.database, self.cache, since_file=since_file)
+        self.assertEqual(follower.since, '12-y')
+
+    def test_sequence_number(self):
+        """ Parse CouchDB sequences """
+        self.assertEqual(sequence_number('12-g1AAAA'), 12)
+        self.assertEqual(sequence_number(7), 7)
+        self.assertIsNone(sequence_number('now'))
+        self.assertIsNone(sequence_number(None))
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
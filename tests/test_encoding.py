@@ -0,0 +1,68 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+JSON Encoder Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import json
+import unittest
+from app import app, encoding
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestEncoding(unittest.TestCase):
+    """ Test Cases for the pluggable JSON encoders """
+
+    def setUp(self):
+        """ Put the configured encoder back after each test """
+        self.addCleanup(encoding.use, app.config['RESPONSE_ENCODER'])
+
+    def test_default_encoder(self):
+        """ Encode compactly with the standard library """
+        encoding.use('json')
+        data = {'name': 'fido', 'customer_id': '1', 'id': 'abc'}
+        body = encoding.dumps(data)
+        self.assertNotIn(' ', body)
+        self.assertEqual(json.loads(body), data)
+
+    def test_every_encoder_agrees(self):
+        """ Every available encoder produces the same JSON """
+        data = [{'name': u'caf\xe9', 'customer_id': '1'}, {'name': None}]
+        with app.app_context():
+            for name in encoding.ENCODERS:
+                encoding.use(name)
+                self.assertEqual(json.loads(encoding.dumps(data)), data)
+
+    def test_register_and_use(self):
+        """ Use an encoder that was registered """
+        encoding.register('test', lambda data: 'encoded')
+        self.addCleanup(encoding.ENCODERS.pop, 'test')
+        encoding.use('test')
+        self.assertEqual(encoding.dumps({}), 'encoded')
+
+    def test_unknown_encoder(self):
+        """ Refuse an encoder that does not exist """
+        self.assertRaises(AssertionError, encoding.use, 'missing')
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Memory Backend Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import unittest
+from mock import patch
+from app.backends import get_backend, MemoryBackend
+from app.models import Wishlist, DataConflictError, DataValidationError
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestMemoryBackend(unittest.TestCase):
+    """ Test Cases for the in-memory storage backend """
+
+    def setUp(self):
+        MemoryBackend.databases.clear()
+        self.backend = MemoryBackend()
+        self.backend.connect('test')
+
+    def test_get_backend(self):
+        """ Backends are picked by name """
+        self.assertIsInstance(get_backend('memory'), MemoryBackend)
+        self.assertRaises(AssertionError, get_backend, 'floppy')
+
+    def test_create_and_get(self):
+        """ Create a document and read it back """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        self.assertTrue(doc['_id'])
+        self.assertTrue(doc['_rev'].startswith('1-'))
+        self.assertEqual(self.backend.get(doc['_id']), doc)
+        self.assertEqual(self.backend.revision(doc['_id']), doc['_rev'])
+        self.assertIsNone(self.backend.get('missing'))
+        self.assertIsNone(self.backend.revision('missing'))
+
+    def test_copies_are_returned(self):
+        """ Changing a returned document does not change the stored one """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        self.backend.get(doc['_id'])['name'] = 'kitty'
+        self.assertEqual(self.backend.get(doc['_id'])['name'], 'fido')
+
+    def test_databases_are_shared_by_name(self):
+        """ Backends that open the same database see the same documents """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        other = MemoryBackend()
+        other.connect('test')
+        self.assertEqual(other.get(doc['_id'])['name'], 'fido')
+        other.connect('other')
+        self.assertIsNone(other.get(doc['_id']))
+
+    def test_update_checks_revision(self):
+        """ Updates must be made against the current revision """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        doc['name'] = 'kitty'
+        rev = self.backend.update(doc)
+        self.assertTrue(rev.startswith('2-'))
+        self.assertRaises(DataConflictError, self.backend.update, doc)
+        doc['_rev'] = rev
+        self.backend.update(doc)
+
+    def test_update_keeps_indexes(self):
+        """ Updates move a document to its new index entry """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        doc['customer_id'] = '2'
+        self.backend.update(doc)
+        self.assertEqual(self.backend.find({'customer_id': '1'})[0], [])
+        self.assertEqual(len(self.backend.find({'customer_id': '2'})[0]), 1)
+        self.assertNotIn('1', self.backend.db.indexes['customer_id'])
+
+    def test_delete(self):
+        """ Deleted documents leave the indexes """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        self.backend.delete(doc['_id'])
+        self.backend.delete(doc['_id'])
+        self.assertIsNone(self.backend.get(doc['_id']))
+        self.assertEqual(self.backend.db.indexes['name'], {})
+        self.assertEqual(self.backend.db.order, [])
+
+    def test_bulk_save_and_delete(self):
+        """ Bulk writes report conflicts per document """
+        rows = self.backend.bulk_save([{'_id': 'a', 'name': 'fido'},
+                                       {'_id': 'b', 'name': 'kitty'}])
+        self.assertEqual([row['id'] for row in rows], ['a', 'b'])
+        rows = self.backend.bulk_save([{'_id': 'a', 'name': 'rex'}])
+        self.assertEqual(rows[0]['error'], 'conflict')
+        docs = [{'_id': 'a', '_rev': self.backend.revision('a')},
+                {'_id': 'b', '_rev': 'stale'}]
+        self.assertEqual(self.backend.bulk_delete(docs), 1)
+        self.assertIsNone(self.backend.get('a'))
+        self.assertIsNotNone(self.backend.get('b'))
+
+    def test_page_all(self):
+        """ Page through every document in id order """
+        for doc_id in 'edcba':
+            self.backend.create({'_id': doc_id, 'name': doc_id})
+        docs, next_key = self.backend.page_all(2)
+        self.assertEqual([doc['_id'] for doc in docs], ['a', 'b'])
+        self.assertEqual(next_key, 'c')
+        docs, next_key = self.backend.page_all(3, next_key, include_docs=False)
+        self.assertEqual(sorted(docs[0]), ['_id', '_rev'])
+        self.assertEqual([doc['_id'] for doc in docs], ['c', 'd', 'e'])
+        self.assertIsNone(next_key)
+
+    def test_find_uses_index(self):
+        """ Equality on an indexed field only looks at matching documents """
+        for number in range(10):
+            self.backend.create({'name': 'list', 'customer_id': str(number)})
+        candidates = self.backend._candidates({'customer_id': '3', 'name': 'list'})
+        self.assertEqual(len(candidates), 1)
+        docs, _ = self.backend.find({'customer_id': '3'})
+        self.assertEqual(docs[0]['customer_id'], '3')
+
+    def test_find_with_operators(self):
+        """ Selectors can compare values """
+        for number in range(5):
+            self.backend.create({'name': 'list', 'customer_id': str(number)})
+        docs, _ = self.backend.find({'customer_id': {'$gte': '3'}})
+        self.assertEqual(len(docs), 2)
+        docs, _ = self.backend.find({'customer_id': {'$in': ['1', '4']}})
+        self.assertEqual(len(docs), 2)
+        self.assertRaises(DataValidationError, self.backend.find,
+                          {'customer_id': {'$regex': '.*'}})
+
+    def test_find_pages_sorts_and_projects(self):
+        """ Query results can be sorted, projected and paged """
+        for name in ['b', 'd', 'a', 'c']:
+            self.backend.create({'name': name, 'customer_id': '1'})
+        docs, bookmark = self.backend.find({}, fields=['_id', 'name'], sort_keys=['name'],
+                                           direction='desc', limit=3)
+        self.assertEqual([doc['name'] for doc in docs], ['d', 'c', 'b'])
+        self.assertNotIn('customer_id', docs[0])
+        docs, bookmark = self.backend.find({}, sort_keys=['name'], direction='desc',
+                                           limit=3, bookmark=bookmark)
+        self.assertEqual([doc['name'] for doc in docs], ['a'])
+        self.assertIsNone(bookmark)
+        docs, _ = self.backend.find({}, sort_keys=['name'], skip=1)
+        self.assertEqual([doc['name'] for doc in docs], ['b', 'c', 'd'])
+        self.assertRaises(DataValidationError, self.backend.find, {}, limit=2,
+                          bookmark='bogus')
+
+    def test_find_uses_index_for_in(self):
+        """ $in and $eq conditions are narrowed down with an index """
+        for customer_id in ['1', '2', '3']:
+            self.backend.create({'name': 'fido', 'customer_id': customer_id})
+        docs = self.backend._candidates({'customer_id': {'$in': ['1', '3', '9']}})
+        self.assertEqual(sorted(doc['customer_id'] for doc in docs), ['1', '3'])
+        docs = self.backend._candidates({'customer_id': {'$eq': '2'}})
+        self.assertEqual([doc['customer_id'] for doc in docs], ['2'])
+        docs, _ = self.backend.find({'customer_id': {'$in': ['2', '3']}},
+                                    sort_keys=['customer_id'])
+        self.assertEqual([doc['customer_id'] for doc in docs], ['2', '3'])
+
+    def test_bookmark_survives_deletes(self):
+        """ Deleting the documents of a page does not skip the next one """
+        for name in ['a', 'b', 'c', 'd', 'e']:
+            self.backend.create({'_id': name, 'name': name, 'customer_id': '1'})
+        docs, bookmark = self.backend.find({'customer_id': '1'}, limit=2)
+        self.assertEqual([doc['_id'] for doc in docs], ['a', 'b'])
+        self.backend.bulk_delete(docs)
+        docs, bookmark = self.backend.find({'customer_id': '1'}, limit=2, bookmark=bookmark)
+        self.assertEqual([doc['_id'] for doc in docs], ['c', 'd'])
+        docs, _ = self.backend.find({'customer_id': '1'}, sort_keys=['name'],
+                                    direction='desc', limit=2)
+        self.assertEqual([doc['_id'] for doc in docs], ['e', 'd'])
+
+    def test_create_query_index(self):
+        """ Index one more field """
+        self.backend.create({'name': 'fido', 'color': 'red'})
+        self.backend.create_query_index('color')
+        self.assertEqual(len(self.backend.db.indexes['color']['red']), 1)
+
+    @patch('app.models.WISHLIST_BACKEND', 'memory')
+    def test_wishlist_model(self):
+        """ The Wishlist model can run on the memory backend """
+        Wishlist.init_db('test')
+        self.assertIsInstance(Wishlist.backend, MemoryBackend)
+        Wishlist.remove_all()
+        Wishlist('fido', '1').save()
+        Wishlist('kitty', '2').save()
+        wishlists = Wishlist.find_by(customer_id='2')
+        self.assertEqual(len(wishlists), 1)
+        self.assertEqual(Wishlist.find(wishlists[0].id).name, 'kitty')
+        self.assertEqual(Wishlist.remove_all(), 2)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Metrics Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+from prometheus_client import REGISTRY
+from app import metrics
+
+# increments a counter in two forked workers and prints what /metrics would
+MULTIPROCESS_SCRIPT = '''
+import os
+from app import metrics
+for _ in range(2):
+    pid = os.fork()
+    if pid == 0:
+        metrics.observe_request('GET', '/wishlists', 200, 0.01)
+        os._exit(0)
+    os.waitpid(pid, 0)
+print(metrics.generate()[0])
+'''
+
+def sample(name, labels):
+    """ Returns the current value of a metric sample or 0 """
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestMetrics(unittest.TestCase):
+    """ Test Cases for the Prometheus metrics """
+
+    def test_timed(self):
+        """ Timed methods are observed and their errors counted """
+        @metrics.timed('test_op')
+        def works():
+            return 'ok'
+        @metrics.timed('test_op')
+        def fails():
+            raise KeyError('bad')
+        labels = {'operation': 'test_op'}
+        count = sample('wishlist_db_operation_duration_seconds_count', labels)
+        errors = sample('wishlist_db_operation_errors_total', labels)
+        self.assertEqual(works(), 'ok')
+        self.assertRaises(KeyError, fails)
+        self.assertEqual(sample('wishlist_db_operation_duration_seconds_count', labels),
+                         count + 2)
+        self.assertEqual(sample('wishlist_db_operation_errors_total', labels), errors + 1)
+        self.assertEqual(sample('wishlist_db_operations_in_flight', labels), 0)
+
+    def test_observe_request(self):
+        """ Requests are counted by route and errors by status """
+        labels = {'method': 'GET', 'endpoint': '/test', 'status': '404'}
+        metrics.observe_request('GET', '/test', 404, 0.2)
+        self.assertEqual(sample('wishlist_http_requests_total', labels), 1)
+        self.assertEqual(sample('wishlist_http_errors_total',
+                                {'endpoint': '/test', 'status': '404'}), 1)
+        self.assertEqual(sample('wishlist_http_request_duration_seconds_count',
+                                {'method': 'GET', 'endpoint': '/test'}), 1)
+
+    def test_multiprocess(self):
+        """ Metrics add up across worker processes """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory,
+                   PYTHONPATH=os.getcwd())
+        output = subprocess.check_output([sys.executable, '-c', MULTIPROCESS_SCRIPT],
+                                         env=env)
+        self.assertIn('wishlist_http_requests_total{endpoint="/wishlists",'
+                      'method="GET",status="200"} 2.0', output)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Retry Policy Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import logging
+import unittest
+from requests import HTTPError, ConnectionError, Response
+from prometheus_client import REGISTRY
+from app import resilience
+from app.resilience import RetryPolicy, CircuitBreaker, CircuitOpenError
+from app.resilience import retrying, retry_after
+
+def http_error(code, headers=None):
+    """ Returns an HTTPError with a response of the status code """
+    response = Response()
+    response.status_code = code
+    response.headers.update(headers or {})
+    return HTTPError('{} error'.format(code), response=response)
+
+class Flaky(object):
+    """ A call that raises the errors it was given before it works """
+
+    def __init__(self, *errors):
+        """ Constructor """
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestRetryPolicy(unittest.TestCase):
+    """ Test Cases for the Retry Policy """
+
+    def setUp(self):
+        """ Use a policy with a clock that sleeping moves forward """
+        self.now = 1000.0
+        self.sleeps = []
+        self.policy = RetryPolicy(tries=5, delay=1, backoff=2, deadline=10, jitter=False,
+                                  timer=lambda: self.now, sleep=self.sleep,
+                                  breaker=CircuitBreaker(threshold=100))
+        self.addCleanup(resilience.configure, resilience.policy)
+        self.addCleanup(resilience.end_budget)
+        resilience.configure(self.policy)
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def sleep(self, seconds):
+        """ Records a sleep and moves the clock """
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def test_retries_server_errors(self):
+        """ Retry 5xx and 429 errors with exponential backoff """
+        call = Flaky(http_error(503), http_error(429), http_error(500))
+        retries = REGISTRY.get_sample_value('wishlist_db_retries_total',
+                                            {'operation': 'flaky'}) or 0
+        self.assertEqual(self.policy.call('flaky', call), 'ok')
+        self.assertEqual(call.calls, 4)
+        self.assertEqual(self.sleeps, [1, 2, 4])
+        self.assertEqual(REGISTRY.get_sample_value('wishlist_db_retries_total',
+                                                   {'operation': 'flaky'}), retries + 3)
+
+    def test_client_errors_are_not_retried(self):
+        """ Raise 4xx errors other than 429 at once """
+        for code in (400, 404, 409):
+            call = Flaky(http_error(code))
+            self.assertRaises(HTTPError, self.policy.call, 'flaky', call)
+            self.assertEqual(call.calls, 1)
+        self.assertRaises(ValueError, self.policy.call, 'flaky', Flaky(ValueError()))
+        self.assertEqual(self.sleeps, [])
+
+    def test_gives_up_after_tries(self):
+        """ Raise the last error once every attempt has failed """
+        call = Flaky(*[http_error(502) for _ in range(5)])
+        self.policy.deadline = 100
+        self.assertRaises(HTTPError, self.policy.call, 'flaky', call)
+        self.assertEqual(call.calls, 5)
+        self.assertEqual(len(self.sleeps), 4)
+
+    def test_deadline(self):
+        """ Never sleep past the deadline """
+        call = Flaky(*[http_error(503) for _ in range(5)])
+        self.assertRaises(HTTPError, self.policy.call, 'flaky', call)
+        # 1 + 2 + 4 seconds fit in 10, another 8 do not
+        self.assertEqual(self.sleeps, [1, 2, 4])
+        self.assertEqual(call.calls, 4)
+
+    def test_retry_after(self):
+        """ Wait as long as Retry-After asks """
+        call = Flaky(http_error(429, {'Retry-After': '3'}))
+        self.assertEqual(self.policy.call('flaky', call), 'ok')
+        self.assertEqual(self.sleeps, [3.0])
+        call = Flaky(http_error(503, {'Retry-After': '60'}))
+        self.assertRaises(HTTPError, self.policy.call, 'flaky', call)
+        self.assertEqual(call.calls, 1)
+
+    def test_retry_after_values(self):
+        """ Parse Retry-After as seconds or an HTTP date """
+        self.assertEqual(retry_after(http_error(503, {'Retry-After': '2'})), 2.0)
+        self.assertEqual(retry_after(http_error(503, {'Retry-After':
+                                                      'Thu, 01 Jan 1970 00:00:00 GMT'})), 0)
+        self.assertIsNone(retry_after(http_error(503, {'Retry-After': 'soon'})))
+        self.assertIsNone(retry_after(http_error(503)))
+
+    def test_jitter(self):
+        """ Jittered waits stay between half and all of the backoff """
+        policy = RetryPolicy(delay=1, backoff=2, deadline=100)
+        for attempt in range(1, 6):
+            wait = policy.wait(attempt)
+            self.assertGreaterEqual(wait, 2 ** (attempt - 1) / 2.0)
+            self.assertLessEqual(wait, 2 ** (attempt - 1))
+
+    def test_nested_calls_share_one_policy(self):
+        """ Only the outermost call retries """
+        inner = Flaky(*[http_error(503) for _ in range(3)])
+        @retrying('inner')
+        def update():
+            return inner()
+        @retrying('outer')
+        def save():
+            return update()
+        self.assertEqual(save(), 'ok')
+        self.assertEqual(inner.calls, 4)
+        self.assertEqual(len(self.sleeps), 3)
+
+    def test_request_budget(self):
+        """ Retries across a request share its budget """
+        resilience.start_budget(5)
+        errors = [http_error(503) for _ in range(3)]
+        self.assertRaises(HTTPError, self.policy.call, 'flaky', Flaky(*errors))
+        self.assertEqual(self.sleeps, [1, 2])
+        # 3 of the 5 seconds are spent, so a 1 second wait fits but not 2 more
+        errors = [http_error(503) for _ in range(2)]
+        self.assertRaises(HTTPError, self.policy.call, 'flaky', Flaky(*errors))
+        self.assertEqual(self.sleeps, [1, 2, 1])
+        resilience.end_budget()
+        self.assertEqual(self.policy.call('flaky', Flaky(http_error(503))), 'ok')
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """ Test Cases for the Circuit Breaker """
+
+    def setUp(self):
+        """ Create a breaker with a clock we control """
+        self.now = 1000.0
+        self.breaker = CircuitBreaker(threshold=3, reset_timeout=30, probes=1,
+                                      timer=lambda: self.now)
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def fail(self, error=None):
+        """ Makes a call through the breaker that raises an error """
+        self.assertRaises(Exception, self.breaker.call,
+                          Flaky(error or ConnectionError('down')))
+
+    def test_opens_after_threshold(self):
+        """ Open after failures in a row and fail fast """
+        self.fail()
+        self.fail()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.fail(http_error(503))
+        self.assertEqual(self.breaker.state, 'open')
+        call = Flaky()
+        with self.assertRaises(CircuitOpenError) as context:
+            self.breaker.call(call)
+        self.assertEqual(context.exception.retry_after, 30)
+        self.assertEqual(call.calls, 0)
+
+    def test_success_resets_failures(self):
+        """ Only failures in a row count """
+        self.fail()
+        self.fail()
+        self.assertEqual(self.breaker.call(Flaky()), 'ok')
+        self.fail()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_client_errors_do_not_count(self):
+        """ Errors that show the database is up do not open it """
+        for _ in range(5):
+            self.fail(http_error(404))
+            self.fail(http_error(429))
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_probe_closes(self):
+        """ A successful probe closes the circuit """
+        for _ in range(3):
+            self.fail()
+        self.now += 30
+        self.assertEqual(self.breaker.state, 'half_open')
+        self.assertEqual(self.breaker.call(Flaky()), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_half_open_probe_fails(self):
+        """ A failed probe opens the circuit again """
+        for _ in range(3):
+            self.fail()
+        self.now += 31
+        self.fail()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+    def test_probes_are_limited(self):
+        """ Let only a limited number of probes through at once """
+        for _ in range(3):
+            self.fail()
+        self.now += 30
+        def probe():
+            # a second call while this probe is running is refused
+            self.assertRaises(CircuitOpenError, self.breaker.call, Flaky())
+            return 'ok'
+        self.assertEqual(self.breaker.call(probe), 'ok')
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_stops_retries(self):
+        """ Retries stop as soon as the circuit opens """
+        sleeps = []
+        policy = RetryPolicy(tries=10, delay=1, deadline=100, jitter=False,
+                             sleep=sleeps.append, breaker=self.breaker)
+        call = Flaky(*[http_error(503) for _ in range(10)])
+        self.assertRaises(HTTPError, policy.call, 'flaky', call)
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(len(sleeps), 2)
+        self.assertRaises(CircuitOpenError, policy.call, 'flaky', call)
+        self.assertEqual(call.calls, 3)
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -20,18 +20,26 @@ nosetests -v --with-spec --spec-color
 """
 import unittest
 import logging
+from mock import MagicMock, patch
 from werkzeug.datastructures import MultiDict, ImmutableMultiDict
-from app import server
+from requests import ConnectionError
+from app import server, resilience
+from app.cache import LRUCache
+from app.changes import ChangesFollower
 
 # Status Codes
 HTTP_200_OK = 200
 HTTP_201_CREATED = 201
 HTTP_204_NO_CONTENT = 204
+HTTP_304_NOT_MODIFIED = 304
+HTTP_207_MULTI_STATUS = 207
 HTTP_400_BAD_REQUEST = 400
 HTTP_404_NOT_FOUND = 404
 HTTP_405_METHOD_NOT_ALLOWED = 405
 HTTP_409_CONFLICT = 409
+HTTP_412_PRECONDITION_FAILED = 412
 HTTP_415_UNSUPPORTED_MEDIA_TYPE = 415
+HTTP_503_SERVICE_UNAVAILABLE = 503
 
 ######################################################################
 #  T E S T   C A S E S
@@ -60,6 +68,15 @@ class TestWishlistServer(unittest.TestCase):
         self.assertEqual(resp.status_code, HTTP_200_OK)
         self.assertTrue(len(resp.data) > 0)
 
+    def test_get_wishlist_list_is_streamed(self):
+        """ Get a list of Wishlists as a streamed JSON array """
+        resp = self.app.get('/wishlists')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.content_type, 'application/json')
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+
     def test_get_wishlist(self):
         """ get a single Wishlist """
         wishlist = self.get_wishlist('bags')[0] # returns a list
@@ -68,6 +85,61 @@ class TestWishlistServer(unittest.TestCase):
         data = resp.get_json()
         self.assertEqual(data['name'], 'bags')
 
+    def test_get_wishlist_not_modified(self):
+        """ Get a Wishlist with the ETag of the current copy """
+        wishlist = self.get_wishlist('bags')[0] # returns a list
+        resp = self.app.get('/wishlists/{}'.format(wishlist['id']))
+        etag = resp.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        resp = self.app.get('/wishlists/{}'.format(wishlist['id']),
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(resp.data), 0)
+        # once the wishlist changes the full body comes back
+        wishlist['customer_id'] = '7'
+        self.app.put('/wishlists/{}'.format(wishlist['id']), json=wishlist,
+                     content_type='application/json')
+        resp = self.app.get('/wishlists/{}'.format(wishlist['id']),
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.get_json()['customer_id'], '7')
+
+    def test_query_by_customer_id_not_modified(self):
+        """ Query Wishlists by customer_id with the ETag of the current list """
+        resp = self.app.get('/wishlists', query_string='customer_id=1',
+                            headers={'If-None-Match': '"stale"'})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        etag = resp.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        resp = self.app.get('/wishlists', query_string='customer_id=1',
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_304_NOT_MODIFIED)
+        server.data_load({"name": "shoes", "customer_id": "1"})
+        resp = self.app.get('/wishlists', query_string='customer_id=1',
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 2)
+
+    def test_query_streams_without_etag(self):
+        """ Query Wishlists without If-None-Match in a single streamed read """
+        with patch('app.server.Wishlist.revisions') as revisions:
+            resp = self.app.get('/wishlists', query_string='customer_id=1,2&sort=-name')
+            self.assertFalse(revisions.called)
+        self.assertIsNone(resp.headers.get('ETag'))
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual([item['name'] for item in resp.get_json()], ['fido', 'bags'])
+        resp = self.app.get('/wishlists', query_string='customer_id=1,2&sort=-name',
+                            headers={'If-None-Match': '"stale"'})
+        etag = resp.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        resp = self.app.get('/wishlists', query_string='customer_id=1,2&sort=-name',
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_304_NOT_MODIFIED)
+        resp = self.app.get('/wishlists', query_string='customer_id=1,2&sort=-name&skip=1',
+                            headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 1)
+
     def test_get_wishlist_not_found(self):
         """ Get a Wishlist that doesn't exist """
         resp = self.app.get('/wishlists/0')
@@ -99,6 +171,37 @@ class TestWishlistServer(unittest.TestCase):
         self.assertEqual(len(data), wishlist_count + 1)
         self.assertIn(new_json, data)
 
+    def test_create_wishlists_in_bulk(self):
+        """ Create a list of Wishlists in bulk """
+        wishlist_count = self.get_wishlist_count()
+        new_wishlists = [{'name': 'Bags', 'customer_id': '1'},
+                         {'name': 'Shoes', 'customer_id': '3'}]
+        resp = self.app.post('/wishlists/bulk', json=new_wishlists,
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual(len(data), 2)
+        for result in data:
+            self.assertIn('id', result)
+        self.assertEqual(self.get_wishlist_count(), wishlist_count + 2)
+
+    def test_create_wishlists_in_bulk_with_bad_data(self):
+        """ Create a list of Wishlists in bulk where one has no name """
+        new_wishlists = [{'name': 'Bags', 'customer_id': '1'},
+                         {'customer_id': '3'}]
+        resp = self.app.post('/wishlists/bulk', json=new_wishlists,
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_207_MULTI_STATUS)
+        data = resp.get_json()
+        self.assertIn('id', data[0])
+        self.assertIn('error', data[1])
+
+    def test_create_wishlists_in_bulk_not_a_list(self):
+        """ Create Wishlists in bulk without a JSON array """
+        resp = self.app.post('/wishlists/bulk', json={'name': 'Bags'},
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
     def test_create_wishlist_from_formdata(self):
         wishlist_data = MultiDict()
         wishlist_data.add('name', 'Timothy')
@@ -128,6 +231,26 @@ class TestWishlistServer(unittest.TestCase):
         new_json = resp.get_json()
         self.assertEqual(new_json['customer_id'], '4')
 
+    def test_update_wishlist_with_if_match(self):
+        """ Update a Wishlist with the ETag it was read with """
+        wishlist = self.get_wishlist('fido')[0] # returns a list
+        resp = self.app.get('/wishlists/{}'.format(wishlist['id']))
+        etag = resp.headers.get('ETag')
+        self.assertIsNotNone(etag)
+        wishlist['customer_id'] = '4'
+        resp = self.app.put('/wishlists/{}'.format(wishlist['id']), json=wishlist,
+                            content_type='application/json', headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertNotEqual(resp.headers.get('ETag'), etag)
+        self.assertEqual(resp.get_json()['customer_id'], '4')
+        # a second write with the old ETag must not overwrite the first
+        wishlist['customer_id'] = '5'
+        resp = self.app.put('/wishlists/{}'.format(wishlist['id']), json=wishlist,
+                            content_type='application/json', headers={'If-Match': etag})
+        self.assertEqual(resp.status_code, HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.get('/wishlists/{}'.format(wishlist['id']))
+        self.assertEqual(resp.get_json()['customer_id'], '4')
+
     def test_update_wishlist_with_no_name(self):
         """ Update a Wishlist without assigning a name """
         wishlist = self.get_wishlist('fido')[0] # returns a list
@@ -154,12 +277,50 @@ class TestWishlistServer(unittest.TestCase):
         new_count = self.get_wishlist_count()
         self.assertEqual(new_count, wishlist_count - 1)
 
+    def test_delete_wishlists_by_customer_id(self):
+        """ Delete the Wishlists of a customer """
+        resp = self.app.delete('/wishlists', query_string='customer_id=1')
+        self.assertEqual(resp.status_code, HTTP_204_NO_CONTENT)
+        resp = self.app.get('/wishlists')
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['customer_id'], '2')
+
+    def test_delete_wishlists_of_several_customers(self):
+        """ Delete the Wishlists of several customers """
+        server.data_load({"name": "kitty", "customer_id": "3"})
+        resp = self.app.delete('/wishlists', query_string='customer_id=1,3')
+        self.assertEqual(resp.status_code, HTTP_204_NO_CONTENT)
+        data = self.app.get('/wishlists').get_json()
+        self.assertEqual([item['customer_id'] for item in data], ['2'])
+
+    def test_delete_wishlists_without_filter(self):
+        """ Delete Wishlists without a filter """
+        resp = self.app.delete('/wishlists')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_wishlist_count(), 2)
+
     def test_create_wishlist_with_no_name(self):
         """ Create a Wishlist without a name """
         new_wishlist = {'customer_id': '9'}
         resp = self.app.post('/wishlists', json=new_wishlist, content_type='application/json')
         self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
 
+    def test_create_wishlist_not_stored(self):
+        """ Create a Wishlist the database did not store """
+        with patch.object(server.Wishlist.backend, 'create', return_value=None):
+            resp = self.app.post('/wishlists', json={'name': 'x', 'customer_id': '1'},
+                                 content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.get_json()['error'], 'Service Unavailable')
+
+    def test_create_wishlist_with_list_customer_id(self):
+        """ Create a Wishlist whose customer_id is not a scalar """
+        new_wishlist = {'name': 'x', 'customer_id': [1]}
+        resp = self.app.post('/wishlists', json=new_wishlist, content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.get_wishlist_count(), 2)
+
     def test_create_wishlist_no_content_type(self):
         """ Create a Wishlist with no Content-Type """
         resp = self.app.post('/wishlists', data="new_wishlist")
@@ -188,6 +349,28 @@ class TestWishlistServer(unittest.TestCase):
         query_item = data[0]
         self.assertEqual(query_item['name'], 'fido')
 
+    def test_query_with_fields_and_sort(self):
+        """ Query Wishlists for some fields in sorted order """
+        resp = self.app.get('/wishlists', query_string='fields=name&sort=-name')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data, [{'name': 'fido'}, {'name': 'bags'}])
+
+    def test_query_with_limit_and_skip(self):
+        """ Query a page of Wishlists after skipping some """
+        resp = self.app.get('/wishlists', query_string='sort=name&limit=1&skip=1')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['name'], 'fido')
+
+    def test_query_with_bad_fields(self):
+        """ Query Wishlists for an unknown field """
+        resp = self.app.get('/wishlists', query_string='fields=color')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/wishlists', query_string='skip=-1')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
     def test_query_by_customer_id(self):
         """ Query Wishlists by customer_id """
         resp = self.app.get('/wishlists', query_string='customer_id=1')
@@ -199,6 +382,183 @@ class TestWishlistServer(unittest.TestCase):
         query_item = data[0]
         self.assertEqual(query_item['customer_id'], '1')
 
+    def test_query_by_several_customer_ids(self):
+        """ Query Wishlists with comma separated and repeated values """
+        server.data_load({"name": "kitty", "customer_id": "3"})
+        resp = self.app.get('/wishlists', query_string='customer_id=1,2')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(sorted(item['name'] for item in data), ['bags', 'fido'])
+        resp = self.app.get('/wishlists?customer_id=1&customer_id=3&sort=name')
+        data = resp.get_json()
+        self.assertEqual([item['name'] for item in data], ['fido', 'kitty'])
+
+    def test_query_by_customer_id_and_name(self):
+        """ Query Wishlists that match every filter """
+        server.data_load({"name": "bags", "customer_id": "1"})
+        resp = self.app.get('/wishlists', query_string='customer_id=1&name=bags')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['customer_id'], '1')
+        self.assertEqual(data[0]['name'], 'bags')
+        resp = self.app.get('/wishlists', query_string='customer_id=2&name=fido,kitty')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [])
+
+    def test_get_wishlist_page(self):
+        """ Get a page of Wishlists and follow the next link """
+        resp = self.app.get('/wishlists', query_string='limit=1')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        link = resp.headers.get('Link')
+        self.assertIsNotNone(link)
+        self.assertIn('rel="next"', link)
+        next_url = link[link.index('<') + 1:link.index('>')]
+        resp = self.app.get(next_url)
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data += resp.get_json()
+        self.assertEqual(len(data), 2)
+        self.assertEqual(set(item['name'] for item in data), set(['fido', 'bags']))
+
+    def test_get_wishlist_page_bad_limit(self):
+        """ Get a page of Wishlists with a bad limit """
+        resp = self.app.get('/wishlists', query_string='limit=zero')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/wishlists', query_string='limit=0')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_get_wishlist_page_bad_cursor(self):
+        """ Get a page of Wishlists with a bad cursor """
+        resp = self.app.get('/wishlists', query_string='customer_id=1&cursor=bogus&limit=2')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        resp = self.app.get('/wishlists', query_string='sort=name&cursor=-2&limit=2')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_metrics(self):
+        """ Get request and database metrics for Prometheus """
+        wishlist = self.get_wishlist('fido')[0]
+        self.app.get('/wishlists/{}'.format(wishlist['id']))
+        self.app.get('/wishlists/missing')
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('wishlist_http_requests_total{endpoint="/wishlists/<wishlist_id>",'
+                      'method="GET",status="200"}', resp.data)
+        self.assertIn('wishlist_http_errors_total{endpoint="/wishlists/<wishlist_id>",'
+                      'status="404"}', resp.data)
+        self.assertIn('wishlist_http_request_duration_seconds_bucket', resp.data)
+        self.assertIn('wishlist_db_operation_duration_seconds_count{operation="find"}',
+                      resp.data)
+        self.assertIn('wishlist_http_requests_in_flight', resp.data)
+
+    @patch('app.metrics.observe_request')
+    def test_metrics_streamed_list(self, observe_mock):
+        """ A streamed list is timed once its body has been sent """
+        resp = self.app.get('/wishlists')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        observe_mock.assert_not_called()
+        self.assertEqual(len(resp.get_json()), 2)
+        resp.close()
+        observe_mock.assert_called_once()
+        self.assertEqual(observe_mock.call_args[0][:3], ('GET', '/wishlists', 200))
+
+    def test_metrics_changes_lag(self):
+        """ Get the lag of the changes feed follower from /metrics """
+        database = MagicMock()
+        database.metadata.return_value = {'update_seq': '10-abc'}
+        database.changes.return_value = iter([None])
+        follower = ChangesFollower(database, LRUCache())
+        follower.follow()
+        database.metadata.return_value = {'update_seq': '13-abc'}
+        follower.report_lag()
+        resp = self.app.get('/metrics')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertIn('wishlist_changes_lag 3.0', resp.data)
+        self.assertIn('wishlist_changes_lag_seconds ', resp.data)
+        self.assertIn('wishlist_changes_last_event_timestamp_seconds ', resp.data)
+        self.assertIn('wishlist_changes_reconnects_total ', resp.data)
+
+    def test_get_wishlist_response_is_cached(self):
+        """ Reuse the encoded Wishlist until its revision changes """
+        wishlist = self.get_wishlist('fido')[0]
+        url = '/wishlists/{}'.format(wishlist['id'])
+        first = self.app.get(url)
+        hits = server.RESPONSE_CACHE.stats()['hits']
+        second = self.app.get(url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(server.RESPONSE_CACHE.stats()['hits'], hits + 1)
+        resp = self.app.put(url, json={'name': 'fido', 'customer_id': '7'},
+                            content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json()['customer_id'], '7')
+        self.assertNotEqual(resp.headers['ETag'], first.headers['ETag'])
+
+    def test_lookup_wishlists(self):
+        """ Look up several Wishlists by id in one request """
+        fido = self.get_wishlist('fido')[0]
+        bags = self.get_wishlist('bags')[0]
+        resp = self.app.post('/wishlists/_lookup',
+                             json={'ids': [bags['id'], 'missing', fido['id'], bags['id']]},
+                             content_type='application/json')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([wishlist['name'] for wishlist in data['wishlists']],
+                         ['bags', 'fido'])
+        self.assertEqual(data['wishlists'][1], fido)
+        self.assertEqual(data['missing'], ['missing'])
+
+    def test_lookup_wishlists_bad_request(self):
+        """ Refuse a lookup without a list of ids """
+        for body in ({'ids': 'abc'}, ['abc'], {'ids': [1]}, {'ids': ['a'] * 1001}):
+            resp = self.app.post('/wishlists/_lookup', json=body,
+                                 content_type='application/json')
+            self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+        resp = self.app.post('/wishlists/_lookup', data='ids=a')
+        self.assertEqual(resp.status_code, HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_get_wishlist_stats(self):
+        """ Get the number of Wishlists and the top customers """
+        server.data_load({"name": "kitty", "customer_id": "2"})
+        resp = self.app.get('/wishlists/stats', query_string='top=1')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['customers'], 2)
+        self.assertEqual(data['per_customer'], {'min': 1, 'max': 2, 'mean': 1.5})
+        self.assertEqual(data['top_customers'], [{'customer_id': '2', 'count': 2}])
+        resp = self.app.get('/wishlists/stats', query_string='top=-1')
+        self.assertEqual(resp.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_count_customer_wishlists(self):
+        """ Count the Wishlists of a customer """
+        resp = self.app.get('/customers/1/wishlists/count')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {'customer_id': '1', 'count': 1})
+        resp = self.app.get('/customers/99/wishlists/count')
+        self.assertEqual(resp.get_json()['count'], 0)
+
+    def test_healthcheck(self):
+        """ Report a closed circuit as healthy """
+        resp = self.app.get('/healthcheck')
+        self.assertEqual(resp.status_code, HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data['message'], 'Healthy')
+        self.assertEqual(data['circuit']['state'], 'closed')
+
+    def test_circuit_open(self):
+        """ Fail fast with 503 while the database is unavailable """
+        self.open_circuit()
+        resp = self.app.get('/healthcheck')
+        self.assertEqual(resp.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.get_json()['circuit']['state'], 'open')
+        self.assertIn('Retry-After', resp.headers)
+        resp = self.app.get('/wishlists/missing')
+        self.assertEqual(resp.status_code, HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertGreater(int(resp.headers['Retry-After']), 0)
+        self.assertEqual(resp.get_json()['error'], 'Service Unavailable')
 
 ######################################################################
 # Utility functions
@@ -221,6 +581,14 @@ class TestWishlistServer(unittest.TestCase):
         data = resp.get_json()
         return len(data)
 
+    def open_circuit(self):
+        """ fails database calls until the circuit breaker opens """
+        breaker = resilience.policy.breaker
+        def unreachable():
+            raise ConnectionError('database is down')
+        for _ in range(breaker.threshold):
+            self.assertRaises(ConnectionError, breaker.call, unreachable)
+
 
 ######################################################################
 #   M A I N
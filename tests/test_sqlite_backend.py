@@ -0,0 +1,226 @@
+# Copyright 2016, 2017 John J. Rofrano. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SQLite Backend Test Suite
+
+Test cases can be run with the following:
+nosetests -v --with-spec --spec-color
+"""
+
+import shutil
+import tempfile
+import threading
+import unittest
+from mock import patch
+from app.backends import get_backend, SQLiteBackend
+from app.models import Wishlist, DataConflictError, DataValidationError
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestSQLiteBackend(unittest.TestCase):
+    """ Test Cases for the SQLite storage backend """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.patcher = patch('app.models.SQLITE_DIR', self.directory)
+        self.patcher.start()
+        self.backend = SQLiteBackend()
+        self.backend.connect('test')
+        self.backend.create_indexes()
+
+    def tearDown(self):
+        self.backend.disconnect()
+        self.patcher.stop()
+        shutil.rmtree(self.directory)
+
+    def test_get_backend(self):
+        """ The sqlite backend is picked by name """
+        self.assertIsInstance(get_backend('sqlite'), SQLiteBackend)
+
+    def test_wal_mode(self):
+        """ The database runs in WAL mode """
+        mode = self.backend.connection().execute('PRAGMA journal_mode').fetchone()[0]
+        self.assertEqual(mode, 'wal')
+
+    def test_indexes(self):
+        """ Lookups on customer_id and name use an index """
+        conn = self.backend.connection()
+        for column in ('customer_id', 'name'):
+            plan = conn.execute('EXPLAIN QUERY PLAN SELECT doc FROM wishlists '
+                                'WHERE {} = ?'.format(column), ('1',)).fetchall()
+            self.assertIn('INDEX', ' '.join(str(row) for row in plan))
+
+    def test_create_and_get(self):
+        """ Create a document and read it back """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        self.assertEqual(self.backend.get(doc['_id']), doc)
+        self.assertEqual(self.backend.revision(doc['_id']), doc['_rev'])
+        self.assertIsNone(self.backend.create(doc))
+        self.assertIsNone(self.backend.get('missing'))
+        self.assertIsNone(self.backend.revision('missing'))
+
+    def test_update_checks_revision(self):
+        """ Updates must be made against the current revision """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        doc['name'] = 'kitty'
+        rev = self.backend.update(doc)
+        self.assertTrue(rev.startswith('2-'))
+        self.assertRaises(DataConflictError, self.backend.update, doc)
+        self.assertEqual(self.backend.get(doc['_id'])['name'], 'kitty')
+
+    def test_delete(self):
+        """ Delete a document """
+        doc = self.backend.create({'name': 'fido', 'customer_id': '1'})
+        self.backend.delete(doc['_id'])
+        self.assertIsNone(self.backend.get(doc['_id']))
+
+    def test_bulk_save_and_delete(self):
+        """ Bulk writes report conflicts per document """
+        rows = self.backend.bulk_save([{'_id': 'a', 'name': 'fido'},
+                                       {'_id': 'b', 'name': 'kitty'}])
+        self.assertEqual([row['id'] for row in rows], ['a', 'b'])
+        rows = self.backend.bulk_save([{'_id': 'a', 'name': 'rex'},
+                                       {'_id': 'b', '_rev': rows[1]['rev'], 'name': 'tom'}])
+        self.assertEqual(rows[0]['error'], 'conflict')
+        self.assertEqual(self.backend.get('b')['name'], 'tom')
+        docs = [{'_id': 'a', '_rev': self.backend.revision('a')},
+                {'_id': 'b', '_rev': 'stale'}]
+        self.assertEqual(self.backend.bulk_delete(docs), 1)
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_bulk_save_with_duplicate_id(self):
+        """ A second document with the same _id in a batch is a conflict """
+        self.backend.create({'_id': 'b', 'name': 'bags'})
+        rows = self.backend.bulk_save([{'_id': 'a', 'name': 'fido'},
+                                       {'_id': 'a', 'name': 'rex'},
+                                       {'_id': 'b', 'name': 'kitty'},
+                                       {'_id': 'c', 'name': 'tom'}])
+        self.assertEqual(rows[0]['id'], 'a')
+        self.assertIn('rev', rows[0])
+        self.assertEqual(rows[1], {'id': 'a', 'error': 'conflict',
+                                   'reason': 'Document update conflict.'})
+        self.assertEqual(rows[2]['error'], 'conflict')
+        self.assertIn('rev', rows[3])
+        self.assertEqual(self.backend.get('a')['name'], 'fido')
+        self.assertEqual(self.backend.get('b')['name'], 'bags')
+        self.assertEqual(self.backend.get('c')['name'], 'tom')
+
+    def test_failed_transaction_rolls_back(self):
+        """ Nothing from a failed transaction is kept """
+        try:
+            with self.backend.transaction() as conn:
+                conn.execute("INSERT INTO wishlists VALUES ('a', '1-a', 'n', 'c', '{}')")
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_page_all(self):
+        """ Page through every document in id order """
+        for doc_id in 'edcba':
+            self.backend.create({'_id': doc_id, 'name': doc_id})
+        docs, next_key = self.backend.page_all(2)
+        self.assertEqual([doc['_id'] for doc in docs], ['a', 'b'])
+        self.assertEqual(next_key, 'c')
+        docs, next_key = self.backend.page_all(3, next_key, include_docs=False)
+        self.assertEqual([doc['_id'] for doc in docs], ['c', 'd', 'e'])
+        self.assertIsNone(next_key)
+
+    def test_find(self):
+        """ Query with column and document conditions """
+        for number in range(5):
+            self.backend.create({'name': 'list', 'customer_id': str(number),
+                                 'color': 'red' if number % 2 else 'blue'})
+        docs, _ = self.backend.find({'customer_id': {'$gte': '3'}})
+        self.assertEqual(len(docs), 2)
+        docs, _ = self.backend.find({'customer_id': {'$in': ['1', '4']}})
+        self.assertEqual(len(docs), 2)
+        docs, _ = self.backend.find({'name': 'list', 'color': 'red'})
+        self.assertEqual(sorted(doc['customer_id'] for doc in docs), ['1', '3'])
+        self.assertRaises(DataValidationError, self.backend.find,
+                          {'customer_id': {'$regex': '.*'}})
+
+    def test_bookmark_survives_deletes(self):
+        """ Deleting the documents of a page does not skip the next one """
+        for name in ['a', 'b', 'c', 'd', 'e']:
+            self.backend.create({'_id': name, 'name': name, 'customer_id': '1'})
+        docs, bookmark = self.backend.find({'customer_id': '1'}, limit=2)
+        self.assertEqual([doc['_id'] for doc in docs], ['a', 'b'])
+        self.backend.bulk_delete(docs)
+        docs, bookmark = self.backend.find({'customer_id': '1'}, limit=2, bookmark=bookmark)
+        self.assertEqual([doc['_id'] for doc in docs], ['c', 'd'])
+        docs, bookmark = self.backend.find({}, sort_keys=['name'], direction='desc', limit=2)
+        self.assertEqual([doc['_id'] for doc in docs], ['e', 'd'])
+        docs, _ = self.backend.find({}, sort_keys=['name'], direction='desc', limit=2,
+                                    bookmark=bookmark)
+        self.assertEqual([doc['_id'] for doc in docs], ['c'])
+
+    def test_find_with_too_many_values(self):
+        """ $in lists longer than SQLite takes are a validation error """
+        self.backend.create({'name': 'fido', 'customer_id': '1'})
+        values = [str(number) for number in range(1000)]
+        self.assertRaises(DataValidationError, self.backend.find,
+                          {'customer_id': {'$in': values}})
+        docs, _ = self.backend.find({'customer_id': {'$in': values[:900]}})
+        self.assertEqual(len(docs), 1)
+
+    def test_find_pages_sorts_and_projects(self):
+        """ Query results can be sorted, projected and paged """
+        for name in ['b', 'd', 'a', 'c']:
+            self.backend.create({'name': name, 'customer_id': '1'})
+        docs, bookmark = self.backend.find({}, fields=['_id', 'name'], sort_keys=['name'],
+                                           direction='desc', limit=3)
+        self.assertEqual([doc['name'] for doc in docs], ['d', 'c', 'b'])
+        self.assertNotIn('customer_id', docs[0])
+        docs, bookmark = self.backend.find({}, sort_keys=['name'], direction='desc',
+                                           limit=3, bookmark=bookmark)
+        self.assertEqual([doc['name'] for doc in docs], ['a'])
+        self.assertIsNone(bookmark)
+        docs, _ = self.backend.find({}, sort_keys=['name'], skip=1)
+        self.assertEqual([doc['name'] for doc in docs], ['b', 'c', 'd'])
+        self.assertRaises(DataValidationError, self.backend.find, {}, limit=2,
+                          bookmark='bogus')
+
+    def test_connection_per_thread(self):
+        """ Every thread gets its own connection """
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(self.backend.connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(connections[0], self.backend.connection())
+        self.assertEqual(len(self.backend.connections), 2)
+
+    def test_wishlist_model(self):
+        """ The Wishlist model can run on the sqlite backend """
+        with patch('app.models.WISHLIST_BACKEND', 'sqlite'):
+            Wishlist.init_db('test')
+        self.assertIsInstance(Wishlist.backend, SQLiteBackend)
+        Wishlist.remove_all()
+        Wishlist.save_many([Wishlist('fido', '1'), Wishlist('kitty', '2')])
+        wishlists = Wishlist.find_by(customer_id='2')
+        self.assertEqual(len(wishlists), 1)
+        wishlists[0].name = 'tom'
+        wishlists[0].save()
+        self.assertEqual(Wishlist.find(wishlists[0].id, cached=False).name, 'tom')
+        self.assertEqual(Wishlist.remove_all(), 2)
+        Wishlist.disconnect()
+
+
+######################################################################
+#   M A I N
+######################################################################
+if __name__ == '__main__':
+    unittest.main()
@@ -22,9 +22,13 @@ nosetests -v --with-spec --spec-color
 # import os
 # import json
 import unittest
+import threading
 from mock import MagicMock, patch
 from requests import HTTPError, ConnectionError
-from app.models import Wishlist, DataValidationError
+from app.models import Wishlist, DataValidationError, QueryIndexError, DataConflictError
+from app.models import CLOUDANT_POOL_SIZE, CACHE_SIZE
+from app import resilience
+from app.resilience import RetryPolicy, CircuitBreaker
 
 VCAP_SERVICES = {
     'cloudantNoSQLDB': [
@@ -50,6 +54,12 @@ class TestWishlists(unittest.TestCase):
         Wishlist.init_db("test")
         Wishlist.remove_all()
 
+    @staticmethod
+    def use_cache():
+        """ Turns the cache on whether or not a follower is running """
+        with patch('app.models.CACHE_WITHOUT_FOLLOWER', True):
+            Wishlist.init_db("test")
+
     def test_create_a_wishlist(self):
         """ Create a wishlist and assert that it exists """
         wishlist = Wishlist("fido", "1")
@@ -90,6 +100,28 @@ class TestWishlists(unittest.TestCase):
         self.assertEqual(wishlists[0].customer_id, "k9")
         self.assertEqual(wishlists[0].name, "fido")
 
+    def test_update_carries_revision(self):
+        """ Update a Wishlist and track its revision """
+        wishlist = Wishlist("fido", "1")
+        wishlist.save()
+        self.assertIsNotNone(wishlist.rev)
+        first_rev = wishlist.rev
+        wishlist.customer_id = "k9"
+        wishlist.save()
+        self.assertNotEqual(wishlist.rev, first_rev)
+        self.assertEqual(Wishlist.find(wishlist.id, cached=False).rev, wishlist.rev)
+
+    def test_update_with_stale_revision(self):
+        """ Update a Wishlist that was changed by someone else """
+        wishlist = Wishlist("fido", "1")
+        wishlist.save()
+        stale = Wishlist.find(wishlist.id)
+        wishlist.customer_id = "k9"
+        wishlist.save()
+        stale.customer_id = "cat"
+        self.assertRaises(DataConflictError, stale.update)
+        self.assertEqual(Wishlist.find(wishlist.id).customer_id, "k9")
+
     def test_delete_a_wishlist(self):
         """ Delete a Wishlist """
         wishlist = Wishlist("fido", "1")
@@ -111,6 +143,23 @@ class TestWishlists(unittest.TestCase):
         self.assertEqual(data['customer_id'], "1")
 
 
+    def test_serialize_a_document(self):
+        """ Serialize a stored document like the Wishlist read from it """
+        document = {"_id": "123", "_rev": "1-abc", "name": "fido", "customer_id": "1"}
+        self.assertEqual(Wishlist.serialize_document(document),
+                         Wishlist.from_document(document).serialize())
+        for fields in (["id"], ["name", "id"], ["customer_id"]):
+            self.assertEqual(Wishlist.serialize_document(document, fields),
+                             Wishlist.from_document(document).serialize(fields))
+        self.assertEqual(Wishlist.serialize_document({"name": "fido"}),
+                         {"name": "fido", "customer_id": None})
+
+    def test_wishlist_has_no_dict(self):
+        """ Wishlists keep their attributes in slots """
+        wishlist = Wishlist("fido", "1")
+        self.assertFalse(hasattr(wishlist, '__dict__'))
+        self.assertRaises(AttributeError, setattr, wishlist, 'color', 'red')
+
     def test_deserialize_a_wishlist(self):
         """ Deserialize a Wishlist """
         data = {"name": "Bags", "customer_id": "1"}
@@ -137,6 +186,16 @@ class TestWishlists(unittest.TestCase):
         wishlist = Wishlist()
         self.assertRaises(DataValidationError, wishlist.deserialize, "string data")
 
+    def test_deserialize_with_non_scalar_fields(self):
+        """ Deserialize a Wishlist whose fields are lists or objects """
+        wishlist = Wishlist()
+        self.assertRaises(DataValidationError, wishlist.deserialize,
+                          {"name": "x", "customer_id": [1]})
+        self.assertRaises(DataValidationError, wishlist.deserialize,
+                          {"name": {"first": "x"}, "customer_id": "1"})
+        wishlist.deserialize({"name": "x", "customer_id": 7})
+        self.assertEqual(wishlist.customer_id, 7)
+
     def test_save_a_wishlist_with_no_name(self):
         """ Save a Wishlist with no name """
         wishlist = Wishlist(None, "1")
@@ -157,6 +216,109 @@ class TestWishlists(unittest.TestCase):
         self.assertEqual(wishlist.id, saved_wishlist.id)
         self.assertEqual(wishlist.name, "Bags")
 
+    def test_find_uses_cache(self):
+        """ Find a Wishlist by id twice and hit the cache """
+        self.use_cache()
+        saved_wishlist = Wishlist("Bags", "1")
+        saved_wishlist.save()
+        Wishlist.find(saved_wishlist.id)
+        hits = Wishlist.cache.stats()['hits']
+        wishlist = Wishlist.find(saved_wishlist.id)
+        self.assertEqual(wishlist.name, "Bags")
+        self.assertEqual(Wishlist.cache.stats()['hits'], hits + 1)
+        # updates refresh the cached copy and deletes drop it
+        wishlist.name = "Shoes"
+        wishlist.save()
+        self.assertEqual(Wishlist.find(wishlist.id).name, "Shoes")
+        wishlist.delete()
+        self.assertNotIn(wishlist.id, Wishlist.cache)
+        self.assertIsNone(Wishlist.find(wishlist.id))
+
+    def test_cache_needs_a_follower(self):
+        """ Wishlists are only cached when other writers cannot be missed """
+        backend_class = type(Wishlist.backend)
+        with patch.object(backend_class, 'shared', True), \
+                patch('app.models.CHANGES_FOLLOWER', False):
+            Wishlist.init_db("test")
+            self.assertEqual(Wishlist.cache.maxsize, 0)
+            self.use_cache()
+            self.assertEqual(Wishlist.cache.maxsize, CACHE_SIZE)
+        with patch.object(backend_class, 'shared', False):
+            Wishlist.init_db("test")
+            self.assertEqual(Wishlist.cache.maxsize, CACHE_SIZE)
+
+    def test_find_many(self):
+        """ Find several Wishlists by id in one read """
+        self.use_cache()
+        fido = Wishlist("fido", "1")
+        fido.save()
+        kitty = Wishlist("kitty", "2")
+        kitty.save()
+        Wishlist.find(fido.id)
+        wishlists, missing = Wishlist.find_many([kitty.id, "missing", fido.id, kitty.id])
+        self.assertEqual([wishlist.name for wishlist in wishlists], ["kitty", "fido"])
+        self.assertEqual(wishlists[0].rev, kitty.rev)
+        self.assertEqual(missing, ["missing"])
+        self.assertIn(kitty.id, Wishlist.cache)
+        self.assertEqual(Wishlist.find_many([]), ([], []))
+        kitty.delete()
+        wishlists, missing = Wishlist.find_many([kitty.id, fido.id], cached=False)
+        self.assertEqual([wishlist.id for wishlist in wishlists], [fido.id])
+        self.assertEqual(missing, [kitty.id])
+
+    def test_count(self):
+        """ Count all Wishlists and those of a customer """
+        Wishlist("fido", "1").save()
+        Wishlist("kitty", "1").save()
+        Wishlist("Bags", "2").save()
+        self.assertEqual(Wishlist.count(), 3)
+        self.assertEqual(Wishlist.count("1"), 2)
+        self.assertEqual(Wishlist.count("3"), 0)
+
+    def test_stats(self):
+        """ Summarize the Wishlists of every customer """
+        self.assertEqual(Wishlist.stats()['total'], 0)
+        for name, customer_id in (("a", "1"), ("b", "2"), ("c", "2"), ("d", "3"), ("e", "3")):
+            Wishlist(name, customer_id).save()
+        with patch.object(Wishlist.backend, 'count') as count_mock:
+            stats = Wishlist.stats(top=2)
+        count_mock.assert_not_called()
+        self.assertEqual(stats['total'], 5)
+        self.assertEqual(stats['customers'], 3)
+        self.assertEqual(stats['per_customer'], {'min': 1, 'max': 2, 'mean': 1.67})
+        # ties are broken by customer_id
+        self.assertEqual(stats['top_customers'], [{'customer_id': '2', 'count': 2},
+                                                  {'customer_id': '3', 'count': 2}])
+
+    def test_warm_cache(self):
+        """ Read the first Wishlists into the cache """
+        self.use_cache()
+        fido = Wishlist("fido", "1")
+        fido.save()
+        Wishlist("Bags", "2").save()
+        Wishlist.cache.clear()
+        self.assertEqual(Wishlist.warm_cache(), 2)
+        self.assertIn(fido.id, Wishlist.cache)
+        Wishlist.cache.clear()
+        self.assertEqual(Wishlist.warm_cache(1), 1)
+        self.assertEqual(len(Wishlist.cache), 1)
+        self.assertEqual(Wishlist.warm_cache(0), 0)
+
+    def test_revision(self):
+        """ Read the revision of a Wishlist """
+        wishlist = Wishlist("Bags", "1")
+        wishlist.save()
+        self.assertEqual(Wishlist.revision(wishlist.id), wishlist.rev)
+        self.assertIsNone(Wishlist.revision("missing"))
+
+    def test_revisions(self):
+        """ Read the ids and revisions of matching Wishlists """
+        fido = Wishlist("fido", "1")
+        fido.save()
+        Wishlist("Bags", "2").save()
+        revisions = list(Wishlist.revisions(customer_id="1"))
+        self.assertEqual(revisions, [(fido.id, fido.rev)])
+
     def test_find_with_no_wishlists(self):
         """ Find a Wishlist with empty database """
         wishlist = Wishlist.find("1")
@@ -186,7 +348,264 @@ class TestWishlists(unittest.TestCase):
         self.assertEqual(wishlists[0].customer_id, "1")
         self.assertEqual(wishlists[0].name, "fido")
 
+    def test_find_by_several_values(self):
+        """ Find Wishlists whose field has any of several values """
+        Wishlist("fido", "1").save()
+        Wishlist("kitty", "2").save()
+        Wishlist("Bags", "3").save()
+        wishlists = Wishlist.find_by(customer_id=["1", "3"], sort=['name'])
+        self.assertEqual([wishlist.name for wishlist in wishlists], ["Bags", "fido"])
+        wishlists = Wishlist.find_by(customer_id={'$in': ["2"]})
+        self.assertEqual([wishlist.name for wishlist in wishlists], ["kitty"])
+
+    def test_find_by_and(self):
+        """ Find Wishlists that match every selector in $and """
+        Wishlist("fido", "1").save()
+        Wishlist("kitty", "1").save()
+        Wishlist("fido", "2").save()
+        wishlists = Wishlist.find_by(**{'$and': [{'customer_id': ["1", "2"]},
+                                                 {'name': 'fido'},
+                                                 {'customer_id': {'$in': ["1", "3"]}}]})
+        self.assertEqual(len(wishlists), 1)
+        self.assertEqual(wishlists[0].customer_id, "1")
+        self.assertEqual(wishlists[0].name, "fido")
+        self.assertRaises(DataValidationError, Wishlist.find_by, **{'$and': {'name': 'fido'}})
+        self.assertRaises(DataValidationError, Wishlist.find_by, **{'$or': []})
+
+    def test_parse_selector(self):
+        """ Selectors are turned into one condition per field """
+        self.assertEqual(Wishlist.parse_selector({'name': 'fido', 'customer_id': ['1']}),
+                         {'name': 'fido', 'customer_id': '1'})
+        self.assertEqual(Wishlist.parse_selector({'customer_id': ('1', '2')}),
+                         {'customer_id': {'$in': ['1', '2']}})
+        self.assertEqual(Wishlist.parse_selector({'$and': [{'name': {'$gte': 'a'}},
+                                                           {'name': 'fido'}]}),
+                         {'name': {'$gte': 'a', '$eq': 'fido'}})
+        self.assertEqual(Wishlist.parse_selector({'$and': [{'name': ['a', 'b', 'c']},
+                                                           {'name': ['c', 'a']}]}),
+                         {'name': {'$in': ['a', 'c']}})
+        self.assertRaises(DataValidationError, Wishlist.parse_selector,
+                          {'$and': [{'name': 'fido'}, {'name': 'kitty'}]})
+
+    def test_create_retries_server_errors(self):
+        """ Create is retried on 503 and the breaker counts the failures """
+        response = MagicMock(status_code=503, headers={})
+        breaker = CircuitBreaker(threshold=100)
+        policy = RetryPolicy(tries=2, delay=0, jitter=False, sleep=lambda seconds: None,
+                             breaker=breaker)
+        self.addCleanup(resilience.configure, resilience.policy)
+        resilience.configure(policy)
+        create = Wishlist.backend.create
+        errors = [HTTPError(response=response)]
+        def flaky_create(doc):
+            if errors:
+                raise errors.pop()
+            return create(doc)
+        with patch.object(Wishlist.backend, 'create', side_effect=flaky_create) as create_mock:
+            wishlist = Wishlist("fido", "1")
+            wishlist.create()
+        self.assertIsNotNone(wishlist.id)
+        self.assertEqual(create_mock.call_count, 2)
+        with patch.object(Wishlist.backend, 'create',
+                          side_effect=HTTPError(response=response)):
+            self.assertRaises(HTTPError, Wishlist("kitty", "1").create)
+        self.assertEqual(breaker.failures, 2)
+
+    def test_find_by_retries_one_page(self):
+        """ A failed page is retried without reading the earlier pages again """
+        for number in range(3):
+            Wishlist("list{}".format(number), "1").save()
+        response = MagicMock(status_code=429, headers={})
+        find = Wishlist.backend.find
+        calls = []
+        def flaky_find(*args, **kwargs):
+            calls.append(kwargs.get('bookmark'))
+            if len(calls) == 2:
+                raise HTTPError(response=response)
+            return find(*args, **kwargs)
+        policy = RetryPolicy(tries=3, delay=0, jitter=False, sleep=lambda seconds: None,
+                             breaker=CircuitBreaker(threshold=100))
+        self.addCleanup(resilience.configure, resilience.policy)
+        resilience.configure(policy)
+        with patch('app.models.PAGE_SIZE', 2), \
+                patch.object(Wishlist.backend, 'find', side_effect=flaky_find):
+            wishlists = Wishlist.find_by_customer_id("1")
+        self.assertEqual(len(wishlists), 3)
+        self.assertEqual(len(calls), 3)
+        self.assertIsNone(calls[0])
+        self.assertIsNotNone(calls[1])
+        self.assertEqual(calls[2], calls[1])
+
+    def test_find_by_with_fields_sort_and_limit(self):
+        """ Find Wishlists with a projection, sort order and limit """
+        Wishlist("fido", "1").save()
+        Wishlist("kitty", "1").save()
+        Wishlist("Bags", "1").save()
+        Wishlist("Shoes", "2").save()
+        wishlists = Wishlist.find_by(fields=['id', 'name'], sort=['-name'],
+                                     limit=2, customer_id="1")
+        self.assertEqual([wishlist.name for wishlist in wishlists], ["kitty", "fido"])
+        self.assertIsNone(wishlists[0].customer_id)
+        self.assertEqual(wishlists[0].serialize(['name']), {'name': 'kitty'})
+        wishlists = Wishlist.find_by(sort=['name'], skip=1, customer_id="1")
+        self.assertEqual([wishlist.name for wishlist in wishlists], ["fido", "kitty"])
+
+    def test_find_by_with_bad_sort(self):
+        """ Find Wishlists sorted by an unknown field """
+        self.assertRaises(DataValidationError, Wishlist.find_by, sort=['color'])
+        self.assertRaises(DataValidationError, Wishlist.find_by, sort=['name', '-customer_id'])
+        self.assertRaises(DataValidationError, Wishlist.find_by, fields=['color'])
+
+    def test_page_through_wishlists(self):
+        """ Page through all Wishlists with a cursor """
+        Wishlist("fido", "1").save()
+        Wishlist("kitty", "1").save()
+        Wishlist("Bags", "2").save()
+        wishlists, cursor = Wishlist.page(2)
+        self.assertEqual(len(wishlists), 2)
+        self.assertIsNotNone(cursor)
+        more, cursor = Wishlist.page(2, cursor)
+        self.assertEqual(len(more), 1)
+        self.assertIsNone(cursor)
+        names = [wishlist.name for wishlist in wishlists + more]
+        self.assertItemsEqual(names, ["fido", "kitty", "Bags"])
+
+    def test_page_with_bad_cursor(self):
+        """ Page with a cursor that was not handed out """
+        Wishlist("fido", "1").save()
+        self.assertRaises(DataValidationError, Wishlist.page, 2, 'bogus', customer_id="1")
+        self.assertRaises(DataValidationError, Wishlist.page, 2, '-1', customer_id="1")
+
+    @patch('app.backends.cloudant_backend.Query')
+    def test_cloudant_bad_bookmark(self, query_mock):
+        """ Cloudant rejecting a bookmark is a validation error """
+        from app.backends.cloudant_backend import CloudantBackend
+        response = MagicMock(status_code=400)
+        query_mock.return_value.side_effect = HTTPError(response=response)
+        backend = CloudantBackend()
+        backend.database = MagicMock()
+        self.assertRaises(DataValidationError, backend.find, {'_id': {'$gt': None}},
+                          limit=2, bookmark='bogus')
+        self.assertRaises(HTTPError, backend.find, {'_id': {'$gt': None}}, limit=2)
+
+    @patch('app.models.CLOUDANT_TIMEOUT', 30)
+    def test_cloudant_changes_heartbeat(self):
+        """ Changes feed heartbeats come well inside the read timeout """
+        from app.backends.cloudant_backend import CloudantBackend
+        backend = CloudantBackend()
+        backend.database = MagicMock()
+        follower = backend.changes_follower(Wishlist.cache)
+        self.assertEqual(follower.heartbeat, 15000)
+
+    def test_cloudant_get_many_skips_design_docs(self):
+        """ Reading several ids never returns a design document """
+        from app.backends.cloudant_backend import CloudantBackend
+        backend = CloudantBackend()
+        backend.database = MagicMock()
+        backend.database.all_docs.return_value = {'rows': [
+            {'key': '1', 'doc': {'_id': '1', 'name': 'fido'}},
+            {'key': '_design/stats', 'doc': {'_id': '_design/stats', 'views': {}}},
+            {'key': '2', 'error': 'not_found'}]}
+        self.assertEqual(backend.get_many(['1', '_design/stats', '2']),
+                         [{'_id': '1', 'name': 'fido'}, None, None])
+
+    def test_cloudant_in_has_no_index(self):
+        """ A $in condition does not pick an index """
+        from app.backends.cloudant_backend import CloudantBackend
+        backend = CloudantBackend()
+        self.assertIsNone(backend.index_for({'name': {'$in': ['a', 'b']}}))
+        self.assertEqual(backend.index_for({'name': {'$gt': 'a'}}),
+                         '_design/wishlists-name')
+
+    @patch('app.backends.cloudant_backend.Query')
+    def test_cloudant_find_by_customers(self, query_mock):
+        """ Several customer_ids are read from the by_customer view """
+        from app.backends.cloudant_backend import CloudantBackend
+        backend = CloudantBackend()
+        backend.database = MagicMock()
+        rows = [{'doc': {'_id': str(i), 'name': name, 'customer_id': customer}}
+                for i, (name, customer) in enumerate([('b', '1'), ('a', '2'), ('c', '1')])]
+        rows.append({'doc': None})
+        backend.database.get_view_result.return_value = {'rows': rows}
+        selector = {'customer_id': {'$in': ['1', '2', '1']}, 'name': {'$ne': 'c'}}
+        docs, bookmark = backend.find(selector, fields=['name'], sort_keys=['name'], limit=1)
+        self.assertEqual(docs, [{'name': 'a'}])
+        docs, bookmark = backend.find(selector, sort_keys=['name'], limit=1,
+                                      bookmark=bookmark)
+        self.assertEqual([doc['name'] for doc in docs], ['b'])
+        kwargs = backend.database.get_view_result.call_args[1]
+        self.assertEqual(kwargs['keys'], ['1', '2'])
+        self.assertTrue(kwargs['include_docs'])
+        query_mock.assert_not_called()
+        self.assertEqual(backend.find({'customer_id': {'$in': []}}), ([], None))
+
+    def test_page_by_customer_id(self):
+        """ Page through Wishlists for a Customer_id """
+        Wishlist("fido", "1").save()
+        Wishlist("kitty", "1").save()
+        Wishlist("Bags", "2").save()
+        wishlists, cursor = Wishlist.page(5, customer_id="1")
+        self.assertEqual(len(wishlists), 2)
+        self.assertIsNone(cursor)
+        for wishlist in wishlists:
+            self.assertEqual(wishlist.customer_id, "1")
+
+    def test_iter_all(self):
+        """ Iterate over all Wishlists """
+        Wishlist("fido", "1").save()
+        Wishlist("Bags", "2").save()
+        wishlists = Wishlist.iter_all()
+        self.assertNotIsInstance(wishlists, list)
+        names = [wishlist.name for wishlist in wishlists]
+        self.assertItemsEqual(names, ["fido", "Bags"])
+
+    def test_iter_by_customer_id(self):
+        """ Iterate over Wishlists by Customer_id """
+        Wishlist("fido", "1").save()
+        Wishlist("Bags", "2").save()
+        wishlists = list(Wishlist.iter_by(customer_id="2"))
+        self.assertEqual(len(wishlists), 1)
+        self.assertEqual(wishlists[0].name, "Bags")
+
+    def test_save_many_wishlists(self):
+        """ Save a list of Wishlists in batches """
+        wishlists = [Wishlist("list{}".format(i), "1") for i in range(5)]
+        wishlists.append(Wishlist(None, "2"))
+        results = Wishlist.save_many(wishlists, batch_size=2)
+        self.assertEqual(len(results), 6)
+        for wishlist, result in zip(wishlists[:5], results[:5]):
+            self.assertIsNotNone(wishlist.id)
+            self.assertEqual(result['id'], wishlist.id)
+        self.assertIn('error', results[5])
+        self.assertIsNone(wishlists[5].id)
+        self.assertEqual(len(Wishlist.all()), 5)
+
+    def test_delete_where(self):
+        """ Delete the Wishlists that match a selector """
+        Wishlist("fido", "1").save()
+        Wishlist("kitty", "1").save()
+        Wishlist("Bags", "2").save()
+        count = Wishlist.delete_where(customer_id="1")
+        self.assertEqual(count, 2)
+        wishlists = Wishlist.all()
+        self.assertEqual(len(wishlists), 1)
+        self.assertEqual(wishlists[0].name, "Bags")
+
+    def test_delete_where_more_than_a_batch(self):
+        """ Delete more matching Wishlists than fit in one bulk request """
+        Wishlist.save_many([Wishlist("list{}".format(i), "1") for i in range(35)])
+        Wishlist("Bags", "2").save()
+        with patch('app.models.BULK_BATCH_SIZE', 10):
+            count = Wishlist.delete_where(customer_id="1")
+        self.assertEqual(count, 35)
+        self.assertEqual(Wishlist.find_by(customer_id="1"), [])
+        self.assertEqual(len(Wishlist.all()), 1)
 
+    def test_remove_all(self):
+        """ Remove all of the Wishlists """
+        Wishlist.save_many([Wishlist("list{}".format(i), "1") for i in range(5)])
+        self.assertEqual(Wishlist.remove_all(), 5)
+        self.assertEqual(Wishlist.all(), [])
 
     def test_create_query_index(self):
         """ Test create query index """
@@ -194,6 +613,53 @@ class TestWishlists(unittest.TestCase):
         Wishlist("bags", "2").save()
         Wishlist.create_query_index('customer_id')
 
+    def test_create_indexes(self):
+        """ Test the declared indexes are created once """
+        Wishlist.create_indexes()
+        Wishlist.create_indexes()
+        response = Wishlist.backend.database.get_query_indexes(raw_result=True)
+        ddocs = [index['ddoc'] for index in response['indexes']]
+        for ddoc in ('_design/wishlists-customer_id', '_design/wishlists-name',
+                     '_design/wishlists-customer_id-name'):
+            self.assertEqual(ddocs.count(ddoc), 1)
+
+    def test_create_views(self):
+        """ Test the stats design document is installed and upgraded """
+        from app.backends import cloudant_backend
+        document = Wishlist.backend.database['_design/wishlist-stats']
+        document.fetch()
+        self.assertEqual(document['version'], cloudant_backend.STATS_VERSION)
+        rev = document['_rev']
+        Wishlist.create_views()
+        document.fetch()
+        self.assertEqual(document['_rev'], rev)
+        with patch('app.backends.cloudant_backend.STATS_VERSION', 0):
+            Wishlist.create_views()
+        document.fetch()
+        self.assertNotEqual(document['_rev'], rev)
+        self.assertEqual(document['version'], 0)
+
+    def test_index_for(self):
+        """ Test picking the index for a selector """
+        self.assertEqual(Wishlist.backend.index_for({'name': 'fido'}),
+                         '_design/wishlists-name')
+        self.assertEqual(Wishlist.backend.index_for({'name': 'fido', 'customer_id': '1'}),
+                         '_design/wishlists-customer_id-name')
+        self.assertIsNone(Wishlist.backend.index_for({'color': 'red'}))
+
+    @patch('app.models.STRICT_INDEXES', True)
+    def test_find_by_without_index_in_strict_mode(self):
+        """ Test a query with no index raises in strict mode """
+        self.assertRaises(QueryIndexError, Wishlist.find_by, color='red')
+
+    def test_follow_changes(self):
+        """ Test starting and stopping the changes feed follower """
+        follower = Wishlist.follow_changes()
+        self.assertTrue(follower.is_alive())
+        self.assertIs(Wishlist.follow_changes(), follower)
+        Wishlist.stop_following()
+        self.assertIsNone(Wishlist.follower)
+
     def test_disconnect(self):
         """ Test Disconnet """
         Wishlist.disconnect()
@@ -234,6 +700,36 @@ class TestWishlists(unittest.TestCase):
         wishlist.create()
         wishlist.delete()
 
+    def test_connection_pool(self):
+        """ Test the client keeps a bounded pool of connections """
+        client = Wishlist.backend.client
+        adapter = client.r_session.get_adapter(client.server_url)
+        self.assertEqual(adapter._pool_maxsize, Wishlist.backend.pool_size())
+
+    def test_pool_size(self):
+        """ The changes feed follower gets a pooled connection of its own """
+        from app.backends.cloudant_backend import CloudantBackend
+        with patch('app.models.CHANGES_FOLLOWER', False):
+            self.assertEqual(CloudantBackend.pool_size(), CLOUDANT_POOL_SIZE)
+        with patch('app.models.CHANGES_FOLLOWER', True):
+            self.assertEqual(CloudantBackend.pool_size(), CLOUDANT_POOL_SIZE + 1)
+
+    def test_concurrent_saves(self):
+        """ Save Wishlists from several threads at once """
+        errors = []
+        def worker(number):
+            try:
+                Wishlist("list-%d" % number, str(number)).save()
+            except Exception as err: # pylint: disable=broad-except
+                errors.append(err)
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(Wishlist.all()), 8)
+
     @patch('cloudant.client.Cloudant.__init__')
     def test_connection_error(self, bad_mock):
         """ Test Connection error handler """